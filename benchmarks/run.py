@@ -0,0 +1,419 @@
+"""
+Benchmarks of the pipeline's hot paths on synthetic data, compared against a stored baseline.
+
+Cases, each at a small, medium and large size:
+
+- find_best_frame_interval / find_best_frame_adaptive: stage 02's search for the largest couch over
+  synthetic episodes of 20, 60 and 180 seconds, with the stand-in detector
+- adaptive_early_stop: the adaptive search stopping at its target in the first batch, while the decoding
+  thread has filled the prefetch queue with the rest of the round, which must return rather than hang
+- segmentation: SegmentationEngine and save_segmentation_outputs over 8, 32 and 96 frames, with the
+  stand-in segmenter
+- get_weighted_colors: masked dominant colours of segmented images at 360p, 720p and 1080p
+- colour_families: LUT family shares, as in scripts 09 and 10, over 10, 100 and 1000 images
+- composite: strip and grid composites of 100, 1,000 and 10,000 couches, as in scripts 07 to 10
+
+Every case also checks its output against the known answer of the synthetic data, so a change that
+gets faster by getting it wrong shows up as a failed check rather than an improvement. Run it from the
+repository root:
+
+    python benchmarks/run.py                          # everything, compared with benchmarks/baseline.json
+    python benchmarks/run.py composite --sizes small  # some cases and sizes only
+    python benchmarks/run.py --save-baseline          # make this run the new baseline
+
+Each run is written to benchmarks/results/<time>.json. The run exits with status 1 when a check fails
+or a case is slower than its baseline by more than the tolerance. Timings only compare across runs on
+the same machine; the baseline records the machine it was made on.
+
+The synthetic videos and images are generated once into --workdir and reused. When ultralytics is
+installed, the interval and adaptive cases call find_best_frame from 02-get-couch-image.py itself;
+otherwise they run the same DetectionEngine and adaptive_best_frame calls it is made of.
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+import matplotlib.colors as mcolors
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCHMARKS_DIR), "src")
+sys.path.insert(0, SRC_DIR)
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from colour_extraction import QUANTIZE_BITS, get_weighted_colors  # noqa: E402
+from colour_families import (HSV_FAMILIES, HUE_RANGES, build_family_lut, classify_hsv_families, family_shares,  # noqa: E402
+                             hue_range_classifier)
+from composite_renderer import grid_rows, palette_matrix, save_composite, strip_rows  # noqa: E402
+from detection_engine import DetectionEngine  # noqa: E402
+from frame_sampler import FrameSampler  # noqa: E402
+from frame_search import adaptive_best_frame  # noqa: E402
+from mask_codec import decode_mask, encode_mask  # noqa: E402
+from segmentation_engine import SegmentationEngine, save_segmentation_outputs  # noqa: E402
+from stand_ins import StandInDetector, StandInSegmenter  # noqa: E402
+import synthetic  # noqa: E402
+
+BASELINE_PATH = os.path.join(BENCHMARKS_DIR, "baseline.json")
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, "results")
+WORKDIR = os.path.join(tempfile.gettempdir(), "couch-benchmarks")
+REPEATS = 3
+TOLERANCE = 0.25  # Slowdown over the baseline median reported as a regression
+MIN_SLOWDOWN_SECONDS = 0.05  # Smaller slowdowns are timer noise, however large in relative terms
+
+COUCH_CLASS = "couch"
+CONFIDENCE_THRESHOLD = 0.7
+VIDEO_FPS = 25
+FRAME_INTERVAL = VIDEO_FPS  # One sample a second, so every synthetic shot is sampled at least twice
+QUANTIZE_BITS_SHIFT = 8 - QUANTIZE_BITS
+# Near-neutral couch greys, as RGB, which script 10's hue families must not call "Red"
+NEUTRAL_GREYS = [(120, 121, 123), (128, 128, 128), (74, 74, 74), (192, 192, 192), (141, 138, 134), (60, 62, 66)]
+EARLY_STOP_BATCH_SIZE = 2  # Prefetch batch and queue size of the early stop case
+EARLY_STOP_DELAY = 0.2  # Seconds per model call, long enough for the decoding thread to fill the queue meanwhile
+EARLY_STOP_TIMEOUT = 30  # Seconds after which the early stop case counts as hung
+
+
+def load_stage_02():
+    """02-get-couch-image.py as a module, or None when its dependencies (ultralytics) are not installed."""
+    spec = importlib.util.spec_from_file_location("get_couch_image", os.path.join(SRC_DIR, "02-get-couch-image.py"))
+    module = importlib.util.module_from_spec(spec)
+    try:
+        spec.loader.exec_module(module)
+    except ImportError:
+        return None
+    return module
+
+
+STAGE_02 = load_stage_02()
+
+
+# find_best_frame
+
+def prepare_video(workdir: str, seconds: int) -> dict:
+    path = os.path.join(workdir, f"episode_{seconds}s.mp4")
+    truth_path = path + ".json"
+    if os.path.exists(truth_path):
+        with open(truth_path, "r") as f:
+            truth = json.load(f)
+    else:
+        truth = synthetic.make_video(path, seconds=seconds, fps=VIDEO_FPS, seed=seconds)
+        with open(truth_path, "w") as f:
+            json.dump(truth, f)
+    return {**truth, "items": truth["frames"]}
+
+
+def interval_best_frame(video_path: str, model):
+    """The interval branch of stage 02's find_best_frame."""
+    engine = DetectionEngine(model, COUCH_CLASS, CONFIDENCE_THRESHOLD)
+    best_frame, largest_box_ratio = None, 0
+    for _, frame, box_ratio in engine.detect(FrameSampler(video_path, FRAME_INTERVAL)):
+        if box_ratio and box_ratio > largest_box_ratio:
+            best_frame, largest_box_ratio = frame, box_ratio
+    return best_frame, largest_box_ratio
+
+
+def adaptive_search(video_path: str, model):
+    """The adaptive branch of stage 02's find_best_frame."""
+    engine = DetectionEngine(model, COUCH_CLASS, CONFIDENCE_THRESHOLD)
+    best_frame, largest_box_ratio, _ = adaptive_best_frame(video_path, engine)
+    return best_frame, largest_box_ratio
+
+
+def run_find_best_frame(state: dict, search_mode: str):
+    if STAGE_02 is not None:
+        best_frame, largest_box_ratio, _ = STAGE_02.find_best_frame(state["path"], StandInDetector(), FRAME_INTERVAL,
+                                                                    search_mode=search_mode)
+        return largest_box_ratio
+    search = interval_best_frame if search_mode == "interval" else adaptive_search
+    return search(state["path"], StandInDetector())[1]
+
+
+def check_find_best_frame(state: dict, largest_box_ratio: float, min_share: float):
+    details = {"box_ratio": round(largest_box_ratio, 4), "expected_box_ratio": round(state["best_box_ratio"], 4)}
+    expected = state["best_box_ratio"]
+    return min_share * expected - 0.01 <= largest_box_ratio <= expected + 0.01, details
+
+
+# Segmentation
+
+def prepare_segmentation(workdir: str, images: int) -> dict:
+    frames = [synthetic.make_couch_frame((1280, 720), seed=seed) for seed in range(images)]
+    output_dir = os.path.join(workdir, f"segmentation_{images}")
+    return {"frames": frames, "output_dir": output_dir, "items": images}
+
+
+def run_segmentation(state: dict):
+    items = ((f"synthetic_{i}", image) for i, (image, _, _, _) in enumerate(state["frames"]))
+    engine = SegmentationEngine(StandInSegmenter())
+    masks = []
+    for video_id, image, couch_mask in engine.segment(items):
+        save_segmentation_outputs(video_id, image, couch_mask, segmented_dir=os.path.join(state["output_dir"], "segmented"),
+                                  hex_values_dir=os.path.join(state["output_dir"], "hex_values"))
+        masks.append(couch_mask)
+    return masks
+
+
+def check_segmentation(state: dict, masks: list):
+    ious = []
+    for (_, truth, _, _), mask in zip(state["frames"], masks):
+        found, truth = mask > 0, truth > 0
+        ious.append((found & truth).sum() / max((found | truth).sum(), 1))
+    return len(masks) == len(state["frames"]) and min(ious) > 0.95, {"min_iou": round(float(min(ious)), 4)}
+
+
+# Dominant colours
+
+def prepare_weighted_colors(workdir: str, size) -> dict:
+    images = []
+    for seed in range(10):
+        path = os.path.join(workdir, f"segmented_{size[0]}x{size[1]}_{seed}.jpg")
+        image, mask, colours, proportions = synthetic.make_segmented_image(size, seed=seed)
+        if not os.path.exists(path):
+            cv2.imwrite(path, cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+        images.append((path, encode_mask(mask), colours, proportions))
+    return {"images": images, "items": len(images)}
+
+
+def run_weighted_colors(state: dict):
+    return [get_weighted_colors(path, n_colors=5, mask=rle) for path, rle, _, _ in state["images"]]
+
+
+def check_weighted_colors(state: dict, palettes: list):
+    # The largest colour of every couch should come back as one of its dominant colours
+    errors = []
+    for (_, _, colours, _), (hex_colors, _) in zip(state["images"], palettes):
+        found = np.array([[int(hex_color[i:i + 2], 16) for i in (1, 3, 5)] for hex_color in hex_colors])
+        errors.append(np.linalg.norm(found - np.array(colours[0]), axis=1).min())
+    return max(errors) < 20, {"max_rgb_error": round(float(max(errors)), 2)}
+
+
+# Colour families
+
+def prepare_colour_families(workdir: str, images: int) -> dict:
+    # Cycle through a pool of ten images, the cost per image does not depend on which one it is
+    pool = [synthetic.make_segmented_image((1280, 720), seed=seed) for seed in range(10)]
+    return {"pool": [(image, encode_mask(mask), colours, proportions) for image, mask, colours, proportions in pool],
+            "items": images}
+
+
+def run_colour_families(state: dict):
+    lut = build_family_lut(classify_hsv_families)
+    pool = state["pool"]
+    return [family_shares(pool[i % len(pool)][0], lut, len(HSV_FAMILIES), mask=pool[i % len(pool)][1])
+            for i in range(state["items"])]
+
+
+def check_colour_families(state: dict, shares: list):
+    # Same shares as applying the family rules to the quantized colour of every couch pixel, one by one
+    worst = 0.0
+    for (image, rle, _, _), image_shares in zip(state["pool"], shares):
+        pixels = image[decode_mask(rle) > 0]
+        centres = ((pixels >> QUANTIZE_BITS_SHIFT) + 0.5) / (1 << QUANTIZE_BITS)
+        families = classify_hsv_families(mcolors.rgb_to_hsv(centres))
+        expected = np.bincount(families, minlength=len(HSV_FAMILIES)) / len(pixels)
+        worst = max(worst, float(np.abs(image_shares - expected).max()))
+
+    # A flat grey couch in script 10's hue families comes out as the neutral family
+    family_names, classify = hue_range_classifier(HUE_RANGES)
+    lut = build_family_lut(classify)
+    grey_families = set()
+    for grey in NEUTRAL_GREYS:
+        image = np.full((64, 64, 3), grey, dtype=np.uint8)
+        grey_families.add(family_names[int(np.argmax(family_shares(image, lut, len(family_names))))])
+    return worst < 1e-9 and grey_families == {"Grey"}, {"max_share_error": worst,
+                                                         "grey_families": sorted(grey_families)}
+
+
+# Composites
+
+def prepare_composite(workdir: str, couches: int) -> dict:
+    rng = np.random.default_rng(couches)
+    palettes = []
+    for _ in range(couches):
+        colours = rng.integers(0, 256, (5, 3))
+        palettes.append((["#%02x%02x%02x" % tuple(colour) for colour in colours], list(rng.dirichlet(np.ones(5)))))
+    output_dir = os.path.join(workdir, f"composite_{couches}")
+    os.makedirs(output_dir, exist_ok=True)
+    return {"palettes": palettes, "output_dir": output_dir, "items": couches}
+
+
+def run_composite(state: dict):
+    colours, proportions = palette_matrix(state["palettes"])
+    couches = len(state["palettes"])
+    strip_path = save_composite(os.path.join(state["output_dir"], "strips.jpg"),
+                                strip_rows(colours, proportions, width=300, height=50), 300, 50 * couches)
+    num_columns = 10
+    rows = -(-couches // num_columns)
+    grid_path = save_composite(os.path.join(state["output_dir"], "grid.jpg"),
+                               grid_rows(colours, proportions, num_columns=num_columns, square_size=100),
+                               num_columns * 100, rows * 100)
+    return strip_path, grid_path
+
+
+def check_composite(state: dict, paths):
+    from PIL import Image
+    Image.MAX_IMAGE_PIXELS = None
+    couches = len(state["palettes"])
+    sizes = []
+    for path in paths:
+        with Image.open(path) as image:
+            sizes.append(image.size)
+    expected = [(300, 50 * couches), (1000, -(-couches // 10) * 100)]
+    return sizes == expected, {"sizes": [list(size) for size in sizes]}
+
+
+def run_adaptive_early_stop(state: dict):
+    """Adaptive search stopping at the first couch found, in a thread so a hang fails the check instead of the run."""
+    engine = DetectionEngine(StandInDetector(delay=EARLY_STOP_DELAY), COUCH_CLASS, CONFIDENCE_THRESHOLD,
+                             batch_size=EARLY_STOP_BATCH_SIZE, queue_size=EARLY_STOP_BATCH_SIZE)
+    outcome = {}
+
+    def search():
+        # A coarse pass of one batch for the model plus a full queue, so the decoding thread has read every
+        # frame and is putting the end of the stream on a full queue when the search stops
+        coarse_samples = 2 * EARLY_STOP_BATCH_SIZE
+        outcome["stats"] = adaptive_best_frame(state["path"], engine, max_inferences=2 * coarse_samples,
+                                               target_box_ratio=0.01, coarse_step_seconds=0.5)[2]
+
+    thread = threading.Thread(target=search, daemon=True)
+    thread.start()
+    thread.join(EARLY_STOP_TIMEOUT)
+    return outcome.get("stats"), engine.inferences
+
+
+def check_adaptive_early_stop(state: dict, output):
+    stats, inferences = output
+    details = {"returned": stats is not None, "stopped": stats and stats["stopped"], "inferences": inferences}
+    return stats is not None and stats["stopped"] == "target" and inferences == EARLY_STOP_BATCH_SIZE, details
+
+
+# Case table: {case: ({size: parameter}, prepare, run, check)}
+CASES = {
+    "find_best_frame_interval": ({"small": 20, "medium": 60, "large": 180}, prepare_video,
+                                 lambda state: run_find_best_frame(state, "interval"),
+                                 lambda state, output: check_find_best_frame(state, output, 1.0)),
+    "find_best_frame_adaptive": ({"small": 20, "medium": 60, "large": 180}, prepare_video,
+                                 lambda state: run_find_best_frame(state, "adaptive"),
+                                 lambda state, output: check_find_best_frame(state, output, 0.8)),
+    "adaptive_early_stop": ({"small": 20, "medium": 60, "large": 180}, prepare_video, run_adaptive_early_stop,
+                            check_adaptive_early_stop),
+    "segmentation": ({"small": 8, "medium": 32, "large": 96}, prepare_segmentation, run_segmentation,
+                     check_segmentation),
+    "get_weighted_colors": ({"small": (640, 360), "medium": (1280, 720), "large": (1920, 1080)},
+                            prepare_weighted_colors, run_weighted_colors, check_weighted_colors),
+    "colour_families": ({"small": 10, "medium": 100, "large": 1000}, prepare_colour_families, run_colour_families,
+                        check_colour_families),
+    "composite": ({"small": 100, "medium": 1000, "large": 10000}, prepare_composite, run_composite, check_composite),
+}
+
+
+def machine_info() -> dict:
+    return {"platform": platform.platform(), "processor": platform.processor() or platform.machine(),
+            "cpus": os.cpu_count(), "python": platform.python_version(), "numpy": np.__version__,
+            "opencv": cv2.__version__, "stage_02": STAGE_02 is not None}
+
+
+def time_case(name: str, size: str, workdir: str, repeats: int) -> dict:
+    """Prepare a case, run it once to check its output and then `repeats` more times to time it."""
+    sizes, prepare, run, check = CASES[name]
+    state = prepare(workdir, sizes[size])
+    # The pipeline code prints progress for every item, which would be timed along with it
+    with contextlib.redirect_stdout(io.StringIO()):
+        passed, details = check(state, run(state))
+        seconds = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            run(state)
+            seconds.append(time.perf_counter() - started)
+    median = statistics.median(seconds)
+    return {"median_s": round(median, 4), "min_s": round(min(seconds), 4), "items": state["items"],
+            "ms_per_item": round(1000 * median / state["items"], 4), "passed": bool(passed), "details": details}
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Keys of the results slower than their baseline median by more than `tolerance`."""
+    regressions = []
+    for key, result in results.items():
+        previous = baseline.get("results", {}).get(key)
+        if previous is None:
+            result["change"] = None
+            continue
+        result["change"] = round(result["median_s"] / previous["median_s"] - 1, 4)
+        if result["change"] > tolerance and result["median_s"] - previous["median_s"] > MIN_SLOWDOWN_SECONDS:
+            regressions.append(key)
+    return regressions
+
+
+def format_table(results: dict) -> str:
+    lines = [f"{'case':<40}{'median s':>10}{'ms/item':>11}{'vs base':>9}  check"]
+    for key, result in results.items():
+        change = "" if result.get("change") is None else f"{result['change']:+.0%}"
+        lines.append(f"{key:<40}{result['median_s']:>10.3f}{result['ms_per_item']:>11.3f}{change:>9}  "
+                     f"{'ok' if result['passed'] else 'FAILED'} {json.dumps(result['details'])}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline's hot paths on synthetic data.")
+    parser.add_argument("cases", nargs="*", help=f"Cases to run, out of {', '.join(CASES)} (default: all)")
+    parser.add_argument("--sizes", nargs="+", default=["small", "medium", "large"], choices=["small", "medium", "large"])
+    parser.add_argument("--repeats", type=int, default=REPEATS, help="Timed runs of each case and size")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="Slowdown reported as a regression")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the baseline")
+    parser.add_argument("--workdir", default=WORKDIR, help="Where the synthetic data is generated and kept")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.cases if name not in CASES]
+    if unknown:
+        parser.error(f"Unknown cases {', '.join(unknown)}, expected some of {', '.join(CASES)}")
+
+    os.makedirs(args.workdir, exist_ok=True)
+    results = {}
+    for name in args.cases or CASES:
+        for size in args.sizes:
+            key = f"{name}/{size}"
+            print(f"Running {key}", flush=True)
+            results[key] = time_case(name, size, args.workdir, args.repeats)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+    print(format_table(results))
+
+    run = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "machine": machine_info(), "repeats": args.repeats,
+           "results": results}
+    if baseline and baseline.get("machine") != run["machine"]:
+        print("The baseline was made on a different machine or environment, so timings may not compare")
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}.json"), "w") as f:
+        json.dump(run, f, indent=2)
+    if args.save_baseline:
+        # Keep the baseline of cases and sizes that were not run this time
+        run["results"] = {**baseline.get("results", {}), **results}
+        with open(args.baseline, "w") as f:
+            json.dump(run, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+
+    failed = [key for key, result in results.items() if not result["passed"]]
+    if failed:
+        print(f"Checks failed: {', '.join(failed)}")
+    if regressions:
+        print(f"Slower than the baseline by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+    sys.exit(1 if failed or regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
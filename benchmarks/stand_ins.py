@@ -0,0 +1,111 @@
+"""
+Stand-ins for the YOLO detection and segmentation models, for benchmarking without model downloads.
+
+They are called like ultralytics models, on a frame or a list of frames, and return results with the
+attributes the pipeline reads: `names`, `boxes` (with cls, conf and xyxy) and `masks.data`. The couch
+is found as the pixels that differ from the room colour in the frame's corners, which is right for
+the synthetic frames of synthetic.py and nothing else. Their cost is a few numpy passes over the frame
+rather than a network, so benchmarks with them measure the pipeline around the model: decoding,
+batching, mask handling and colour extraction.
+"""
+
+import time
+import cv2
+import numpy as np
+
+COUCH_CLASS_ID = 57  # "couch" in the COCO classes the YOLO models are trained on
+NAMES = {0: "person", COUCH_CLASS_ID: "couch"}
+DIFFERENCE_THRESHOLD = 60  # Sum over channels of the difference from the room colour
+MIN_LINE_PIXELS = 4  # Rows and columns with fewer couch pixels are compression noise, not couch
+
+
+class _Array:
+    """Numpy array behind the .cpu().numpy() calls made on torch tensors."""
+
+    def __init__(self, array):
+        self.array = array
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.array
+
+
+class _Box:
+    def __init__(self, xyxy, conf: float, cls: int):
+        self.xyxy = [xyxy]
+        self.conf = [conf]
+        self.cls = [cls]
+
+
+class _Boxes(list):
+    @property
+    def cls(self):
+        return [box.cls[0] for box in self]
+
+
+class _Masks:
+    def __init__(self, data):
+        self.data = data
+
+
+class _Result:
+    def __init__(self, boxes, masks=None):
+        self.names = NAMES
+        self.boxes = _Boxes(boxes)
+        self.masks = masks
+
+
+def couch_pixels(image):
+    """Boolean mask of the pixels differing from the median colour of the image's four corner patches."""
+    patch = max(min(image.shape[:2]) // 32, 2)
+    corners = np.concatenate([image[:patch, :patch], image[:patch, -patch:], image[-patch:, :patch],
+                              image[-patch:, -patch:]]).reshape(-1, 3)
+    room = np.median(corners, axis=0).astype(np.int16)
+    return np.abs(image.astype(np.int16) - room).sum(axis=2) > DIFFERENCE_THRESHOLD
+
+
+class StandInDetector:
+    """
+    Detection stand-in: one couch box around the pixels that differ from the room.
+
+    Parameters:
+    - delay (float): Seconds each call sleeps for, standing in for the model's own cost.
+    """
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+
+    def __call__(self, frames):
+        if self.delay:
+            time.sleep(self.delay)
+        return [self._detect(frame) for frame in (frames if isinstance(frames, list) else [frames])]
+
+    def _detect(self, frame):
+        found = couch_pixels(frame)
+        rows = np.flatnonzero(found.sum(axis=1) >= MIN_LINE_PIXELS)
+        cols = np.flatnonzero(found.sum(axis=0) >= MIN_LINE_PIXELS)
+        if len(rows) == 0:
+            return _Result([])
+        xyxy = [cols[0], rows[0], cols[-1] + 1, rows[-1] + 1]
+        return _Result([_Box(xyxy, 0.9, COUCH_CLASS_ID)])
+
+
+class StandInSegmenter(StandInDetector):
+    """Segmentation stand-in: the couch mask at a lower resolution than the image, like YOLO's mask head."""
+
+    def __init__(self, mask_side: int = 640):
+        super().__init__()
+        self.mask_side = mask_side
+
+    def _detect(self, frame):
+        result = super()._detect(frame)
+        if not result.boxes:
+            return result
+        found = couch_pixels(frame).astype(np.float32)
+        scale = self.mask_side / max(frame.shape[:2])
+        if scale < 1:
+            found = cv2.resize(found, (int(frame.shape[1] * scale), int(frame.shape[0] * scale)))
+        result.masks = _Masks([_Array((found > 0.5).astype(np.float32))])
+        return result
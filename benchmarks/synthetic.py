@@ -0,0 +1,133 @@
+"""
+Synthetic inputs with known answers for the benchmarks, so no video, image or model has to be downloaded.
+
+- make_video() writes an mp4 with cv2.VideoWriter made of shots, each a flat room colour with a
+  couch-coloured rectangle of known size. The largest rectangle is the frame stage 02 should pick.
+- make_couch_frame() draws a couch of known palette and proportions, as horizontal bands inside a
+  rounded blob, over a room background, the kind of frame stage 03 segments.
+- make_segmented_image() is the same couch on black with its mask, as stage 03 leaves it for 06 to 10.
+
+The stand-in models in stand_ins.py find the couch by its difference from the room colour, so the
+synthetic frames keep the room colour in the corners.
+"""
+
+import cv2
+import numpy as np
+
+# Couch colours roughly spanning the stage 04 vocabulary, as RGB
+COUCH_COLOURS = [
+    (128, 128, 128), (192, 192, 192), (74, 74, 74), (227, 213, 184), (44, 62, 102), (91, 127, 166),
+    (85, 107, 47), (139, 90, 43), (178, 34, 34), (106, 27, 154), (240, 200, 8), (232, 160, 176),
+]
+# Wall colours at least 79 (summed over channels) from every couch colour, so the stand-ins can tell them apart
+ROOM_COLOURS = [(245, 245, 240), (200, 240, 225), (170, 220, 230), (250, 235, 150), (150, 210, 255)]
+
+
+def _texture(rng, height: int, width: int, strength: float = 6.0):
+    """Smooth low-amplitude noise, so frames compress and histogram like footage rather than flat fills."""
+    coarse = rng.normal(0, strength, (max(height // 16, 1), max(width // 16, 1), 1)).astype(np.float32)
+    return cv2.resize(coarse, (width, height), interpolation=cv2.INTER_LINEAR)[..., None]
+
+
+def make_video(path: str, seconds: float = 20, fps: int = 25, size=(640, 360), min_shot_seconds: float = 2.0,
+               max_shot_seconds: float = 5.0, seed: int = 0) -> dict:
+    """
+    Write a synthetic episode of shots, each with one couch-coloured rectangle.
+
+    Returns:
+    - dict: {"path", "fps", "frames", "shots": [{"start", "end", "colour", "box_ratio"}], "best_box_ratio"},
+      where start and end are frame indices and box_ratio is the rectangle's share of the frame.
+    """
+    rng = np.random.default_rng(seed)
+    width, height = size
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    if not writer.isOpened():
+        raise RuntimeError(f"OpenCV cannot write mp4v video to {path}")
+
+    total = int(seconds * fps)
+    shots, frame_index = [], 0
+    while frame_index < total:
+        length = min(int(rng.uniform(min_shot_seconds, max_shot_seconds) * fps), total - frame_index)
+        room = np.array(ROOM_COLOURS[rng.integers(len(ROOM_COLOURS))], dtype=np.float32)
+        colour = COUCH_COLOURS[rng.integers(len(COUCH_COLOURS))]
+        # Keep a margin of room colour around the couch, the stand-in detector reads the room from the corners
+        box_w = int(width * rng.uniform(0.15, 0.7))
+        box_h = int(height * rng.uniform(0.15, 0.6))
+        x = int(rng.integers(width // 16, width - width // 16 - box_w))
+        y = int(rng.integers(height // 16, height - height // 16 - box_h))
+
+        background = np.broadcast_to(room, (height, width, 3)) + _texture(rng, height, width, strength=3.0)
+        for offset in range(length):
+            # A slow pan, so consecutive frames of a shot differ a little
+            frame = np.roll(background, offset // 5, axis=1)
+            frame[y:y + box_h, x:x + box_w] = colour
+            writer.write(cv2.cvtColor(np.clip(frame, 0, 255).astype(np.uint8), cv2.COLOR_RGB2BGR))
+        shots.append({"start": frame_index, "end": frame_index + length, "colour": colour,
+                      "box_ratio": box_w * box_h / (width * height)})
+        frame_index += length
+    writer.release()
+    return {"path": path, "fps": fps, "frames": total, "shots": shots,
+            "best_box_ratio": max(shot["box_ratio"] for shot in shots)}
+
+
+def random_palette(rng, n_colours: int = 3):
+    """Couch colours and the share of the couch each covers, largest first."""
+    picks = rng.choice(len(COUCH_COLOURS), size=n_colours, replace=False)
+    proportions = np.sort(rng.dirichlet(np.full(n_colours, 2.0)))[::-1]
+    return [COUCH_COLOURS[i] for i in picks], proportions
+
+
+def couch_mask(rng, height: int, width: int):
+    """A rounded couch-shaped blob as a uint8 mask of 0 and 255."""
+    mask = np.zeros((height, width), dtype=np.uint8)
+    box_w, box_h = int(width * rng.uniform(0.4, 0.7)), int(height * rng.uniform(0.3, 0.5))
+    x, y = (width - box_w) // 2, (height - box_h) // 2
+    radius = max(min(box_w, box_h) // 6, 1)
+    cv2.rectangle(mask, (x + radius, y), (x + box_w - radius, y + box_h), 255, -1)
+    cv2.rectangle(mask, (x, y + radius), (x + box_w, y + box_h - radius), 255, -1)
+    for cx, cy in ((x + radius, y + radius), (x + box_w - radius, y + radius),
+                   (x + radius, y + box_h - radius), (x + box_w - radius, y + box_h - radius)):
+        cv2.circle(mask, (cx, cy), radius, 255, -1)
+    return mask
+
+
+def paint_couch(image, mask, colours, proportions, rng):
+    """Fill the masked pixels with horizontal bands of the palette colours, each covering its proportion."""
+    rows = np.flatnonzero(mask.any(axis=1))
+    couch_rows = mask[rows].astype(bool).sum(axis=1)
+    # Band edges where the cumulative share of couch pixels crosses each proportion
+    edges = np.searchsorted(np.cumsum(couch_rows) / couch_rows.sum(), np.cumsum(proportions)[:-1])
+    bands = np.split(rows, edges)
+    noise = _texture(rng, *mask.shape, strength=4.0)
+    for colour, band in zip(colours, bands):
+        band_mask = np.zeros_like(mask, dtype=bool)
+        band_mask[band] = mask[band] > 0
+        image[band_mask] = np.clip(np.array(colour, dtype=np.float32) + noise[band_mask], 0, 255)
+    return image
+
+
+def make_couch_frame(size=(1280, 720), seed: int = 0):
+    """
+    An RGB frame of a couch in a room.
+
+    Returns:
+    - tuple: (RGB image, uint8 mask, couch colours, proportions)
+    """
+    rng = np.random.default_rng(seed)
+    width, height = size
+    room = np.array(ROOM_COLOURS[rng.integers(len(ROOM_COLOURS))], dtype=np.float32)
+    image = np.clip(np.broadcast_to(room, (height, width, 3)) + _texture(rng, height, width), 0, 255).astype(np.uint8)
+    mask = couch_mask(rng, height, width)
+    colours, proportions = random_palette(rng)
+    return paint_couch(image, mask, colours, proportions, rng), mask, colours, proportions
+
+
+def make_segmented_image(size=(1280, 720), seed: int = 0):
+    """
+    A segmented couch image: the couch of make_couch_frame() on black.
+
+    Returns:
+    - tuple: (RGB image, uint8 mask, couch colours, proportions)
+    """
+    image, mask, colours, proportions = make_couch_frame(size, seed)
+    return cv2.bitwise_and(image, image, mask=mask), mask, colours, proportions
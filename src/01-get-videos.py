@@ -5,9 +5,10 @@ It also downloads the largest thumbnail for each video and saves it to a local f
 
 import yt_dlp
 import json
-import requests
 from datetime import datetime
 import os
+from thumbnail_fetcher import ThumbnailFetcher
+from tracing import span
 
 # Define playlist URL and JSON file paths
 playlist_url = "https://youtube.com/playlist?list=PL1WZky7MVeY_6H2ieeVKitXGd3npyPo-g&si=sNuLJYlNXl8a4XCs"
@@ -27,8 +28,10 @@ os.makedirs(thumbnail_folder, exist_ok=True)
 def fetch_playlist_videos(url):
     """Fetches all video metadata from the playlist."""
     with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        playlist_info = ydl.extract_info(url, download=False)
+        with span("playlist_fetch"):
+            playlist_info = ydl.extract_info(url, download=False)
         videos_data = []
+        thumbnail_jobs = []
 
         for entry in playlist_info['entries']:
             # Get largest thumbnail if available
@@ -37,7 +40,7 @@ def fetch_playlist_videos(url):
                 largest_thumbnail = max(thumbnails, key=lambda t: t["width"] * t["height"])
                 thumbnail_url = largest_thumbnail["url"]
                 thumbnail_path = os.path.join(thumbnail_folder, f"{entry['id']}.png")
-                download_thumbnail(thumbnail_url, thumbnail_path)
+                thumbnail_jobs.append((thumbnail_url, thumbnail_path))
             else:
                 thumbnail_url = None
                 thumbnail_path = None
@@ -52,24 +55,11 @@ def fetch_playlist_videos(url):
                 "date_added": datetime.now().isoformat()
             }
             videos_data.append(video_info)
-    
-    return videos_data
 
-def download_thumbnail(url, path):
-    """Downloads a thumbnail image from a URL and saves it to a specified path."""
-    if os.path.exists(path):
-        print(f"Thumbnail already exists at {path}, skipping download.")
-        return
-    
-    try:
-        response = requests.get(url, stream=True)
-        if response.status_code == 200:
-            with open(path, 'wb') as f:
-                for chunk in response.iter_content(1024):
-                    f.write(chunk)
-        print(f"Thumbnail saved to {path}")
-    except Exception as e:
-        print(f"Failed to download thumbnail from {url}: {e}")
+    # Download new or changed thumbnails concurrently
+    with span("thumbnail_fetch", thumbnails=len(thumbnail_jobs)):
+        ThumbnailFetcher().fetch_all(thumbnail_jobs)
+    return videos_data
 
 def load_existing_data(filepath):
     """Loads existing video data from JSON if available."""
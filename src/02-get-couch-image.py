@@ -14,26 +14,61 @@ import matplotlib.pyplot as plt
 import yt_dlp
 import numpy as np
 import json
+from frame_sampler import FrameSampler, FrameReader
+from detection_engine import DetectionEngine, couch_box_ratio
+from download_scheduler import DownloadScheduler
+from detection_store import DetectionStore
+from frame_search import adaptive_best_frame
+from shot_gate import ShotGate
+from segmentation_engine import couch_mask_from_result, save_segmentation_outputs
+from thumbnail_screen import prescreen_videos
+from tracing import span, traced, count
 
 # Configurable variables
 MODEL_NAME = "kadirnar/Yolov10/yolov10n.pt"
+SEGMENTATION_MODEL_NAME = "yolov8n-seg.pt"
+FUSED_SEGMENTATION = False  # Segment the winning frame in memory here instead of leaving it to stage 03
 FRAME_INTERVAL = 100  # Process every nth frame
+SAMPLER_MODE = "auto"  # "grab", "keyframe", "timestamp" or "auto" to pick the cheapest for each video
+SEARCH_MODE = "interval"  # "interval" to sample every FRAME_INTERVAL frames, "adaptive" for a budgeted coarse-to-fine search
+SEARCH_MAX_INFERENCES = 60  # Model calls per video in adaptive mode
+SEARCH_MAX_SECONDS = None  # Wall time per video in adaptive mode, None for no limit
+TARGET_BOX_RATIO = None  # Stop the adaptive search once a couch covers this share of the frame
+SHOT_GATING = False  # Only run the model on one or two representatives per shot in interval mode
+MAX_PER_SHOT = 2
 COUCH_CLASS = 'couch'
 CONFIDENCE_THRESHOLD = 0.7
+BATCH_SIZE = 8  # Number of frames passed to the model at once
+QUEUE_SIZE = 32  # Maximum number of decoded frames waiting for the model
 OUTPUT_DIR = "data/couch_images"
 VIDEO_DIR = "videos"
-INFO_FILE_PATH = "data/couch_info.json"
+INFO_STORE_PATH = "data/couch_info.jsonl"
 VIDEO_IDS_FILE = "data/never_too_small_official_playlist.json"
+# Point these at a local HTTP server (e.g. "http://localhost:8000/{video_id}.mp4" and "best") to stand in for YouTube
+VIDEO_URL_TEMPLATE = os.getenv("VIDEO_URL_TEMPLATE", "https://www.youtube.com/watch?v={video_id}")
+VIDEO_FORMAT = os.getenv("VIDEO_FORMAT", "137+140")
+# Two-tier mode detects on a small video-only stream and only fetches the winning frame at full resolution
+TWO_TIER_DETECTION = False
+LOW_RES_VIDEO_FORMAT = os.getenv("LOW_RES_VIDEO_FORMAT", "134/bestvideo[height<=360]")
+FULL_RES_VIDEO_FORMAT = os.getenv("FULL_RES_VIDEO_FORMAT", "137")
+PREFETCH_DOWNLOADS = 2  # Videos downloaded ahead while detection runs on the current one
+MAX_CONCURRENT_DOWNLOADS = 2
+MAX_PREFETCH_BYTES = 4 * 1024 ** 3  # Stop prefetching while the waiting videos take more than this
+MIN_FREE_BYTES = 2 * 1024 ** 3  # Stop prefetching while the disk has less free space than this
+# Run the detector on each video's thumbnail first, skipping videos with no couch and starting with the likeliest
+THUMBNAIL_PRESCREEN = False
+PRESCREEN_THRESHOLD = 0.25  # Couch confidence on the thumbnail needed to download the video
 
 def setup_directories():
     os.makedirs(VIDEO_DIR, exist_ok=True)
     os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-def download_video(video_id: str) -> str:
-    video_path = os.path.join(VIDEO_DIR, f"{video_id}.mp4")
-    video_url = f"https://www.youtube.com/watch?v={video_id}"
+@traced()
+def download_video(video_id: str, video_format: str = VIDEO_FORMAT, suffix: str = "") -> str:
+    video_path = os.path.join(VIDEO_DIR, f"{video_id}{suffix}.mp4")
+    video_url = VIDEO_URL_TEMPLATE.format(video_id=video_id)
     ydl_opts = {
-        'format': '137+140',
+        'format': video_format,
         'outtmpl': video_path,
     }
     try:
@@ -44,41 +79,79 @@ def download_video(video_id: str) -> str:
         print(f"Error downloading video {video_id}: {e}")
         return None
 
+def download_low_res_video(video_id: str) -> str:
+    return download_video(video_id, video_format=LOW_RES_VIDEO_FORMAT, suffix="_low")
+
+@traced()
+def fetch_full_res_frame(video_id: str, timestamp: float):
+    """
+    Read a single frame at `timestamp` seconds from the full resolution stream without downloading it.
+
+    Only the byte ranges around the frame are fetched, so the server has to support HTTP range requests.
+    """
+    video_url = VIDEO_URL_TEMPLATE.format(video_id=video_id)
+    try:
+        with yt_dlp.YoutubeDL({'format': FULL_RES_VIDEO_FORMAT, 'quiet': True}) as ydl:
+            info = ydl.extract_info(video_url, download=False)
+        headers = "".join(f"{key}: {value}\r\n" for key, value in info.get('http_headers', {}).items())
+        with FrameReader(info['url'], options={'headers': headers}) as reader:
+            _, frame = reader.read(int(round(timestamp * reader.fps)))
+        return frame
+    except Exception as e:
+        print(f"Error fetching full resolution frame for video {video_id}: {e}")
+        return None
+
 def load_model(model_name: str):
     return YOLO(model_name)
 
+@traced()
 def process_frame(frame, model):
     results = model(frame)
+    count("inferences")
     for result in results:
-        for box in result.boxes:
-            if result.names[int(box.cls[0])] == COUCH_CLASS and box.conf[0] > CONFIDENCE_THRESHOLD:
-                x_min, y_min, x_max, y_max = map(int, box.xyxy[0])
-                box_area = (x_max - x_min) * (y_max - y_min)
-                frame_area = frame.shape[0] * frame.shape[1]
-                box_ratio = box_area / frame_area
-                return box_ratio, frame
+        box_ratio = couch_box_ratio(result, frame.shape, COUCH_CLASS, CONFIDENCE_THRESHOLD)
+        if box_ratio is not None:
+            return box_ratio, frame
     return None, None
 
-def find_best_frame(video_path: str, model, frame_interval: int):
-    cap = cv2.VideoCapture(video_path)
+@traced()
+def find_best_frame(video_path: str, model, frame_interval: int, sampler_mode: str = SAMPLER_MODE,
+                    batch_size: int = BATCH_SIZE, search_mode: str = SEARCH_MODE):
+    engine = DetectionEngine(model, COUCH_CLASS, CONFIDENCE_THRESHOLD, batch_size=batch_size, queue_size=QUEUE_SIZE)
+
+    if search_mode == "adaptive":
+        best_frame, largest_box_ratio, stats = adaptive_best_frame(
+            video_path,
+            engine,
+            max_inferences=SEARCH_MAX_INFERENCES,
+            max_seconds=SEARCH_MAX_SECONDS,
+            target_box_ratio=TARGET_BOX_RATIO,
+        )
+        count("frames_decoded", stats['frames_decoded'])
+        print(f"Adaptive search made {stats['inferences']} inferences in {stats['rounds']} rounds "
+              f"({stats['seconds']:.1f}s, stopped: {stats['stopped']})")
+        return best_frame, largest_box_ratio, stats['best_time']
+
+    sampler = FrameSampler(video_path, frame_interval, mode=sampler_mode)
+    samples = ShotGate(sampler, max_per_shot=MAX_PER_SHOT) if SHOT_GATING else sampler
     best_frame = None
+    best_frame_index = None
     largest_box_ratio = 0
-    frame_count = 0
-
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-        if frame_count % frame_interval == 0:
-            box_ratio, detected_frame = process_frame(frame, model)
-            if box_ratio and box_ratio > largest_box_ratio:
-                largest_box_ratio = box_ratio
-                best_frame = detected_frame.copy()
-        frame_count += frame_interval
-        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_count)
-
-    cap.release()
-    return best_frame, largest_box_ratio
+
+    for frame_index, frame, box_ratio in engine.detect(samples):
+        if box_ratio and box_ratio > largest_box_ratio:
+            largest_box_ratio = box_ratio
+            best_frame = frame
+            best_frame_index = frame_index
+
+    count("frames_decoded", sampler.frames_decoded)
+    print(f"Sampled {sampler.samples} frames in {sampler.mode} mode "
+          f"({sampler.frames_decoded_per_sample:.1f} frames decoded per sample), "
+          f"{engine.inferences} inferences in batches of {batch_size}")
+    if SHOT_GATING:
+        print(f"Shot gating found {samples.shots} shots and skipped {samples.skipped} inferences")
+    best_time = best_frame_index / sampler.fps if best_frame_index is not None and sampler.fps else None
+    return best_frame, largest_box_ratio, best_time
 
 def display_frame(frame, box_ratio):
     if frame is not None:
@@ -99,31 +172,41 @@ def save_frame(frame, video_id: str):
         print("No frame to save.")
         return None
 
-def save_detection_info(video_id: str, detected: bool, image_path: str):
+def segment_frame(frame, segmentation_model, video_id: str) -> dict:
+    """
+    Segment the couch in the winning frame while it is still in memory.
+
+    Returns the fields to add to the detection record: the run-length encoded mask and the paths of the
+    segmented image and hex values, or an empty dict if no couch mask was found.
+    """
+    # Stage 03 segments RGB images loaded with PIL, so match that here
+    image_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    with span("segmentation", video_id=video_id):
+        results = segmentation_model(image_rgb)
+    count("inferences")
+    couch_mask = couch_mask_from_result(results[0], image_rgb.shape, COUCH_CLASS)
+    if couch_mask is None:
+        print(f"No couch mask found in the best frame of video {video_id}, leaving it to stage 03")
+        return {}
+
+    return save_segmentation_outputs(video_id, image_rgb, couch_mask)
+
+def save_detection_info(store: DetectionStore, video_id: str, detected: bool, image_path: str, **extra):
     info = {
         "video_id": video_id,
         "couch_detected": detected,
-        "image_path": image_path if detected else None
+        "image_path": image_path if detected else None,
+        **extra
     }
-    
-    # Load existing data if it exists
-    if os.path.exists(INFO_FILE_PATH):
-        with open(INFO_FILE_PATH, "r") as f:
-            data = json.load(f)
-    else:
-        data = {}
-
-    # Update the entry for the current video
-    data[video_id] = info
 
-    # Write updated data back to JSON file
-    with open(INFO_FILE_PATH, "w") as f:
-        json.dump(data, f, indent=4)
-    print(f"Detection info saved to {INFO_FILE_PATH}")
+    # Appends a single record instead of rewriting every video's entry
+    store.put(info)
+    print(f"Detection info saved to {store.path}")
 
 def main():
     setup_directories()
     model = load_model(MODEL_NAME)
+    segmentation_model = load_model(SEGMENTATION_MODEL_NAME) if FUSED_SEGMENTATION else None
     
     # Load video IDs from JSON file
     with open(VIDEO_IDS_FILE, "r") as f:
@@ -132,31 +215,55 @@ def main():
     video_ids = [entry['id'] for entry in video_entries]
     
     # Load existing detection info if it exists
-    if os.path.exists(INFO_FILE_PATH):
-        with open(INFO_FILE_PATH, "r") as f:
-            existing_info = json.load(f)
-    else:
-        existing_info = {}
+    store = DetectionStore(INFO_STORE_PATH)
 
+    video_ids_to_process = []
     for video_id in video_ids:
-        if video_id in existing_info:
+        if video_id in store:
             print(f"Skipping video {video_id} as it is already processed.")
             continue
-        
-        video_path = download_video(video_id)
-        if video_path is None:
-            continue
-        
-        best_frame, largest_box_ratio = find_best_frame(video_path, model, FRAME_INTERVAL)
-        
+        video_ids_to_process.append(video_id)
+
+    if THUMBNAIL_PRESCREEN:
+        video_ids_to_process, skipped = prescreen_videos(model, video_ids_to_process, threshold=PRESCREEN_THRESHOLD,
+                                                         couch_class=COUCH_CLASS, model_name=MODEL_NAME)
+        for video_id in skipped:
+            print(f"Skipping video {video_id} as no couch was seen in its thumbnail.")
+
+    # Downloads for the next videos run in the background while detection runs on the current one
+    scheduler = DownloadScheduler(
+        video_ids_to_process,
+        download_low_res_video if TWO_TIER_DETECTION else download_video,
+        prefetch=PREFETCH_DOWNLOADS,
+        max_concurrent=MAX_CONCURRENT_DOWNLOADS,
+        max_prefetch_bytes=MAX_PREFETCH_BYTES,
+        min_free_bytes=MIN_FREE_BYTES,
+        download_dir=VIDEO_DIR,
+    )
+
+    for video_id, video_path in scheduler:
+        best_frame, largest_box_ratio, best_time = find_best_frame(video_path, model, FRAME_INTERVAL)
+
+        # Swap the low resolution winner for the same moment from the full resolution stream
+        if TWO_TIER_DETECTION and best_frame is not None:
+            full_res_frame = fetch_full_res_frame(video_id, best_time)
+            if full_res_frame is not None:
+                best_frame = full_res_frame
+            else:
+                print(f"Keeping the low resolution frame for video {video_id}")
+
         # Save frame and get path if a couch is detected
         if best_frame is not None:
             # display_frame(best_frame, largest_box_ratio)
             image_path = save_frame(best_frame, video_id)
-            save_detection_info(video_id, detected=True, image_path=image_path)
+            segmentation = segment_frame(best_frame, segmentation_model, video_id) if FUSED_SEGMENTATION else {}
+            save_detection_info(store, video_id, detected=True, image_path=image_path, **segmentation)
         else:
             print(f"No couch detected in video {video_id} with confidence above the threshold.")
-            save_detection_info(video_id, detected=False, image_path=None)
+            save_detection_info(store, video_id, detected=False, image_path=None)
+
+    if scheduler.failed:
+        print(f"Failed to download {len(scheduler.failed)} videos: {', '.join(scheduler.failed)}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
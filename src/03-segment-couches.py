@@ -9,99 +9,67 @@ I think we will remove the hex values and the segmented images from the final ve
 
 """
 
-import json
 import os
-import cv2
 import numpy as np
 from PIL import Image
 from ultralytics import YOLO
-from sklearn.cluster import KMeans
-import matplotlib.pyplot as plt
+from detection_store import DetectionStore
+from segmentation_engine import SegmentationEngine, save_segmentation_outputs, SEGMENTED_DIR, HEX_VALUES_DIR
+from mask_codec import decode_mask
+
+BATCH_SIZE = 8  # Number of images passed to the segmentation model at once
 
 # Load YOLOv8 model
 model = YOLO('yolov8n-seg.pt')  # Ensure you have the segmentation model for YOLO
 
-def process_couch_image(video_id):
-    # Load couch information JSON
-    with open('data/couch_info.json', 'r') as f:
-        couch_info = json.load(f)
-
-    # Check if video_id exists in couch_info and if the couch is detected
-    if video_id not in couch_info or not couch_info[video_id].get('couch_detected'):
-        print(f"No couch detected for video ID: {video_id}")
-        return
-    
-    # Define paths for the input image, output segmented image, and output hex values
-    image_path = couch_info[video_id]['image_path']
-    segmented_image_path = f"data/couch_images_segmented/{video_id}.jpg"
-    hex_values_path = f"data/couch_hex_values/{video_id}.json"
-
-    # ensure that the directories exist
-    os.makedirs(os.path.dirname(segmented_image_path), exist_ok=True)
-    os.makedirs(os.path.dirname(hex_values_path), exist_ok=True)
-
-    # Check if segmented image and hex values already exist
-    if os.path.exists(segmented_image_path) and os.path.exists(hex_values_path):
-        print(f"Segmented image and hex values already exist for video ID: {video_id}")
-        return
-    
-    # Load the image
-    image = Image.open(image_path)
-    image_np = np.array(image)
-
-    # Perform inference with YOLOv8 model
-    results = model(image_np)
-
-    # Check if masks are available in the results
-    if not hasattr(results[0], 'masks') or results[0].masks is None:
-        print("No segmentation masks found in the results.")
-        return
-
-    # Extract the segmentation mask for the couch
-    couch_mask = None
-    for seg, cls in zip(results[0].masks.data, results[0].boxes.cls):
-        label_name = results[0].names[int(cls)]
-        if label_name == 'couch':  # Look for the 'couch' label
-            couch_mask = seg.cpu().numpy()
-            break
-
+# Detection records written by 02-get-couch-image.py, loaded once for the whole run
+store = DetectionStore()
+
+def load_done_index():
+    """Return the video IDs that already have a segmented image and hex values recorded in the store."""
+    done = {record['video_id'] for record in store.records()
+            if record.get('segmented_image_path') and record.get('hex_values_path')}
+
+    # Backfill outputs written before the store tracked them, with one listing per directory
+    segmented = {os.path.splitext(f)[0] for f in os.listdir(SEGMENTED_DIR)} if os.path.isdir(SEGMENTED_DIR) else set()
+    hex_values = {os.path.splitext(f)[0] for f in os.listdir(HEX_VALUES_DIR)} if os.path.isdir(HEX_VALUES_DIR) else set()
+    for video_id in (segmented & hex_values) - done:
+        if video_id in store:
+            store.update(video_id,
+                         segmented_image_path=f"{SEGMENTED_DIR}/{video_id}.jpg",
+                         hex_values_path=f"{HEX_VALUES_DIR}/{video_id}.json")
+            done.add(video_id)
+    return done
+
+def load_images(couches):
+    for couch in couches:
+        # Load the image
+        image = Image.open(couch['image_path'])
+        yield couch['video_id'], np.array(image)
+
+def save_couch_segmentation(video_id, image_np, couch_mask):
+    outputs = save_segmentation_outputs(video_id, image_np, couch_mask)
+
+    # Record the outputs so the next run can skip this video
+    store.update(video_id, **outputs)
+
+# loop through all of the detected couches in the store that have not been segmented yet
+done = load_done_index()
+couches = [couch for couch in store.records() if couch.get('couch_detected') and couch['video_id'] not in done]
+print(f"Segmenting {len(couches)} couches, {len(done)} already done")
+
+# Couches segmented in memory by stage 02 already have a mask, so they skip the model
+for couch in couches:
+    if couch.get('couch_mask'):
+        video_id, image_np = next(load_images([couch]))
+        save_couch_segmentation(video_id, image_np, decode_mask(couch['couch_mask']))
+couches = [couch for couch in couches if not couch.get('couch_mask')]
+
+engine = SegmentationEngine(model, batch_size=BATCH_SIZE)
+for video_id, image_np, couch_mask in engine.segment(load_images(couches)):
     if couch_mask is None:
-        print("Couch not detected in the image.")
-        return
-
-    # Ensure the mask is in uint8 format for OpenCV
-    couch_mask = (couch_mask * 255).astype(np.uint8)
-    if couch_mask.shape != image_np.shape[:2]:  # Ensure mask has same dimensions as source image
-        couch_mask = cv2.resize(couch_mask, (image_np.shape[1], image_np.shape[0]))
-
-    # Apply the mask to the original image
-    segmented_couch = cv2.bitwise_and(image_np, image_np, mask=couch_mask)
-
-    # Reshape the segmented part for clustering
-    pixels = segmented_couch.reshape((-1, 3))
-    pixels = pixels[np.all(pixels != [0, 0, 0], axis=1)]  # Exclude black areas (non-couch)
-
-    # Use KMeans clustering to find the dominant colors
-    n_colors = 5
-    kmeans = KMeans(n_clusters=n_colors)
-    kmeans.fit(pixels)
-    colors = kmeans.cluster_centers_
-
-    # Convert colors to hex format
-    hex_colors = ['#%02x%02x%02x' % tuple(map(int, color)) for color in colors]
-
-    # Save segmented couch image
-    Image.fromarray(segmented_couch).save(segmented_image_path)
-    print(f"Segmented image saved to {segmented_image_path}")
-
-    # Save hex colors to JSON
-    with open(hex_values_path, 'w') as f:
-        json.dump(hex_colors, f)
-    print(f"Hex values saved to {hex_values_path}")
-
-# loop through all of the couches in the couch_info.json file
-with open('data/couch_info.json', 'r') as f:
-    couch_info = json.load(f)
+        print(f"Couch not detected in the image for video ID: {video_id}")
+        continue
+    save_couch_segmentation(video_id, image_np, couch_mask)
 
-for video_id in couch_info:
-    process_couch_image(video_id)
\ No newline at end of file
+print(f"Segmented {engine.images} images in {engine.seconds:.1f}s ({engine.images_per_second:.2f} images per second)")
@@ -2,19 +2,57 @@
 This file classifies the color of couches in the images extracted from the Never Too Small videos.
 
 It does this using natural language with the help of the OpenAI API.
+
+With LOCAL_FIRST on, couches are first named locally from their dominant colours (see colour_names.py),
+and only those named with low confidence are sent to the model. Couches the model has already answered
+keep its answer. Scored against the model's labels, the local names agree too rarely to be on by default.
+
+Classifications saved before the response cache existed are imported into it on each run, keyed by
+the URL request that produced them, so they are not paid for again. Each classification records the
+digest of the image it describes, so an image changed since then is classified again.
+
+Set CONCURRENCY above 1 to classify on asyncio with several requests in flight. Setting OPENAI_BASE_URL
+points the client at any server speaking the chat completions protocol, such as a local mock.
 """
 
 import os
 import json
+import time
+import asyncio
 import logging
 from dotenv import load_dotenv
 from pydantic import BaseModel, Field
-from openai import OpenAI, APIError, BadRequestError, OpenAIError
+from openai import (OpenAI, AsyncOpenAI, APIError, APIConnectionError, APIStatusError, BadRequestError,
+                    OpenAIError)
+from detection_store import DetectionStore
+from async_runner import TokenBucket, call_with_retries, run_concurrently
+from image_payload import image_data_url
+from response_cache import ResponseCache, text_digest, file_digest
+from colour_names import ColourNameIndex
+from colour_cache import ColourFeatureCache
+from tracing import span, count
 
 # Define paths
-VIDEO_LIST_PATH = "data/couch_info.json"
+VIDEO_LIST_PATH = "data/couch_info.jsonl"
 CLASSIFICATIONS_DIR = "data/couch_colour_classifications_2"
+RESPONSE_CACHE_PATH = "data/classification_cache.jsonl"
 IMAGE_URL_TEMPLATE = "https://github.com/j-jayes/grey-couches/blob/main/data/couch_images/{video_id}_couch.jpg?raw=true"
+MODEL = "gpt-4o-mini"
+# Send a downscaled crop of the couch inline instead of the URL of the full frame on GitHub. Every existing
+# classification was made from the URL, so turning this on re-classifies every couch, once, at full cost.
+INLINE_IMAGES = False
+IMAGE_MAX_SIDE = 512  # Longest side of the inline image, in pixels
+
+# Local first pass
+LOCAL_FIRST = False  # Name couches from their dominant colours and only ask the model about uncertain ones
+# Lowest confidence of a local name that is accepted without the model. Of the 132 couches the model
+# labelled, 12 reach it and 9 of those agree, the best agreement of any threshold naming 10 or more
+LOCAL_CONFIDENCE_THRESHOLD = 0.93
+
+# Concurrent classification
+CONCURRENCY = 1  # Requests in flight at once, above 1 classification runs on asyncio
+REQUESTS_PER_SECOND = 5.0  # Token bucket rate shared by all requests
+MAX_RETRIES = 5  # Retries of a request after a 429, 5xx or connection error
 
 # Load environment variables from .env file
 load_dotenv()
@@ -29,52 +67,200 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(
 class CouchColourClassification(BaseModel):
     couch_colour: str = Field(description="The classified color of the couch")
 
+# Responses are cached by image, prompt, model and schema, so only changed requests reach the API
+response_cache = ResponseCache(RESPONSE_CACHE_PATH)
+
 # Define the prompt for zero-shot classification
 PROMPT = """
 You will see a still from a video. What color is the couch in the image? Use a single word to describe the color, e.g. 'white', 'black', 'grey', 'beige', 'blue', 'green', 'red', 'brown', 'purple', 'yellow', 'orange', 'pink'. If the couch has multiple colors, choose the most prominent one. 
 """
 
-def get_couch_colour(video_id: str) -> dict:
+def image_url(video_id: str, couch: dict = None) -> str:
+    """
+    URL of the couch image to classify: an inline crop of the local image when INLINE_IMAGES is on and the
+    detection record is given, otherwise the full frame on GitHub.
+    """
+    if INLINE_IMAGES and couch and couch.get("image_path"):
+        return image_data_url(couch["image_path"], couch.get("couch_mask"), max_side=IMAGE_MAX_SIDE)
+    return IMAGE_URL_TEMPLATE.format(video_id=video_id)
+
+def build_messages(url: str) -> list:
+    """Chat messages asking for the couch colour in the image at `url`."""
+    return [
+        {"role": "system", "content": PROMPT},
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": url
+                    },
+                }
+            ],
+        },
+    ]
+
+def local_image_digest(couch: dict = None):
+    """Digest of the local copy of the couch image, or None if there is none."""
+    if couch and couch.get("image_path") and os.path.exists(couch["image_path"]):
+        return file_digest(couch["image_path"])
+    return None
+
+def cache_key(url: str, couch: dict = None, image_digest: str = None) -> str:
+    """
+    Response cache key of a request for the image at `url`. For a URL request, `image_digest` is the
+    digest of the image the URL served, by default that of the local copy as it is now.
+    """
+    if url.startswith("data:"):
+        digest = text_digest(url)  # The image itself is in the URL
+    else:
+        digest = image_digest or local_image_digest(couch) or text_digest(url)
+    return response_cache.key(digest, PROMPT, MODEL, CouchColourClassification.model_json_schema())
+
+def import_classifications(couches: list, directory: str = CLASSIFICATIONS_DIR) -> int:
+    """
+    Add the model's classifications saved in `directory` to the response cache, keyed by the URL request
+    that produced them. Local classifications and couches already in the cache are left out.
+
+    The request is keyed by the image digest the classification recorded. Classifications saved before
+    digests were recorded are only imported when they are newer than the local image, as an image
+    re-extracted since then is not the one the model saw.
+
+    Returns:
+    - int: Number of classifications imported.
+    """
+    imported = 0
+    for couch in couches:
+        video_id = couch["video_id"]
+        path = os.path.join(directory, f"{video_id}.json")
+        if not os.path.exists(path):
+            continue
+        with open(path, "r") as f:
+            classification = json.load(f)
+        if classification.get("classifier", "llm") != "llm":
+            continue
+        image_digest = classification.get("image_digest")
+        if image_digest is None and couch.get("image_path") and os.path.exists(couch["image_path"]) \
+                and os.path.getmtime(path) < os.path.getmtime(couch["image_path"]):
+            continue
+        key = cache_key(IMAGE_URL_TEMPLATE.format(video_id=video_id), couch, image_digest)
+        if key in response_cache.entries:
+            continue
+        content = json.dumps({name: value for name, value in classification.items()
+                              if name not in ("video_id", "image_digest")})
+        response_cache.put(key, content, 0.0, video_id=video_id, model=MODEL, imported_from=path)
+        imported += 1
+    if imported:
+        logging.info(f"Imported {imported} saved classifications into {response_cache.path}.")
+    return imported
+
+def usage_of(response) -> dict:
+    """Token usage of a response as a plain dict, or None if the server did not report it."""
+    usage = getattr(response, "usage", None)
+    return usage.model_dump() if usage is not None else None
+
+def save_classification(video_id: str, content: str, couch: dict = None) -> dict:
+    """
+    Parse a structured response, add the video_id and save it in the classifications directory, with the
+    digest of the couch image it describes when there is a local copy.
+    """
+    json_object = json.loads(content)
+    json_object["video_id"] = video_id
+    image_digest = local_image_digest(couch)
+    if image_digest is not None:
+        json_object["image_digest"] = image_digest
+
+    save_path = os.path.join(CLASSIFICATIONS_DIR, f"{video_id}.json")
+    os.makedirs(os.path.dirname(save_path), exist_ok=True)
+    with open(save_path, "w") as json_file:
+        json.dump(json_object, json_file, indent=4, ensure_ascii=False)
+
+    return json_object
+
+def get_couch_colour(video_id: str, couch: dict = None) -> dict:
     """
     Classify the couch color in a specified video.
     
     Parameters:
     - video_id (str): Unique identifier for the video.
+    - couch (dict): The video's detection record, used to crop the couch image locally.
     
     Returns:
     - dict: JSON object with classified color and video ID, or None if an error occurs.
     """
     try:
-        response = client.beta.chat.completions.parse(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": PROMPT},
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": IMAGE_URL_TEMPLATE.format(video_id=video_id)
-                            },
-                        }
-                    ],
-                },
-            ],
-            response_format=CouchColourClassification,
-            max_tokens=2000,
-        )
+        url = image_url(video_id, couch)
+        key = cache_key(url, couch)
+        cached = response_cache.get(key)
+        if cached is not None:
+            return save_classification(video_id, cached["content"], couch)
+
+        started = time.monotonic()
+        with span("openai_request", video_id=video_id):
+            response = client.beta.chat.completions.parse(
+                model=MODEL,
+                messages=build_messages(url),
+                response_format=CouchColourClassification,
+                max_tokens=2000,
+            )
+        count("tokens", (usage_of(response) or {}).get("total_tokens", 0))
+        content = response.choices[0].message.content
+        response_cache.put(key, content, time.monotonic() - started, usage_of(response), video_id=video_id, model=MODEL)
+
+        # Parse response content, add video_id and save the result in the 'classifications' directory
+        return save_classification(video_id, content, couch)
+
+    except (BadRequestError, APIError, OpenAIError) as e:
+        logging.error(f"{e.__class__.__name__} for video {video_id}: {e}")
+    except Exception as e:
+        logging.error(f"Unexpected error for video {video_id}: {e}")
+
+    return None
 
-        # Parse response content and add video_id
-        json_object = json.loads(response.choices[0].message.content)
-        json_object["video_id"] = video_id
+def is_retryable(error: Exception) -> bool:
+    """Rate limits, server errors and dropped connections are worth retrying, anything else is not."""
+    if isinstance(error, APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, APIConnectionError)
 
-        # Save the result in the 'classifications' directory
-        save_path = os.path.join(CLASSIFICATIONS_DIR, f"{video_id}.json")
-        os.makedirs(os.path.dirname(save_path), exist_ok=True)
-        with open(save_path, "w") as json_file:
-            json.dump(json_object, json_file, indent=4, ensure_ascii=False)
+def retry_after(error: Exception):
+    """Seconds the server asked us to wait in a Retry-After header, or None."""
+    if isinstance(error, APIStatusError):
+        try:
+            return float(error.response.headers.get("retry-after"))
+        except (TypeError, ValueError):
+            return None
+    return None
+
+async def get_couch_colour_async(video_id: str, async_client: AsyncOpenAI, limiter: TokenBucket,
+                                 couch: dict = None) -> dict:
+    """Asyncio version of get_couch_colour, retrying rate limited and failed requests with jittered backoff."""
+    try:
+        url = image_url(video_id, couch)
+        key = cache_key(url, couch)
+        cached = response_cache.get(key)
+        if cached is not None:
+            return save_classification(video_id, cached["content"], couch)
+
+        async def request():
+            return await async_client.beta.chat.completions.parse(
+                model=MODEL,
+                messages=build_messages(url),
+                response_format=CouchColourClassification,
+                max_tokens=2000,
+            )
 
+        # Latency includes any retries, as that is what the request cost in wall time
+        started = time.monotonic()
+        with span("openai_request", video_id=video_id):
+            response = await call_with_retries(request, is_retryable, limiter, max_retries=MAX_RETRIES,
+                                               retry_after=retry_after)
+        count("tokens", (usage_of(response) or {}).get("total_tokens", 0))
+        content = response.choices[0].message.content
+        response_cache.put(key, content, time.monotonic() - started, usage_of(response), video_id=video_id, model=MODEL)
+        json_object = save_classification(video_id, content, couch)
+        logging.info(f"Saved classification for video_id {video_id}: {json_object}")
         return json_object
 
     except (BadRequestError, APIError, OpenAIError) as e:
@@ -84,6 +270,64 @@ def get_couch_colour(video_id: str) -> dict:
 
     return None
 
+async def classify_couches_async(couches: list, concurrency: int = CONCURRENCY):
+    """Classify couches with up to `concurrency` requests in flight, saving each result as it arrives."""
+    # Retries are handled by call_with_retries, with jitter and the shared rate limit
+    async_client = AsyncOpenAI(api_key=api_key, max_retries=0)
+    limiter = TokenBucket(REQUESTS_PER_SECOND)
+    results = await run_concurrently(
+        couches, lambda couch: get_couch_colour_async(couch["video_id"], async_client, limiter, couch=couch),
+        concurrency=concurrency)
+    classified = sum(result is not None and not isinstance(result, Exception) for result in results)
+    logging.info(f"Classified {classified} of {len(couches)} couches.")
+
+def couch_palette(couch: dict, colour_cache: ColourFeatureCache):
+    """Dominant colours of a couch and their shares, from its segmented image or else stage 03's hex values."""
+    segmented_image_path = couch.get("segmented_image_path")
+    if segmented_image_path and os.path.exists(segmented_image_path):
+        return colour_cache.get_weighted_colors(segmented_image_path, n_colors=5, mask=couch.get("couch_mask"))
+    hex_values_path = couch.get("hex_values_path") or f"data/couch_hex_values/{couch['video_id']}.json"
+    if os.path.exists(hex_values_path):
+        with open(hex_values_path, "r") as f:
+            return json.load(f), None  # Stage 03 does not save the shares, so the colours count equally
+    return [], None
+
+def answered_by_model(couch: dict) -> bool:
+    """Whether the model has classified the couch, in a saved classification or the response cache."""
+    path = os.path.join(CLASSIFICATIONS_DIR, f"{couch['video_id']}.json")
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            if json.load(f).get("classifier", "llm") == "llm":
+                return True
+    return cache_key(image_url(couch["video_id"], couch), couch) in response_cache.entries
+
+def classify_locally(couches: list) -> list:
+    """
+    Name each couch from its palette, saving the confident ones. Couches the model has already answered
+    are left to it, so a local name never replaces the model's.
+
+    Returns:
+    - list: The couches left for the model, as it has answered them or their local name was not confident enough.
+    """
+    index = ColourNameIndex()
+    colour_cache = ColourFeatureCache()
+    escalated = []
+    for couch in couches:
+        video_id = couch["video_id"]
+        if answered_by_model(couch):
+            escalated.append(couch)
+            continue
+        couch_colour, confidence, shares = index.classify(*couch_palette(couch, colour_cache))
+        if couch_colour is None or confidence < LOCAL_CONFIDENCE_THRESHOLD:
+            escalated.append(couch)
+            continue
+        save_classification(video_id, json.dumps({"couch_colour": couch_colour, "confidence": round(confidence, 4),
+                                                  "classifier": "local", "colour_shares": shares}))
+    colour_cache.save()
+    logging.info(f"Named {len(couches) - len(escalated)} couches locally, "
+                 f"{len(escalated)} already answered or below {LOCAL_CONFIDENCE_THRESHOLD} confidence go to the model.")
+    return escalated
+
 def classify_couches(limit: int = 10):
     """
     Classify the color of couches in a set of videos.
@@ -92,26 +336,36 @@ def classify_couches(limit: int = 10):
     - limit (int): Maximum number of videos to classify.
     """
     try:
-        with open(VIDEO_LIST_PATH, "r") as couches_file:
-            couches_to_classify = json.load(couches_file)
-        couches_to_classify = [couch for couch in couches_to_classify.values() if couch.get("couch_detected")]
+        couches_to_classify = DetectionStore(VIDEO_LIST_PATH).records()
+        couches_to_classify = [couch for couch in couches_to_classify if couch.get("couch_detected")]
 
         logging.info(f"Found {len(couches_to_classify)} couches to classify.")
+        import_classifications(couches_to_classify)
 
+        pending = []
         for counter, couch in enumerate(couches_to_classify, start=1):
             if counter > limit:
                 logging.info(f"Processed {limit} couches, stopping.")
                 break
 
-            video_id = couch.get("video_id")
-            classification_path = os.path.join(CLASSIFICATIONS_DIR, f"{video_id}.json")
+            # Unchanged requests are answered from the response cache, so every couch can be sent through
+            pending.append(couch)
+
+        if LOCAL_FIRST:
+            pending = classify_locally(pending)
 
-            if os.path.exists(classification_path):
-                continue
+        if CONCURRENCY > 1:
+            logging.info(f"Classifying {len(pending)} couches with {CONCURRENCY} requests in flight")
+            asyncio.run(classify_couches_async(pending, CONCURRENCY))
+            logging.info(response_cache.summary())
+            return
 
+        for couch in pending:
+            video_id = couch["video_id"]
             logging.info(f"Classifying couch with video_id {video_id}")
-            json_object = get_couch_colour(video_id)
+            json_object = get_couch_colour(video_id, couch)
             logging.info(f"Saved classification for video_id {video_id}: {json_object}")
+        logging.info(response_cache.summary())
 
     except FileNotFoundError:
         logging.error(f"Video list file {VIDEO_LIST_PATH} not found.")
@@ -7,12 +7,12 @@ import json
 import matplotlib.pyplot as plt
 from collections import Counter
 import matplotlib.colors as mcolors
+from detection_store import DetectionStore
 
-# read in data/couch_info.json and filter out all couches where couch_detected is False
-with open("data/couch_info.json", "r") as f:
-    couches = json.load(f)
+# read in the detection store and filter out all couches where couch_detected is False
+couches = DetectionStore().records()
 
-couches = [couch for couch in couches.values() if couch.get("couch_detected")]
+couches = [couch for couch in couches if couch.get("couch_detected")]
 
 # select only the video_id from the couches
 video_ids = [couch["video_id"] for couch in couches]
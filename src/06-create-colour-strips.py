@@ -3,46 +3,9 @@ This file creates a type of colour strip for the most common colours found in th
 """
 
 import os
-import cv2
-import numpy as np
 import matplotlib.pyplot as plt
-import matplotlib.colors as mcolors
-from sklearn.cluster import KMeans
-from collections import Counter
-
-def get_weighted_colors(image_path, n_colors=5):
-    # Load the image and reshape it
-    image = cv2.imread(image_path)
-    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)  # Convert to RGB
-    pixels = image.reshape(-1, 3)
-
-    # Exclude black pixels (background)
-    non_black_pixels = pixels[np.any(pixels > 30, axis=1)]  # Exclude pixels that are too dark
-
-    # Perform KMeans clustering to find dominant colors
-    kmeans = KMeans(n_clusters=n_colors)
-    kmeans.fit(non_black_pixels)
-    labels = kmeans.labels_
-
-    # Count pixel occurrences for each color
-    label_counts = Counter(labels)
-    total_count = sum(label_counts.values())
-
-    # Get colors and their proportions
-    colors = kmeans.cluster_centers_
-    proportions = [label_counts[i] / total_count for i in range(n_colors)]
-
-    # Convert colors to hex format for plotting
-    hex_colors = [mcolors.to_hex(colors[i] / 255) for i in range(n_colors)]
-
-    # Sort colors by hue for a smoother gradient effect
-    hsv_colors = [mcolors.rgb_to_hsv(colors[i] / 255) for i in range(n_colors)]
-    sorted_indices = sorted(range(n_colors), key=lambda x: (hsv_colors[x][0], hsv_colors[x][1], hsv_colors[x][2]))
-    
-    sorted_hex_colors = [hex_colors[i] for i in sorted_indices]
-    sorted_proportions = [proportions[i] for i in sorted_indices]
-
-    return sorted_hex_colors, sorted_proportions
+from colour_cache import ColourFeatureCache
+from detection_store import DetectionStore
 
 def plot_weighted_color_strip(hex_colors, proportions, output_path):
     # Plot color strip with proportional widths
@@ -63,6 +26,12 @@ def plot_weighted_color_strip(hex_colors, proportions, output_path):
     plt.close(fig)
     print(f"Saved color strip to {output_path}")
 
+# Colour features are cached by image content, so unchanged images are not clustered again
+colour_cache = ColourFeatureCache()
+
+# Couch masks recorded by stage 02 or 03, so only couch pixels are read and dark couches are kept
+couch_masks = DetectionStore().couch_masks()
+
 # Paths
 input_dir = "data/couch_images_segmented"
 output_dir = "data/couch_images_segmented_colour_strips"
@@ -76,7 +45,9 @@ for filename in os.listdir(input_dir):
         output_path = os.path.join(output_dir, f"{video_id}.jpg")
         
         # Get weighted colors and proportions
-        hex_colors, proportions = get_weighted_colors(image_path, n_colors=5)
+        hex_colors, proportions = colour_cache.get_weighted_colors(image_path, n_colors=5, mask=couch_masks.get(video_id))
         
         # Plot and save the weighted color strip
         plot_weighted_color_strip(hex_colors, proportions, output_path)
+
+colour_cache.save()
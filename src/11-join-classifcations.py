@@ -1,44 +1,14 @@
-import pandas as pd
-import glob
-import json
+from detection_store import DetectionStore
+from results_dataset import update_results, DATASET_PATH
+from tracing import span
 
-# read in couch info from "data/couch_info.json"
+# read in couch info from the detection store "data/couch_info.jsonl"
+store = DetectionStore()
 
-df = pd.read_json("data/couch_info.json")
-
-# Transpose the DataFrame to switch rows and columns
-df = df.T
-
-# Reset the index to turn the index into a column
-df = df.reset_index(drop=True)
-
-# Melt the DataFrame
-df_melted = df.melt(var_name='variable', value_name='value')
-
-# Create the final DataFrame
-df_long = pd.DataFrame({
-    'video_id': df_melted[df_melted['variable'] == 'video_id']['value'].values,
-    'couch_detected': df_melted[df_melted['variable'] == 'couch_detected']['value'].values,
-    'image_path': df_melted[df_melted['variable'] == 'image_path']['value'].values
-})
-
-# read in couch colour classifications from "data/couch_colour_classifications_2"
-classification_files = glob.glob("data/couch_colour_classifications_2/*.json")
-
-# Create an empty list to store the classification data
-classification_data = []
-
-# Loop through each file and read the JSON data
-for file in classification_files:
-    with open(file, 'r') as f:
-        data = json.load(f)
-        classification_data.append(data)
-
-# Convert the list of dictionaries to a DataFrame
-df_classifications = pd.DataFrame(classification_data)
-
-# Merge the classification data with the original DataFrame
-df_final = pd.merge(df_long, df_classifications, on='video_id', how='left')
+# Update the results dataset "data/couch_results.parquet" with detections, colours and classifications,
+# rebuilding only the rows of videos whose inputs changed
+with span("update_results"):
+    df_final = update_results(store.records(), DATASET_PATH)
 
 print(df_final)
 
@@ -46,6 +16,7 @@ df_final.value_counts('couch_colour')
 
 df_final['couch_colour'].unique()
 
-# save the final DataFrame to a json file
-df_final.to_json("data/couch_info_with_colour_classifications.json", orient='records', indent=4)
-
+# save the columns of the original join to a json file for index.qmd
+with span("json_export"):
+    df_final[['video_id', 'couch_detected', 'image_path', 'couch_colour']].astype({'couch_colour': 'object'}).to_json(
+        "data/couch_info_with_colour_classifications.json", orient='records', indent=4)
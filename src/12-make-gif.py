@@ -1,21 +1,17 @@
-from PIL import Image, ImageSequence
-import numpy as np
+from scroll_animation import save_scroll_animation
+from composite_renderer import composite_path
+from tracing import span
 
-# Load the image
-image_path = 'data/couch_images_segmented_aggregated/couch_color_composite_by_family.jpg'
-image = Image.open(image_path)
+# Load the image, which 09 saves as a PNG instead when the composite is too large for a JPEG
+image_path = composite_path('data/couch_images_segmented_aggregated/couch_color_composite_by_family.jpg')
 
 # Define parameters for the GIF
 window_height = 150
 scroll_step = 5  # Amount to move the window down for each frame
-frames = []
 
-# Generate frames for the GIF
-for y_offset in range(0, image.height - window_height, scroll_step):
-    # Crop the current window section from the image
-    frame = image.crop((0, y_offset, image.width, y_offset + window_height))
-    frames.append(frame)
-
-# Save the frames as a GIF
+# Save the frames as a GIF, encoding each one as it is cropped (.mp4 or .webp also work, with PyAV installed)
 output_gif_path = 'assets/scrolled_couch_colors.gif'
-frames[0].save(output_gif_path, format='GIF', append_images=frames[1:], save_all=True, duration=100, loop=0)
+with span("scroll_animation"):
+    frames = save_scroll_animation(image_path, output_gif_path, window_height=window_height, scroll_step=scroll_step,
+                                   duration=100, loop=0)
+print(f"Saved {frames} frames to {output_gif_path}")
@@ -0,0 +1,198 @@
+"""
+Concurrent, rate-limited request running for 04-get-couch-colour.py.
+
+Classifying couches one request at a time leaves the script waiting on a network round trip for
+almost all of its run. run_concurrently() keeps up to `concurrency` requests in flight on asyncio,
+while a token bucket caps how many are started per second so the API's rate limits are respected.
+Requests that fail with a retryable error (429 or 5xx) are retried with exponential backoff and full
+jitter, so concurrent retries do not all hit the server again at the same moment.
+
+Running this file checks the rate limit, the backoff bounds, which errors are retried and the
+concurrency bound against local stubs, without the network:
+
+    python src/async_runner.py
+"""
+
+import asyncio
+import random
+import sys
+import time
+
+CONCURRENCY = 8  # Requests in flight at once
+REQUESTS_PER_SECOND = 5.0  # Sustained request rate
+BURST = 5  # Requests that may start at once after a quiet spell
+MAX_RETRIES = 5
+BASE_DELAY = 1.0  # Seconds before the first retry, doubled for every retry after that
+MAX_DELAY = 60.0
+
+
+class TokenBucket:
+    """
+    Asyncio token bucket allowing `rate` acquisitions per second on average and up to `capacity` at once.
+    """
+
+    def __init__(self, rate: float = REQUESTS_PER_SECOND, capacity: float = BURST):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait until a token is available and take it."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def backoff_delay(attempt: int, base_delay: float = BASE_DELAY, max_delay: float = MAX_DELAY) -> float:
+    """Full-jitter exponential backoff: a random delay up to base_delay * 2 ** attempt, capped at max_delay."""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+async def call_with_retries(request, is_retryable, limiter: TokenBucket = None, max_retries: int = MAX_RETRIES,
+                            base_delay: float = BASE_DELAY, max_delay: float = MAX_DELAY, retry_after=None):
+    """
+    Await `request()`, retrying with jittered backoff while it raises errors `is_retryable` accepts.
+
+    Parameters:
+    - request: Coroutine function making one attempt.
+    - is_retryable: Function of the raised exception, True if the request should be tried again.
+    - limiter (TokenBucket): Rate limiter to take a token from before every attempt.
+    - retry_after: Optional function of the exception returning the server's requested wait in seconds, or None.
+    """
+    for attempt in range(max_retries + 1):
+        if limiter is not None:
+            await limiter.acquire()
+        try:
+            return await request()
+        except Exception as e:
+            if attempt == max_retries or not is_retryable(e):
+                raise
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            requested = retry_after(e) if retry_after is not None else None
+            if requested is not None:
+                delay = max(delay, min(requested, max_delay))
+            await asyncio.sleep(delay)
+
+
+async def run_concurrently(items, worker, concurrency: int = CONCURRENCY):
+    """
+    Run `await worker(item)` for every item with at most `concurrency` running at once.
+
+    Workers should save their own results, so each one is written as soon as it completes. Exceptions
+    raised by a worker are returned in place of its result rather than cancelling the others.
+
+    Returns:
+    - list: The result or exception of each item, in the order of `items`.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(item):
+        async with semaphore:
+            return await worker(item)
+
+    return await asyncio.gather(*(bounded(item) for item in items), return_exceptions=True)
+
+
+class _StubError(Exception):
+    """Error of a stubbed request, with the HTTP status a real API error would carry."""
+
+    def __init__(self, status_code: int, retry_after: float = None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+async def _self_check() -> list:
+    """Check rate limit, backoff bounds, retries and concurrency against stubs, as (check, passed, details)."""
+    checks = []
+
+    # The bucket never starts more than `capacity` requests plus `rate` per second over any window
+    rate, capacity, acquisitions = 50.0, 5, 60
+    limiter = TokenBucket(rate, capacity)
+    started = []
+    for _ in range(acquisitions):
+        await limiter.acquire()
+        started.append(time.monotonic())
+    excess = max(j - i + 1 - capacity - rate * (started[j] - started[i])
+                 for i in range(acquisitions) for j in range(i, acquisitions))
+    checks.append(("token bucket rate", excess <= 0.01,
+                   {"acquisitions": acquisitions, "seconds": round(started[-1] - started[0], 3),
+                    "min_seconds": (acquisitions - capacity) / rate}))
+
+    # Every backoff delay lies within [0, min(max_delay, base_delay * 2 ** attempt)], and they are spread out
+    delays = {attempt: [backoff_delay(attempt, 1.0, 10.0) for _ in range(1000)] for attempt in range(6)}
+    in_bounds = all(0 <= delay <= min(10.0, 2 ** attempt) for attempt, values in delays.items() for delay in values)
+    spread = all(max(values) - min(values) > 0.5 * min(10.0, 2 ** attempt) for attempt, values in delays.items())
+    checks.append(("backoff within jitter bounds", in_bounds and spread,
+                   {attempt: round(max(values), 3) for attempt, values in delays.items()}))
+
+    def is_retryable(error):
+        return isinstance(error, _StubError) and (error.status_code == 429 or error.status_code >= 500)
+
+    def stub(statuses):
+        """Request failing with each of `statuses` in turn, then succeeding. Counts its attempts."""
+        attempts = []
+
+        async def request():
+            attempts.append(time.monotonic())
+            if len(attempts) <= len(statuses):
+                status = statuses[len(attempts) - 1]
+                raise _StubError(status, retry_after=0.05 if status == 429 else None)
+            return "ok"
+        return request, attempts
+
+    # 429 and 5xx are retried until the request succeeds, honouring Retry-After
+    request, attempts = stub([429, 500, 503])
+    result = await call_with_retries(request, is_retryable, max_retries=5, base_delay=0.001,
+                                     retry_after=lambda error: error.retry_after)
+    checks.append(("retries 429 and 5xx", result == "ok" and len(attempts) == 4 and attempts[1] - attempts[0] >= 0.05,
+                   {"attempts": len(attempts), "retry_after_wait": round(attempts[1] - attempts[0], 3)}))
+
+    # Any other status is raised at once, and a retryable one is raised once the retries run out
+    outcomes = {}
+    for name, statuses, max_retries in (("400", [400], 5), ("429 x3", [429] * 3, 2)):
+        request, attempts = stub(statuses)
+        try:
+            await call_with_retries(request, is_retryable, max_retries=max_retries, base_delay=0.001)
+            outcomes[name] = ("returned", len(attempts))
+        except _StubError as e:
+            outcomes[name] = (e.status_code, len(attempts))
+    checks.append(("gives up on non-retryable and exhausted", outcomes == {"400": (400, 1), "429 x3": (429, 3)},
+                   outcomes))
+
+    # At most `concurrency` workers run at once, and a failing worker does not cancel the others
+    running, peak = 0, 0
+
+    async def worker(item):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        if item == 3:
+            raise _StubError(500)
+        return item
+
+    results = await run_concurrently(range(20), worker, concurrency=4)
+    failed = [i for i, result in enumerate(results) if isinstance(result, Exception)]
+    checks.append(("concurrency bound", peak == 4 and failed == [3] and results[19] == 19,
+                   {"peak": peak, "failed": failed}))
+    return checks
+
+
+if __name__ == "__main__":
+    # python src/async_runner.py checks the behaviour above against local stubs, without the network
+    checks = asyncio.run(_self_check())
+    for check, passed, details in checks:
+        print(f"{'ok' if passed else 'FAILED':<7}{check:<42}{details}")
+    sys.exit(0 if all(passed for _, passed, _ in checks) else 1)
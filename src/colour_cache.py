@@ -0,0 +1,152 @@
+"""
+Persistent cache of the dominant colour features used by the strip and grid scripts (06 to 10).
+
+Every one of those scripts used to re-cluster every segmented image on every run, even when nothing had
+changed. The cache keys each result by (image content hash, n_colors, darkness threshold, algorithm
+version, and the couch mask when there is one), so a changed image or mask, a different number of colours
+or a new extraction algorithm all miss,
+while re-rendering a composite after a layout tweak is served entirely from the cache.
+
+All entries live in one compressed npz file holding the raw cluster centres and proportions, which are
+sorted and converted to hex on the way out, exactly as get_weighted_colors() returns them. The same file
+keeps the quantized colour histogram of each image, under the same content key, for the colour family
+shares of 09 and 10.
+"""
+
+import hashlib
+import os
+import cv2
+import numpy as np
+from colour_extraction import (ALGORITHM_VERSION, DARKNESS_THRESHOLD, QUANTIZE_BITS, bin_counts, colour_histogram,
+                               cluster_colours, sort_by_hsv)
+from mask_codec import mask_digest
+
+CACHE_PATH = "data/colour_feature_cache.npz"
+
+
+def image_digest(image_path: str) -> str:
+    """SHA-1 of the image file's bytes."""
+    with open(image_path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+class ColourFeatureCache:
+    """
+    Content-addressed cache of cluster centres and proportions, backed by a single npz file.
+
+    Parameters:
+    - path (str): Path to the npz file. It is created on the first save().
+    """
+
+    def __init__(self, path: str = CACHE_PATH):
+        self.path = path
+        self.entries, self.histograms = self._read(path)
+        self._digests = {}
+        self.hits = 0
+        self.misses = 0
+        self._dirty = False
+
+    @staticmethod
+    def _read(path: str):
+        """(cluster entries, histogram entries) stored at `path`. Histograms are kept as (occupied bins, counts)."""
+        if not os.path.exists(path):
+            return {}, {}
+        with np.load(path) as data:
+            keys, offsets = data["keys"], data["offsets"]
+            centres, proportions = data["centres"], data["proportions"]
+            entries = {str(key): (centres[start:end], proportions[start:end])
+                       for key, start, end in zip(keys, offsets[:-1], offsets[1:])}
+            if "histogram_keys" not in data.files:  # Saved before histograms were cached
+                return entries, {}
+            keys, offsets = data["histogram_keys"], data["histogram_offsets"]
+            bins, counts = data["histogram_bins"], data["histogram_counts"]
+        histograms = {str(key): (bins[start:end], counts[start:end])
+                      for key, start, end in zip(keys, offsets[:-1], offsets[1:])}
+        return entries, histograms
+
+    @staticmethod
+    def key(digest: str, n_colors: int, darkness_threshold: int, mask: dict = None) -> str:
+        if mask is not None:
+            # The threshold plays no part in masked extraction, so the mask takes its place in the key
+            return f"{digest}:{n_colors}:mask-{mask_digest(mask)}:{ALGORITHM_VERSION}"
+        return f"{digest}:{n_colors}:{darkness_threshold}:{ALGORITHM_VERSION}"
+
+    @staticmethod
+    def histogram_key(digest: str, darkness_threshold: int, mask: dict = None) -> str:
+        pixels = f"mask-{mask_digest(mask)}" if mask is not None else darkness_threshold
+        return f"{digest}:hist{QUANTIZE_BITS}:{pixels}"
+
+    def _digest(self, image_path: str) -> str:
+        """image_digest(), remembered by size and modification time so each image is read once per run."""
+        stat = os.stat(image_path)
+        known = self._digests.get(image_path)
+        if known is None or known[0] != (stat.st_size, stat.st_mtime_ns):
+            known = self._digests[image_path] = ((stat.st_size, stat.st_mtime_ns), image_digest(image_path))
+        return known[1]
+
+    def get_weighted_colors(self, image_path: str, n_colors: int = 5, darkness_threshold: int = DARKNESS_THRESHOLD,
+                            mask: dict = None):
+        """Same as colour_extraction.get_weighted_colors, but only clusters images the cache has not seen."""
+        key = self.key(self._digest(image_path), n_colors, darkness_threshold, mask)
+        if key in self.entries:
+            self.hits += 1
+            colors, proportions = self.entries[key]
+            return sort_by_hsv(colors, proportions)
+
+        self.misses += 1
+        image = cv2.cvtColor(cv2.imread(image_path), cv2.COLOR_BGR2RGB)
+        colors, proportions = cluster_colours(*colour_histogram(image, darkness_threshold, mask), n_colors)
+        self.entries[key] = (colors.astype(np.float32), proportions.astype(np.float32))
+        self._dirty = True
+        return sort_by_hsv(colors, proportions)
+
+    def bin_counts(self, image_path: str, darkness_threshold: int = DARKNESS_THRESHOLD, mask: dict = None):
+        """Same as colour_extraction.bin_counts for an image file, but only bins images the cache has not seen."""
+        key = self.histogram_key(self._digest(image_path), darkness_threshold, mask)
+        counts = np.zeros(1 << (3 * QUANTIZE_BITS), dtype=np.int64)
+        if key in self.histograms:
+            self.hits += 1
+            bins, bin_totals = self.histograms[key]
+            counts[bins] = bin_totals
+            return counts
+
+        self.misses += 1
+        image = cv2.cvtColor(cv2.imread(image_path), cv2.COLOR_BGR2RGB)
+        counts = bin_counts(image, darkness_threshold, mask)
+        occupied = np.flatnonzero(counts)
+        self.histograms[key] = (occupied.astype(np.int32), counts[occupied])
+        self._dirty = True
+        return counts
+
+    def save(self):
+        """Write new entries to disk, merged with anything another script saved in the meantime."""
+        if not self._dirty:
+            print(f"Colour feature cache: {self.hits} hits, nothing new to save")
+            return
+        stored_entries, stored_histograms = self._read(self.path)
+        entries = {**stored_entries, **self.entries}
+        histograms = {**stored_histograms, **self.histograms}
+        keys = list(entries)
+        lengths = [len(entries[key][0]) for key in keys]
+        histogram_keys = list(histograms)
+        histogram_lengths = [len(histograms[key][0]) for key in histogram_keys]
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez_compressed(
+                f,
+                keys=np.array(keys),
+                offsets=np.concatenate(([0], np.cumsum(lengths))).astype(np.int64),
+                centres=np.concatenate([entries[key][0] for key in keys] or [np.zeros((0, 3), np.float32)]).reshape(-1, 3),
+                proportions=np.concatenate([entries[key][1] for key in keys] or [np.zeros(0, np.float32)]),
+                histogram_keys=np.array(histogram_keys),
+                histogram_offsets=np.concatenate(([0], np.cumsum(histogram_lengths))).astype(np.int64),
+                histogram_bins=np.concatenate([histograms[key][0] for key in histogram_keys] or [np.zeros(0, np.int32)]),
+                histogram_counts=np.concatenate([histograms[key][1] for key in histogram_keys] or [np.zeros(0, np.int64)]),
+            )
+        os.replace(tmp_path, self.path)
+        self.entries = entries
+        self.histograms = histograms
+        self._dirty = False
+        print(f"Colour feature cache: {self.hits} hits, {self.misses} misses, {len(entries)} entries and {len(histograms)} histograms in {self.path}")
@@ -0,0 +1,159 @@
+"""
+Dominant colour extraction shared by the segmentation, strip and grid scripts.
+
+Running KMeans over every non-black pixel of a full resolution frame means clustering hundreds of
+thousands of points per image. Instead, the pixels are first reduced to a quantized colour histogram
+(5 bits per channel, so at most 32768 bins), and KMeans runs over the occupied bins weighted by their
+pixel counts. Each bin is represented by the mean colour of the pixels that fell into it, so very
+little precision is lost, and the histogram is built a block of pixels at a time so memory stays
+bounded whatever the size of the image.
+
+When the couch's segmentation mask is known, only the pixels under it are gathered, straight from the
+run-length encoding. That skips the rest of the frame entirely and keeps dark couches, which the
+darkness threshold would otherwise throw away along with the blacked-out background.
+"""
+
+import cv2
+import numpy as np
+import matplotlib.colors as mcolors
+from sklearn.cluster import KMeans
+from mask_codec import mask_indices
+from tracing import span, traced, count
+
+QUANTIZE_BITS = 5  # Bits kept per channel when binning pixels
+ALGORITHM_VERSION = f"hist{QUANTIZE_BITS}-kmeans-1"  # Bump when a change alters the extracted colours
+DARKNESS_THRESHOLD = 30  # Pixels with every channel at or below this count as background
+CHUNK_PIXELS = 1 << 18  # Pixels binned at a time
+
+_SHIFT = 8 - QUANTIZE_BITS
+_BINS = 1 << (3 * QUANTIZE_BITS)
+
+
+def bin_index(pixels):
+    """Quantized histogram bin of each pixel in an (N, 3) RGB array, as (r << 2b) | (g << b) | b."""
+    q = pixels.astype(np.int32) >> _SHIFT
+    return (q[:, 0] << (2 * QUANTIZE_BITS)) | (q[:, 1] << QUANTIZE_BITS) | q[:, 2]
+
+
+def _accumulate(pixels, counts, sums=None):
+    """Add an (N, 3) block of RGB pixels to the histogram counts and, if given, the per-bin colour sums."""
+    index = bin_index(pixels)
+    counts += np.bincount(index, minlength=_BINS)
+    if sums is not None:
+        for channel in range(3):
+            sums[:, channel] += np.bincount(index, weights=pixels[:, channel], minlength=_BINS)
+
+
+def _non_dark_blocks(image, darkness_threshold: int):
+    """Yield the non-dark pixels of an RGB image as (N, 3) arrays, a block of rows at a time."""
+    chunk_rows = max(CHUNK_PIXELS // image.shape[1], 1)
+    for start in range(0, image.shape[0], chunk_rows):
+        block = image[start:start + chunk_rows]
+        # Same as np.any(pixels > threshold, axis=1), without the boolean temporary per channel
+        brightest = np.maximum(np.maximum(block[..., 0], block[..., 1]), block[..., 2])
+        yield block[brightest > darkness_threshold]
+
+
+def masked_pixels(image, rle: dict):
+    """Gather the pixels of an image under a run-length encoded mask as an (N, 3) array."""
+    if tuple(rle["size"]) != image.shape[:2]:
+        raise ValueError(f"Mask of size {rle['size']} does not match image of size {list(image.shape[:2])}")
+    return image.reshape(-1, 3)[mask_indices(rle)]
+
+
+def _pixel_blocks(image, darkness_threshold: int, mask):
+    if mask is None:
+        return _non_dark_blocks(image, darkness_threshold)
+    pixels = masked_pixels(image, mask)
+    return (pixels[start:start + CHUNK_PIXELS] for start in range(0, len(pixels), CHUNK_PIXELS))
+
+
+@traced()
+def bin_counts(image, darkness_threshold: int = DARKNESS_THRESHOLD, mask: dict = None):
+    """Pixel count of every quantized colour bin over the couch pixels of an RGB image (see colour_histogram)."""
+    counts = np.zeros(_BINS, dtype=np.int64)
+    for pixels in _pixel_blocks(image, darkness_threshold, mask):
+        _accumulate(pixels, counts)
+    return counts
+
+
+@traced()
+def colour_histogram(image, darkness_threshold: int = DARKNESS_THRESHOLD, mask: dict = None):
+    """
+    Bin the couch pixels of an RGB image into a quantized colour histogram.
+
+    The couch pixels are those under `mask`, a run-length encoded mask from mask_codec, or if there is
+    no mask, every pixel brighter than `darkness_threshold` in at least one channel.
+
+    Returns:
+    - tuple: (mean RGB colour of each occupied bin as an (M, 3) array, pixel count of each bin)
+    """
+    counts = np.zeros(_BINS, dtype=np.int64)
+    sums = np.zeros((_BINS, 3), dtype=np.float64)
+    for pixels in _pixel_blocks(image, darkness_threshold, mask):
+        _accumulate(pixels, counts, sums)
+    return _occupied(counts, sums)
+
+
+def pixel_histogram(pixels):
+    """Bin an (N, 3) array of RGB pixels, all of which count, into a quantized colour histogram."""
+    counts = np.zeros(_BINS, dtype=np.int64)
+    sums = np.zeros((_BINS, 3), dtype=np.float64)
+    for start in range(0, len(pixels), CHUNK_PIXELS):
+        _accumulate(pixels[start:start + CHUNK_PIXELS], counts, sums)
+    return _occupied(counts, sums)
+
+
+def _occupied(counts, sums):
+    occupied = np.flatnonzero(counts)
+    return sums[occupied] / counts[occupied, None], counts[occupied]
+
+
+def cluster_colours(bin_colours, bin_counts, n_colors: int = 5):
+    """
+    Weighted KMeans over the occupied histogram bins.
+
+    Returns:
+    - tuple: (cluster centres as an (n, 3) RGB array, share of pixels in each cluster), in KMeans order.
+      Fewer than `n_colors` clusters come back when there are fewer occupied bins than that.
+    """
+    n_clusters = min(n_colors, len(bin_colours))
+    kmeans = KMeans(n_clusters=n_clusters)
+    with span("kmeans", bins=len(bin_colours)):
+        kmeans.fit(bin_colours, sample_weight=bin_counts)
+    count("pixels_clustered", int(bin_counts.sum()))
+    weights = np.bincount(kmeans.labels_, weights=bin_counts, minlength=n_clusters)
+    return kmeans.cluster_centers_, weights / weights.sum()
+
+
+def sort_by_hsv(colors, proportions):
+    """Convert RGB colours to hex and sort them, with their proportions, by hue, saturation and brightness."""
+    hex_colors = [mcolors.to_hex(np.clip(color / 255, 0, 1)) for color in colors]
+    hsv_colors = [mcolors.rgb_to_hsv(np.clip(color / 255, 0, 1)) for color in colors]
+    sorted_indices = sorted(range(len(colors)), key=lambda x: (hsv_colors[x][0], hsv_colors[x][1], hsv_colors[x][2]))
+
+    sorted_hex_colors = [hex_colors[i] for i in sorted_indices]
+    sorted_proportions = [float(proportions[i]) for i in sorted_indices]
+    return sorted_hex_colors, sorted_proportions
+
+
+def get_weighted_colors(image_path, n_colors=5, darkness_threshold=DARKNESS_THRESHOLD, mask=None):
+    """
+    Find the dominant colours of a segmented couch image and the share of couch pixels each one covers.
+
+    Parameters:
+    - image_path (str): Path to the image, with the background blacked out.
+    - n_colors (int): Number of colours to find.
+    - darkness_threshold (int): Pixels with every channel at or below this are treated as background.
+      Ignored when there is a mask.
+    - mask (dict): Run-length encoded couch mask for the image, if known.
+
+    Returns:
+    - tuple: (hex colours, proportions), sorted by hue, saturation and brightness.
+    """
+    image = cv2.imread(image_path)
+    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)  # Convert to RGB
+
+    bin_colours, bin_counts = colour_histogram(image, darkness_threshold, mask)
+    colors, proportions = cluster_colours(bin_colours, bin_counts, n_colors)
+    return sort_by_hsv(colors, proportions)
@@ -0,0 +1,97 @@
+"""
+Lookup-table colour families for the grid scripts (09 and 10).
+
+Both scripts used to put each couch into a single family by running a chain of `if`s over the HSV
+value of its one dominant KMeans colour. Here the family rules are evaluated once, vectorized, for the
+centre of every bin of the quantized RGB cube used by colour_extraction, giving a lookup table from
+bin to family index. The share of each family in an image is then a single bincount over the image's
+quantized histogram, e.g. 62% Grey/White and 30% Yellow/Brown, instead of one label. The scripts take
+that histogram from ColourFeatureCache.bin_counts(), so unchanged images are not decoded again.
+"""
+
+import numpy as np
+import matplotlib.colors as mcolors
+from colour_extraction import QUANTIZE_BITS, DARKNESS_THRESHOLD, bin_counts
+
+# Families of 09-aggregate-colour-grid-families.py, in the order its rules are checked
+HSV_FAMILIES = ['Grey/White', 'Dark Grey/Black', 'Red', 'Orange', 'Yellow/Brown', 'Green', 'Cyan', 'Blue',
+                'Purple', 'Other']
+
+# Hue ranges in degrees of 10-aggregate-colour-grid-families-test.py
+HUE_RANGES = {
+    "Red": [(0, 10), (340, 360)],
+    "Orange": [(10, 30)],
+    "Yellow": [(30, 60)],
+    "Green": [(60, 150)],
+    "Cyan": [(150, 180)],
+    "Blue": [(180, 270)],
+    "Purple": [(270, 320)],
+    "Pink": [(320, 340)]
+}
+# Colours below either are neutral: their hue is noise (0 for an exact grey), so it would put them in "Red"
+NEUTRAL_SATURATION = 0.2  # As the grey rules of 09
+NEUTRAL_VALUE = 0.15
+
+
+def bin_centres():
+    """RGB colour in [0, 1] at the centre of every quantized bin, indexed like colour_extraction.bin_index."""
+    levels = (np.arange(1 << QUANTIZE_BITS) + 0.5) / (1 << QUANTIZE_BITS)
+    r, g, b = np.meshgrid(levels, levels, levels, indexing='ij')
+    return np.stack([r.ravel(), g.ravel(), b.ravel()], axis=1)
+
+
+def classify_hsv_families(hsv):
+    """Vectorized family rules of 09-aggregate-colour-grid-families.py, returning indices into HSV_FAMILIES."""
+    h, s, v = hsv[:, 0], hsv[:, 1], hsv[:, 2]
+    conditions = [
+        (s < 0.2) & (v > 0.8),  # Light grey/white
+        (s < 0.2) & (v < 0.5),  # Dark grey/black
+        (h < 0.05) | (h > 0.95),  # Reds
+        (0.05 <= h) & (h < 0.15),  # Oranges
+        (0.15 <= h) & (h < 0.35),  # Yellows/Browns
+        (0.35 <= h) & (h < 0.5),  # Greens
+        (0.5 <= h) & (h < 0.65),  # Cyans
+        (0.65 <= h) & (h < 0.85),  # Blues
+        (0.85 <= h) & (h < 0.95),  # Purples
+    ]
+    return np.select(conditions, np.arange(len(conditions)), default=len(conditions))
+
+
+def hue_range_classifier(color_families: dict, neutral: str = "Grey"):
+    """
+    Vectorized version of a {family: [(lower, upper), ...]} table of hue ranges in degrees.
+
+    Greys, near-greys and near-blacks have no meaningful hue, so they go to a `neutral` family of their
+    own, checked before the hue ranges.
+
+    Returns:
+    - tuple: (list of family names ending with `neutral` and 'Other', function mapping HSV arrays to family indices)
+    """
+    families = list(color_families) + [neutral, "Other"]
+
+    def classify(hsv):
+        hue = hsv[:, 0] * 360
+        conditions = [(hsv[:, 1] < NEUTRAL_SATURATION) | (hsv[:, 2] < NEUTRAL_VALUE)]
+        conditions += [np.logical_or.reduce([(lower <= hue) & (hue <= upper) for lower, upper in ranges])
+                       for ranges in color_families.values()]
+        choices = [len(color_families)] + list(range(len(color_families)))
+        return np.select(conditions, choices, default=len(families) - 1)
+
+    return families, classify
+
+
+def build_family_lut(classify):
+    """Evaluate a family classifier once for every quantized bin, returning a bin -> family index table."""
+    return classify(mcolors.rgb_to_hsv(bin_centres())).astype(np.uint8)
+
+
+def shares_from_counts(counts, lut, n_families: int):
+    """Share of the pixels of a quantized histogram, as returned by colour_extraction.bin_counts, in each family."""
+    shares = np.bincount(lut, weights=counts, minlength=n_families)
+    total = shares.sum()
+    return shares / total if total else shares
+
+
+def family_shares(image, lut, n_families: int, darkness_threshold: int = DARKNESS_THRESHOLD, mask: dict = None):
+    """Share of the couch pixels of an RGB image, under `mask` or else the non-dark ones, in each family."""
+    return shares_from_counts(bin_counts(image, darkness_threshold, mask), lut, n_families)
@@ -0,0 +1,160 @@
+"""
+Local nearest-named-colour classification of couch palettes, a free first pass before the LLM in stage 04.
+
+Each word of the stage 04 vocabulary is represented by a handful of prototype colours (light and dark
+greys, several browns, and so on), converted once to CIELAB so that distances between colours follow
+perceived differences. Every colour of a couch's palette votes for the names of its nearest
+prototypes: the vote is split between names by a softmax over their distances, so a colour sitting
+between beige and grey gives each only part of its weight, and the votes are weighted by the share
+of the couch the colour covers.
+
+The winning name's share of the vote is the confidence. A clean grey couch scores close to 1, while
+a patterned or in-between couch scores low and is better left to the LLM.
+
+Running this file scores the local names against the LLM's saved classifications, showing for a range
+of confidence thresholds how many couches would be named locally and how many of those names agree:
+
+    python src/colour_names.py --softness 2
+"""
+
+import argparse
+import glob
+import json
+import os
+import cv2
+import numpy as np
+import matplotlib.colors as mcolors
+
+# Same vocabulary as the stage 04 prompt, with prototype colours for each word
+NAMED_COLOURS = {
+    "white": ["#ffffff", "#f5f5f0", "#e8e8e3"],
+    "black": ["#000000", "#1a1a1a", "#2b2b2b"],
+    "grey": ["#4a4a4a", "#606060", "#808080", "#a0a0a0", "#c0c0c0"],
+    "beige": ["#f5f5dc", "#e3d5b8", "#d8c8a8", "#c8b496"],
+    "blue": ["#2c3e66", "#1f4e9c", "#4169e1", "#5b7fa6", "#87a9d6"],
+    "green": ["#3f5f3f", "#2e7d32", "#556b2f", "#6b8e23", "#8fbc8f"],
+    "red": ["#8b1a1a", "#b22222", "#c62828", "#e53935"],
+    "brown": ["#5c4033", "#6f4e37", "#7b5b3a", "#8b5a2b", "#a0522d"],
+    "purple": ["#5d3a6e", "#6a1b9a", "#800080", "#9370db"],
+    "yellow": ["#e6c35c", "#f0c808", "#fdd835", "#ffeb3b"],
+    "orange": ["#d2691e", "#e07b39", "#ef6c00", "#ff8c00"],
+    "pink": ["#d87093", "#e8a0b0", "#f48fb1", "#ffc0cb"],
+}
+# Delta E over which a colour's vote shifts from its nearest name to the next. Chosen with the agreement
+# report: at 8 only 18 of the 132 labelled couches reach a confidence of 0.6, too few for a threshold to select on
+SOFTNESS = 2.0
+CLASSIFICATIONS_DIR = "data/couch_colour_classifications_2"
+SEGMENTED_PATTERN = "data/couch_images_segmented/{video_id}.jpg"
+
+
+def hex_to_lab(hex_colors):
+    """Convert hex colours to an (N, 3) array of CIELAB coordinates (L in 0-100)."""
+    rgb = np.array([mcolors.to_rgb(color) for color in hex_colors], dtype=np.float32).reshape(-1, 1, 3)
+    return cv2.cvtColor(rgb, cv2.COLOR_RGB2Lab).reshape(-1, 3).astype(np.float64)
+
+
+class ColourNameIndex:
+    """
+    Nearest-neighbour index of named prototype colours in CIELAB.
+
+    Parameters:
+    - named_colours (dict): {name: [hex colours]} prototypes for each name.
+    - softness (float): Temperature of the softmax splitting each colour's vote between names, in Delta E.
+    """
+
+    def __init__(self, named_colours: dict = NAMED_COLOURS, softness: float = SOFTNESS):
+        self.names = list(named_colours)
+        self.softness = softness
+        hex_colors = [color for colors in named_colours.values() for color in colors]
+        self.prototypes = hex_to_lab(hex_colors)
+        self.prototype_names = np.repeat(np.arange(len(self.names)), [len(colors) for colors in named_colours.values()])
+
+    def name_distances(self, lab):
+        """Delta E (CIE76) from each of an (N, 3) array of Lab colours to the nearest prototype of every name."""
+        distances = np.linalg.norm(lab[:, None, :] - self.prototypes[None, :, :], axis=2)
+        nearest = np.full((len(lab), len(self.names)), np.inf)
+        for name_index in range(len(self.names)):
+            nearest[:, name_index] = distances[:, self.prototype_names == name_index].min(axis=1)
+        return nearest
+
+    def classify(self, hex_colors, proportions=None):
+        """
+        Name the colour of a palette.
+
+        Parameters:
+        - hex_colors (list): The palette's colours.
+        - proportions (list): Share of the couch each colour covers, equal shares if omitted.
+
+        Returns:
+        - tuple: (name, confidence in [0, 1], {name: share of the vote}) for the names that got any vote.
+        """
+        if not hex_colors:
+            return None, 0.0, {}
+        weights = np.ones(len(hex_colors)) if proportions is None else np.asarray(proportions, dtype=np.float64)
+        weights = weights / weights.sum()
+
+        distances = self.name_distances(hex_to_lab(hex_colors))
+        # Softmax over negative distances, shifted by the nearest so the exponent never overflows
+        votes = np.exp(-(distances - distances.min(axis=1, keepdims=True)) / self.softness)
+        votes /= votes.sum(axis=1, keepdims=True)
+        scores = weights @ votes
+
+        best = int(np.argmax(scores))
+        shares = {name: round(float(score), 4) for name, score in zip(self.names, scores) if score >= 0.0001}
+        return self.names[best], float(scores[best]), shares
+
+
+def agreement(index: ColourNameIndex, palettes: dict, labels: dict, thresholds) -> list:
+    """
+    Agreement of local names with reference labels, such as the LLM's, at each confidence threshold.
+
+    Parameters:
+    - palettes (dict): {video_id: (hex colours, proportions)}
+    - labels (dict): {video_id: name}, for the same videos.
+
+    Returns:
+    - list: (threshold, couches named at or above it, how many of those names match the label) per threshold.
+    """
+    named = []
+    for video_id, palette in palettes.items():
+        name, confidence, _ = index.classify(*palette)
+        named.append((confidence, name == labels[video_id]))
+    return [(threshold, sum(confidence >= threshold for confidence, _ in named),
+             sum(agrees for confidence, agrees in named if confidence >= threshold)) for threshold in thresholds]
+
+
+def llm_labels(directory: str = CLASSIFICATIONS_DIR) -> dict:
+    """{video_id: name} of the classifications the LLM saved, leaving out those named locally."""
+    labels = {}
+    for path in glob.glob(os.path.join(directory, "*.json")):
+        with open(path, "r") as f:
+            classification = json.load(f)
+        if classification.get("classifier", "llm") == "llm":
+            labels[classification["video_id"]] = classification["couch_colour"].strip().lower()
+    return labels
+
+
+if __name__ == "__main__":
+    from colour_cache import ColourFeatureCache
+    from detection_store import DetectionStore
+
+    parser = argparse.ArgumentParser(description="Score local colour names against the LLM's classifications.")
+    parser.add_argument("--softness", type=float, default=SOFTNESS, help="Softmax temperature, in Delta E")
+    args = parser.parse_args()
+
+    labels = llm_labels()
+    detections = DetectionStore()
+    colour_cache = ColourFeatureCache()
+    palettes = {}
+    for video_id in labels:
+        image_path = SEGMENTED_PATTERN.format(video_id=video_id)
+        if os.path.exists(image_path):
+            couch = detections.get(video_id) or {}
+            palettes[video_id] = colour_cache.get_weighted_colors(image_path, n_colors=5, mask=couch.get("couch_mask"))
+    colour_cache.save()
+
+    print(f"{len(palettes)} couches with an LLM label and a segmented image, softness {args.softness:g}")
+    print("threshold  named locally  agreeing")
+    for threshold, named, agreeing in agreement(ColourNameIndex(softness=args.softness), palettes, labels,
+                                                (0.0, 0.5, 0.6, 0.7, 0.8, 0.9, 0.93, 0.95)):
+        print(f"{threshold:>9.2f}  {named:>13}  {agreeing:>8}" + (f"  ({agreeing / named:.0%})" if named else ""))
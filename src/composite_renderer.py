@@ -0,0 +1,163 @@
+"""
+Vectorized rendering of the colour strip and grid composites made by scripts 07 to 10.
+
+Every couch is a row of a palette matrix: its colours and the share of the strip (or square) each
+covers, padded with zero shares to the same number of colours. A whole block of couches is painted at
+once by working out, for every pixel along the strip, which segment it falls in, and broadcasting that
+profile across the strip's height. Segments are int(length * proportion) pixels long and any pixels
+left over at the end stay black, as they did when each strip was painted segment by segment.
+
+Composites are produced as a stream of row blocks. Small ones are assembled in memory and saved with
+PIL as before; composites too big for that, or for JPEG, are streamed row by row into a PNG, so
+catalogues of 100k couches render in bounded memory.
+"""
+
+import os
+import struct
+import zlib
+import numpy as np
+import matplotlib.colors as mcolors
+from PIL import Image
+
+CHUNK_COUCHES = 256  # Couches rendered per block
+MAX_IN_MEMORY_PIXELS = 50_000_000  # Larger composites are streamed to a PNG
+MAX_JPEG_SIDE = 65500  # Largest width or height a JPEG can hold
+
+
+def palette_matrix(palettes):
+    """
+    Stack (hex colours, proportions) pairs into a palette matrix.
+
+    Returns:
+    - tuple: (colours as an (N, K, 3) uint8 array, proportions as an (N, K) array), where K is the most
+      colours any couch has and missing colours have a proportion of 0.
+    """
+    n_colours = max((len(hex_colors) for hex_colors, _ in palettes), default=0)
+    colours = np.zeros((len(palettes), n_colours, 3), dtype=np.uint8)
+    proportions = np.zeros((len(palettes), n_colours))
+    for i, (hex_colors, shares) in enumerate(palettes):
+        for j, (color, proportion) in enumerate(zip(hex_colors, shares)):
+            colours[i, j] = [int(c * 255) for c in mcolors.hex2color(color)]
+            proportions[i, j] = proportion
+    return colours, proportions
+
+
+def segment_profiles(colours, proportions, length: int):
+    """Colour of every pixel along each couch's strip, as an (N, length, 3) uint8 array."""
+    ends = np.cumsum((length * proportions).astype(np.int64), axis=1)
+    segment = (np.arange(length)[None, :, None] >= ends[:, None, :]).sum(axis=2)
+    # Pixels past the last segment index one past the end, which is padded with black
+    padded = np.concatenate([colours, np.zeros_like(colours[:, :1])], axis=1)
+    return padded[np.arange(len(colours))[:, None], segment]
+
+
+def strip_rows(colours, proportions, width: int = 300, height: int = 50, chunk: int = CHUNK_COUCHES):
+    """Yield the composite of one horizontal strip per couch, stacked top to bottom, a block at a time."""
+    for start in range(0, len(colours), chunk):
+        profiles = segment_profiles(colours[start:start + chunk], proportions[start:start + chunk], width)
+        block = np.broadcast_to(profiles[:, None], (len(profiles), height, width, 3))
+        yield block.reshape(-1, width, 3)
+
+
+def grid_rows(colours, proportions, num_columns: int = 10, square_size: int = 100, chunk: int = CHUNK_COUCHES):
+    """Yield the composite of one square per couch, colours stacked top to bottom, laid out in rows of the grid."""
+    rows_per_block = max(chunk // num_columns, 1)
+    couches_per_block = rows_per_block * num_columns
+    for start in range(0, len(colours), couches_per_block):
+        profiles = segment_profiles(colours[start:start + couches_per_block],
+                                    proportions[start:start + couches_per_block], square_size)
+        # Fill the last row of the grid with black squares
+        rows = -(-len(profiles) // num_columns)
+        padding = rows * num_columns - len(profiles)
+        profiles = np.concatenate([profiles, np.zeros((padding, square_size, 3), dtype=np.uint8)])
+        squares = np.broadcast_to(profiles[:, :, None], (len(profiles), square_size, square_size, 3))
+        block = squares.reshape(rows, num_columns, square_size, square_size, 3).transpose(0, 2, 1, 3, 4)
+        yield block.reshape(rows * square_size, num_columns * square_size, 3)
+
+
+class PNGStreamWriter:
+    """
+    Write an RGB PNG a block of rows at a time, without holding the image in memory.
+
+    Parameters:
+    - path (str): Output path.
+    - width, height (int): Size of the image. Exactly `height` rows must be written before close().
+    """
+
+    def __init__(self, path: str, width: int, height: int):
+        self.width = width
+        self.height = height
+        self.rows = 0
+        self._compressor = zlib.compressobj()
+        self._file = open(path, "wb")
+        self._file.write(b"\x89PNG\r\n\x1a\n")
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+
+    def _chunk(self, kind: bytes, data: bytes):
+        self._file.write(struct.pack(">I", len(data)) + kind + data)
+        self._file.write(struct.pack(">I", zlib.crc32(kind + data)))
+
+    def write(self, rows):
+        """Append an (n, width, 3) uint8 block of rows."""
+        rows = np.ascontiguousarray(rows, dtype=np.uint8)
+        # Every scanline starts with a filter type byte, 0 meaning unfiltered
+        scanlines = np.concatenate([np.zeros((len(rows), 1), dtype=np.uint8), rows.reshape(len(rows), -1)], axis=1)
+        data = self._compressor.compress(scanlines.tobytes())
+        if data:
+            self._chunk(b"IDAT", data)
+        self.rows += len(rows)
+
+    def close(self):
+        if self.rows != self.height:
+            self._file.close()
+            raise ValueError(f"Wrote {self.rows} rows to a PNG of height {self.height}")
+        self._chunk(b"IDAT", self._compressor.flush())
+        self._chunk(b"IEND", b"")
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.close()
+        else:
+            self._file.close()
+
+
+def composite_path(path: str) -> str:
+    """The composite saved for `path` by save_composite(): `path` itself, or the PNG it fell back to."""
+    png_path = os.path.splitext(path)[0] + ".png"
+    return png_path if not os.path.exists(path) and os.path.exists(png_path) else path
+
+
+def save_composite(path: str, blocks, width: int, height: int) -> str:
+    """
+    Save a composite produced as a stream of row blocks.
+
+    Composites small enough are assembled in memory and saved to `path` with PIL. Larger ones, or ones a
+    JPEG cannot hold, are streamed to a PNG at the same path with a .png extension. Whichever of the two
+    files is not written is removed, so a composite from an earlier run is never mistaken for this one.
+
+    Returns:
+    - str: The path that was written.
+    """
+    png_path = os.path.splitext(path)[0] + ".png"
+    fits_jpeg = max(width, height) <= MAX_JPEG_SIDE or not path.lower().endswith((".jpg", ".jpeg"))
+    if width * height <= MAX_IN_MEMORY_PIXELS and fits_jpeg:
+        composite_image = np.zeros((height, width, 3), dtype=np.uint8)
+        y_position = 0
+        for block in blocks:
+            composite_image[y_position:y_position + len(block)] = block
+            y_position += len(block)
+        Image.fromarray(composite_image).save(path)
+        written, stale = path, png_path
+    else:
+        with PNGStreamWriter(png_path, width, height) as writer:
+            for block in blocks:
+                writer.write(block)
+        written, stale = png_path, path
+
+    if stale != written and os.path.exists(stale):
+        os.remove(stale)
+    return written
@@ -0,0 +1,129 @@
+"""
+Batched couch detection for 02-get-couch-image.py.
+
+A background thread decodes frames from a FrameSampler into a bounded queue while the main thread
+runs the YOLO model on batches of frames. On CPU-only machines this keeps the decoder and the model
+busy at the same time, and batching amortises the per-call overhead of the model.
+
+The results per frame are the same as calling the model one frame at a time: the box ratio of the
+first couch detected above the confidence threshold, or None.
+"""
+
+import queue
+import threading
+from tracing import span, count
+
+BATCH_SIZE = 8  # Number of frames passed to the model in a single call
+QUEUE_SIZE = 32  # Maximum number of decoded frames waiting for the model
+
+_END_OF_STREAM = object()
+
+
+def couch_box_ratio(result, frame_shape, couch_class: str, confidence_threshold: float):
+    """Return the area of the first confident couch box as a share of the frame, or None."""
+    for box in result.boxes:
+        if result.names[int(box.cls[0])] == couch_class and box.conf[0] > confidence_threshold:
+            x_min, y_min, x_max, y_max = map(int, box.xyxy[0])
+            box_area = (x_max - x_min) * (y_max - y_min)
+            frame_area = frame_shape[0] * frame_shape[1]
+            return box_area / frame_area
+    return None
+
+
+def _put(item_queue: queue.Queue, item, stop: threading.Event) -> bool:
+    """Put an item on the queue, giving up if the consumer stops. Returns whether it was put."""
+    while not stop.is_set():
+        try:
+            item_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _produce(items, item_queue: queue.Queue, stop: threading.Event):
+    # Every put, including the end of stream and errors, gives up once the consumer has stopped, so a
+    # full queue nobody reads any more cannot block the producer
+    try:
+        for item in items:
+            if not _put(item_queue, item, stop):
+                return
+    except Exception as e:  # hand producer errors over to the consuming thread
+        _put(item_queue, e, stop)
+        return
+    _put(item_queue, _END_OF_STREAM, stop)
+
+
+def prefetched_batches(items, batch_size: int, queue_size: int):
+    """
+    Yield lists of up to `batch_size` items, while a background thread keeps pulling items from `items`.
+
+    At most `queue_size` items are held in the queue, so decoding or loading runs ahead of the consumer
+    without unbounded memory. Errors raised by `items` are re-raised in the consuming thread.
+    """
+    item_queue = queue.Queue(maxsize=max(queue_size, batch_size))
+    stop = threading.Event()
+    producer = threading.Thread(target=_produce, args=(items, item_queue, stop), daemon=True)
+    producer.start()
+
+    batch = []
+    try:
+        while True:
+            item = item_queue.get()
+            if item is _END_OF_STREAM:
+                break
+            if isinstance(item, Exception):
+                raise item
+            batch.append(item)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    finally:
+        # Unblock the producer if the caller stopped iterating early
+        stop.set()
+        producer.join()
+
+
+class DetectionEngine:
+    """
+    Run a YOLO model over (frame_index, frame) samples in batches, decoding in a background thread.
+
+    Parameters:
+    - model: An ultralytics YOLO model.
+    - couch_class (str): Class name to look for in the detections.
+    - confidence_threshold (float): Minimum confidence for a detection to count.
+    - batch_size (int): Number of frames per model call.
+    - queue_size (int): Maximum number of decoded frames held in memory.
+    """
+
+    def __init__(self, model, couch_class: str, confidence_threshold: float,
+                 batch_size: int = BATCH_SIZE, queue_size: int = QUEUE_SIZE):
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        self.model = model
+        self.couch_class = couch_class
+        self.confidence_threshold = confidence_threshold
+        self.batch_size = batch_size
+        self.queue_size = max(queue_size, batch_size)
+        self.inferences = 0
+
+    def _run_batch(self, batch):
+        with span("detect_batch", frames=len(batch)):
+            results = self.model([frame for _, frame in batch])
+        self.inferences += len(batch)
+        count("inferences", len(batch))
+        for (frame_index, frame), result in zip(batch, results):
+            box_ratio = couch_box_ratio(result, frame.shape, self.couch_class, self.confidence_threshold)
+            yield frame_index, frame, box_ratio
+
+    def detect(self, samples):
+        """
+        Yield (frame_index, frame, box_ratio) for every sample, in the order they were decoded.
+
+        Parameters:
+        - samples: Iterable of (frame_index, frame) pairs, e.g. a FrameSampler.
+        """
+        for batch in prefetched_batches(samples, self.batch_size, self.queue_size):
+            yield from self._run_batch(batch)
@@ -0,0 +1,146 @@
+"""
+Append-only store for the couch detection records written by 02-get-couch-image.py.
+
+Every record is one JSON line in data/couch_info.jsonl. Saving a record appends a single line and
+fsyncs it, instead of reading and rewriting the whole of data/couch_info.json for every video, so
+the cost of a save no longer grows with the size of the catalogue and a crash can at worst lose the
+line that was being written. When a video is saved more than once the last line wins.
+
+On open the file is scanned once to build an index of video_id -> byte offset, and a torn last line
+left behind by a crash is truncated away. If the store does not exist yet it is seeded from the old
+data/couch_info.json. Running this file exports the store back to data/couch_info.json for anything
+that still expects the old format.
+"""
+
+import json
+import os
+
+STORE_PATH = "data/couch_info.jsonl"
+LEGACY_JSON_PATH = "data/couch_info.json"
+LEGACY_FIELDS = ("video_id", "couch_detected", "image_path")  # Fields of a couch_info.json entry
+
+
+class DetectionStore:
+    """
+    Crash-safe, append-only store of detection records keyed by video_id.
+
+    Parameters:
+    - path (str): Path to the JSONL file backing the store.
+    - legacy_path (str): couch_info.json to import from when the store does not exist yet.
+    """
+
+    def __init__(self, path: str = STORE_PATH, legacy_path: str = LEGACY_JSON_PATH):
+        self.path = path
+        self.index = {}  # video_id -> byte offset of its latest record
+
+        if not os.path.exists(path) and legacy_path and os.path.exists(legacy_path):
+            self._import_legacy(legacy_path)
+        self._load()
+
+    def _import_legacy(self, legacy_path: str):
+        with open(legacy_path, "r") as f:
+            legacy = json.load(f)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        # Write to a temporary file first so a crash here never leaves a half-imported store behind
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            for record in legacy.values():
+                f.write(self._encode(record))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        print(f"Imported {len(legacy)} detection records from {legacy_path} into {self.path}")
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+
+        good_until = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                self.index[record["video_id"]] = good_until
+                good_until += len(line)
+
+        # Drop a partial line left behind by a crash mid-append
+        if good_until < os.path.getsize(self.path):
+            print(f"Truncating incomplete record at the end of {self.path}")
+            with open(self.path, "r+b") as f:
+                f.truncate(good_until)
+
+    @staticmethod
+    def _encode(record: dict) -> bytes:
+        return (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+
+    def __contains__(self, video_id: str) -> bool:
+        return video_id in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def video_ids(self):
+        return list(self.index)
+
+    def get(self, video_id: str, default=None):
+        """Return the latest record for a video, or `default` if there is none."""
+        offset = self.index.get(video_id)
+        if offset is None:
+            return default
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            return json.loads(f.readline())
+
+    def records(self):
+        """Return the latest record of every video, in the order the videos were first saved."""
+        latest = {}
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, "rb") as f:
+            for line in f:
+                record = json.loads(line)
+                latest[record["video_id"]] = record
+        return list(latest.values())
+
+    def couch_masks(self) -> dict:
+        """Return the run-length encoded couch mask of every video that has one, keyed by video_id."""
+        return {record["video_id"]: record["couch_mask"] for record in self.records() if record.get("couch_mask")}
+
+    def put(self, record: dict):
+        """Append a record. It replaces any earlier record for the same video_id."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "ab") as f:
+            offset = f.tell()
+            f.write(self._encode(record))
+            f.flush()
+            os.fsync(f.fileno())
+        self.index[record["video_id"]] = offset
+
+    def update(self, video_id: str, **fields):
+        """Append a copy of the latest record for a video with some fields changed."""
+        record = self.get(video_id, {"video_id": video_id})
+        record.update(fields)
+        self.put(record)
+        return record
+
+    def export_json(self, path: str = LEGACY_JSON_PATH):
+        """
+        Write the store out in the old couch_info.json format, replacing the file atomically.
+
+        Only the original fields are exported, later additions such as masks stay in the store.
+        """
+        data = {record["video_id"]: {field: record.get(field) for field in LEGACY_FIELDS}
+                for record in self.records()}
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=4)
+        os.replace(tmp_path, path)
+        print(f"Exported {len(data)} detection records to {path}")
+
+
+if __name__ == "__main__":
+    DetectionStore().export_json()
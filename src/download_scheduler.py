@@ -0,0 +1,133 @@
+"""
+Prefetching download scheduler for 02-get-couch-image.py.
+
+Downloading a video and running detection on it used to happen strictly one after the other, so the
+network sat idle while the model ran and the CPU sat idle while yt_dlp downloaded. The scheduler keeps
+the next few downloads running in background threads while the caller works on the current video.
+
+- `prefetch` bounds how many videos are downloading or downloaded-but-not-yet-processed at once
+- `max_concurrent` bounds how many downloads run at the same time
+- `max_prefetch_bytes` and `min_free_bytes` stop new downloads when the prefetched videos get too big
+  or the disk gets too full
+- failed downloads are retried with exponential backoff, without holding up the videos behind them
+
+The download function is passed in, so anything that maps a video_id to a local file path (or None on
+failure) can be scheduled, e.g. yt_dlp pointed at a local HTTP server instead of YouTube.
+"""
+
+import heapq
+import os
+import shutil
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+PREFETCH = 2  # Videos downloaded ahead of the one being processed
+MAX_CONCURRENT = 2  # Downloads running at the same time
+MAX_RETRIES = 3  # Attempts per video after the first one fails
+RETRY_DELAY = 30  # Seconds before the first retry, doubled for every retry after that
+
+
+class DownloadScheduler:
+    """
+    Iterate over (video_id, video_path) pairs as downloads finish, prefetching ahead of the caller.
+
+    Parameters:
+    - video_ids (list): Video IDs to download, in the order they should be started.
+    - download (callable): Takes a video_id and returns the local path, or None if the download failed.
+    - prefetch (int): Maximum number of videos downloading or waiting to be processed.
+    - max_concurrent (int): Maximum number of downloads running at once.
+    - max_prefetch_bytes (int): Stop starting downloads while the waiting videos take more than this.
+    - min_free_bytes (int): Stop starting downloads while the disk holding `download_dir` has less free space.
+    - download_dir (str): Directory the videos are downloaded to, used for the free space check.
+    - max_retries (int): Number of retries for a failed download before giving up on it.
+    - retry_delay (float): Seconds before the first retry, doubled for each further attempt.
+
+    Videos that still fail after all retries are left out and listed in `failed`.
+    """
+
+    def __init__(self, video_ids, download, prefetch: int = PREFETCH, max_concurrent: int = MAX_CONCURRENT,
+                 max_prefetch_bytes: int = None, min_free_bytes: int = None, download_dir: str = ".",
+                 max_retries: int = MAX_RETRIES, retry_delay: float = RETRY_DELAY):
+        self.video_ids = list(video_ids)
+        self.download = download
+        self.prefetch = max(prefetch, 1)
+        self.max_concurrent = max(max_concurrent, 1)
+        self.max_prefetch_bytes = max_prefetch_bytes
+        self.min_free_bytes = min_free_bytes
+        self.download_dir = download_dir
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.failed = {}
+
+    def _attempt(self, video_id: str):
+        video_path = self.download(video_id)
+        if video_path is None or not os.path.exists(video_path):
+            raise RuntimeError(f"Download of {video_id} did not produce a file")
+        return video_path
+
+    def _has_disk_room(self, ready, in_flight) -> bool:
+        # Always allow one download when nothing else is buffered, so we degrade to sequential processing
+        if not ready and not in_flight:
+            return True
+        if self.max_prefetch_bytes is not None:
+            waiting_bytes = sum(os.path.getsize(path) for _, path in ready if os.path.exists(path))
+            if waiting_bytes >= self.max_prefetch_bytes:
+                return False
+        if self.min_free_bytes is not None:
+            if shutil.disk_usage(self.download_dir).free < self.min_free_bytes:
+                return False
+        return True
+
+    def _next_item(self, pending, retries):
+        # Retries whose backoff has passed go first, otherwise start the next new video
+        if retries and retries[0][0] <= time.monotonic():
+            _, video_id, attempt = heapq.heappop(retries)
+            return video_id, attempt
+        if pending:
+            return pending.popleft(), 0
+        return None
+
+    def __iter__(self):
+        pending = deque(self.video_ids)
+        retries = []  # heap of (ready_at, video_id, attempt)
+        in_flight = {}  # future -> (video_id, attempt)
+        ready = deque()  # (video_id, video_path) downloaded and waiting for the caller
+        self.failed = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrent) as pool:
+            while pending or retries or in_flight or ready:
+                while len(in_flight) + len(ready) < self.prefetch and self._has_disk_room(ready, in_flight):
+                    item = self._next_item(pending, retries)
+                    if item is None:
+                        break
+                    video_id, attempt = item
+                    in_flight[pool.submit(self._attempt, video_id)] = (video_id, attempt)
+
+                if ready:
+                    # Downloads keep running in the pool while the caller processes this video
+                    yield ready.popleft()
+                    continue
+
+                if not in_flight:
+                    # Only backed-off retries are left, wait for the earliest one
+                    time.sleep(max(retries[0][0] - time.monotonic(), 0))
+                    continue
+
+                # A due retry only needs waking up for when it can be started, otherwise the wait would
+                # return at once and spin until a download finishes
+                slot_free = len(in_flight) < self.prefetch and self._has_disk_room(ready, in_flight)
+                timeout = max(retries[0][0] - time.monotonic(), 0) if retries and slot_free else None
+                done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    video_id, attempt = in_flight.pop(future)
+                    try:
+                        ready.append((video_id, future.result()))
+                    except Exception as e:
+                        if attempt < self.max_retries:
+                            delay = self.retry_delay * 2 ** attempt
+                            print(f"Download of {video_id} failed ({e}), retrying in {delay:.0f}s")
+                            heapq.heappush(retries, (time.monotonic() + delay, video_id, attempt + 1))
+                        else:
+                            print(f"Giving up on {video_id} after {attempt + 1} attempts: {e}")
+                            self.failed[video_id] = str(e)
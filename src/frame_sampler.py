@@ -0,0 +1,229 @@
+"""
+Frame samplers used by 02-get-couch-image.py to pull every nth frame out of a video.
+
+Seeking with cap.set(cv2.CAP_PROP_POS_FRAMES, ...) after every sample makes the decoder start again
+from the previous keyframe each time, which is where most of the wall time went on long 1080p episodes.
+The samplers here avoid that in three different ways:
+
+- "grab": read the video sequentially and only convert the frames we keep (cap.grab() skips the rest)
+- "keyframe": seek to the keyframe nearest each sample, so every sample costs a single decode
+- "timestamp": seek to the exact sample timestamp, decoding forward from the previous keyframe
+
+The keyframe and timestamp modes need PyAV (`pip install av`) for accurate seeking. With mode="auto"
+the sampler probes the GOP structure of the container and picks the mode that decodes the fewest frames.
+"""
+
+import bisect
+import cv2
+
+try:
+    import av
+except ImportError:  # PyAV is optional, without it we always fall back to "grab"
+    av = None
+
+SAMPLER_MODES = ("grab", "keyframe", "timestamp")
+
+
+def probe_keyframes(video_path: str):
+    """
+    Read the packet headers of the video stream to find keyframe positions without decoding anything.
+
+    Returns:
+    - tuple: (sorted list of keyframe frame indices, total number of frames), or (None, None) if PyAV is missing.
+    """
+    if av is None:
+        return None, None
+
+    with av.open(video_path) as container:
+        stream = container.streams.video[0]
+        fps = float(stream.average_rate or stream.guessed_rate)
+        start = stream.start_time or 0
+        keyframes = set()
+        frame_total = 0
+        for packet in container.demux(stream):
+            if packet.pts is None:  # flush packet at the end of the stream
+                continue
+            frame_total += 1
+            if packet.is_keyframe:
+                keyframes.add(int(round((packet.pts - start) * stream.time_base * fps)))
+
+    return sorted(keyframes), frame_total
+
+
+def estimate_frames_per_sample(mode: str, frame_interval: int, keyframes, frame_total: int) -> float:
+    """Average number of frames the decoder has to produce for each sample in the given mode."""
+    if mode == "grab":
+        return float(frame_interval)
+    if mode == "keyframe":
+        return 1.0
+
+    # Timestamp seeks decode from the keyframe at or before the target up to the target itself
+    targets = range(0, frame_total, frame_interval)
+    decoded = 0
+    for target in targets:
+        previous_keyframe = keyframes[max(bisect.bisect_right(keyframes, target) - 1, 0)]
+        decoded += target - previous_keyframe + 1
+    return decoded / max(len(targets), 1)
+
+
+def choose_sampler_mode(frame_interval: int, keyframes, frame_total: int) -> str:
+    """Pick the sampling mode that decodes the fewest frames for this container's GOP structure."""
+    if not keyframes or len(keyframes) < 2 or not frame_total:
+        return "grab"
+
+    costs = {
+        "grab": estimate_frames_per_sample("grab", frame_interval, keyframes, frame_total),
+        "timestamp": estimate_frames_per_sample("timestamp", frame_interval, keyframes, frame_total),
+    }
+    # Keyframe sampling is only a fair substitute when keyframes are at least as dense as the samples
+    mean_gop = frame_total / len(keyframes)
+    if mean_gop <= frame_interval:
+        costs["keyframe"] = estimate_frames_per_sample("keyframe", frame_interval, keyframes, frame_total)
+
+    # min() keeps the first of equal costs, so grab wins ties and we keep the exact frames
+    return min(costs, key=costs.get)
+
+
+class FrameSampler:
+    """
+    Iterate over (frame_index, frame) pairs, one every `frame_interval` frames, as BGR numpy arrays.
+
+    After iterating, `frames_decoded` and `samples` hold the decoding work done, and
+    `frames_decoded_per_sample` summarises it.
+    """
+
+    def __init__(self, video_path: str, frame_interval: int, mode: str = "auto"):
+        if mode != "auto" and mode not in SAMPLER_MODES:
+            raise ValueError(f"Unknown sampler mode {mode!r}, expected 'auto' or one of {SAMPLER_MODES}")
+        if mode in ("keyframe", "timestamp") and av is None:
+            raise ImportError(f"Sampler mode {mode!r} needs PyAV, install it with `pip install av`")
+
+        self.video_path = video_path
+        self.frame_interval = frame_interval
+        cap = cv2.VideoCapture(video_path)
+        self.fps = cap.get(cv2.CAP_PROP_FPS)
+        cap.release()
+        self.keyframes, self.frame_total = (None, None) if mode == "grab" else probe_keyframes(video_path)
+        if mode == "auto":
+            mode = choose_sampler_mode(frame_interval, self.keyframes, self.frame_total)
+        self.mode = mode
+        self.frames_decoded = 0
+        self.samples = 0
+
+    @property
+    def frames_decoded_per_sample(self) -> float:
+        return self.frames_decoded / self.samples if self.samples else 0.0
+
+    def __iter__(self):
+        self.frames_decoded = 0
+        self.samples = 0
+        if self.mode == "grab":
+            samples = self._grab_samples()
+        else:
+            samples = self._seek_samples(exact=self.mode == "timestamp")
+        for frame_index, frame in samples:
+            self.samples += 1
+            yield frame_index, frame
+
+    def _grab_samples(self):
+        cap = cv2.VideoCapture(self.video_path)
+        frame_index = 0
+        try:
+            while cap.isOpened():
+                if frame_index % self.frame_interval == 0:
+                    ret, frame = cap.read()
+                else:
+                    # grab() still decodes, but skips the colour conversion and the copy out of the decoder
+                    ret, frame = cap.grab(), None
+                if not ret:
+                    break
+                self.frames_decoded += 1
+                if frame is not None:
+                    yield frame_index, frame
+                frame_index += 1
+        finally:
+            cap.release()
+
+    def _seek_samples(self, exact: bool):
+        with FrameReader(self.video_path) as reader:
+            last_yielded = None
+            for target in range(0, self.frame_total, self.frame_interval):
+                frame_index, frame = reader.read(target, exact=exact)
+                self.frames_decoded = reader.frames_decoded
+                if frame is None:
+                    return
+                if frame_index == last_yielded:  # two targets can share a keyframe
+                    continue
+                last_yielded = frame_index
+                yield frame_index, frame
+
+
+class FrameReader:
+    """
+    Random access to single frames of a video by frame index, counting the frames decoded on the way.
+
+    Uses PyAV when it is installed, so a read decodes forward from the keyframe at or before the target.
+    Without PyAV it falls back to OpenCV seeking, which is slower and only estimates `frames_decoded`.
+
+    `video_path` can also be an http(s) URL, in which case only the byte ranges around the frames that
+    are read get fetched. `options` are passed on to FFmpeg, e.g. {"headers": "User-Agent: ...\r\n"}.
+    """
+
+    def __init__(self, video_path: str, options: dict = None):
+        self.video_path = video_path
+        self.frames_decoded = 0
+        if av is not None:
+            self.container = av.open(video_path, options=options or {})
+            self.stream = self.container.streams.video[0]
+            self.stream.thread_type = "AUTO"
+            self.fps = float(self.stream.average_rate or self.stream.guessed_rate)
+            self.start = self.stream.start_time or 0
+            self.frame_total = self.stream.frames
+            if not self.frame_total and self.container.duration:
+                self.frame_total = int(self.container.duration / av.time_base * self.fps)
+            self.cap = None
+        else:
+            self.cap = cv2.VideoCapture(video_path)
+            self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+            self.frame_total = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            self.container = None
+
+    @property
+    def duration(self) -> float:
+        return self.frame_total / self.fps if self.fps else 0.0
+
+    def read(self, target: int, exact: bool = True):
+        """
+        Return (frame_index, frame) for the frame at `target`, or the keyframe at or before it if not `exact`.
+
+        Returns (None, None) past the end of the video.
+        """
+        if self.container is None:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+            ret, frame = self.cap.read()
+            self.frames_decoded += 1
+            return (target, frame) if ret else (None, None)
+
+        stream = self.stream
+        # Seeking backwards always lands on the keyframe at or before the target
+        self.container.seek(self.start + int(target / self.fps / stream.time_base), backward=True, stream=stream)
+        for frame in self.container.decode(stream):
+            if frame.pts is None:
+                continue
+            self.frames_decoded += 1
+            frame_index = int(round((frame.pts - self.start) * stream.time_base * self.fps))
+            if not exact or frame_index >= target:
+                return frame_index, frame.to_ndarray(format="bgr24")
+        return None, None
+
+    def close(self):
+        if self.container is not None:
+            self.container.close()
+        else:
+            self.cap.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
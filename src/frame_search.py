@@ -0,0 +1,122 @@
+"""
+Time-budgeted, coarse-to-fine search for the frame with the largest couch, used by 02-get-couch-image.py.
+
+Sampling every FRAME_INTERVAL frames makes a 25 minute episode cost four times as many model calls as a
+6 minute one, and a couch that is only in shot between two samples is missed entirely. Instead, this
+search starts with a sparse pass spread evenly over the running time, then keeps halving the gaps
+around the frames with the highest box ratio until it runs out of budget:
+
+- `max_inferences` caps the number of frames passed to the model for each video
+- `max_seconds` caps the wall time spent on each video
+- `target_box_ratio` stops the search as soon as a couch covers that share of the frame
+
+When the coarse pass finds no couch at all, every gap is halved instead, so the search degrades into a
+denser uniform pass.
+"""
+
+import time
+from frame_sampler import FrameReader
+
+COARSE_STEP_SECONDS = 20  # Spacing of the first, sparse pass
+MIN_STEP_SECONDS = 0.5  # Gaps smaller than this are not split any further
+REFINE_TOP_K = 3  # Number of best frames refined around in each round
+MAX_INFERENCES = 60  # Model calls per video
+MAX_SECONDS = None  # Wall time per video, None for no limit
+TARGET_BOX_RATIO = None  # Stop early once a couch covers this share of the frame, None to never stop early
+
+
+def _refine_targets(scores: dict, frame_total: int, min_step: int, top_k: int):
+    """Midpoints of the gaps next to the best scoring frames, or of every gap if nothing scored yet."""
+    scored = sorted(scores)
+    bounds = [-1] + scored + [frame_total]
+    neighbours = {index: (bounds[i], bounds[i + 2]) for i, index in enumerate(scored)}
+
+    peaks = sorted((index for index in scored if scores[index] > 0), key=scores.get, reverse=True)[:top_k]
+    if peaks:
+        gaps = [(neighbours[peak][0], peak) for peak in peaks] + [(peak, neighbours[peak][1]) for peak in peaks]
+    else:
+        gaps = list(zip(bounds[:-1], bounds[1:]))
+
+    # Widest gaps first, so a tight budget is spent where the least is known
+    gaps = sorted({(left, right) for left, right in gaps if right - left > min_step},
+                  key=lambda gap: gap[1] - gap[0], reverse=True)
+    return [max((left + right) // 2, 0) for left, right in gaps]
+
+
+def adaptive_best_frame(video_path: str, engine, max_inferences: int = MAX_INFERENCES,
+                        max_seconds: float = MAX_SECONDS, target_box_ratio: float = TARGET_BOX_RATIO,
+                        coarse_step_seconds: float = COARSE_STEP_SECONDS,
+                        min_step_seconds: float = MIN_STEP_SECONDS, refine_top_k: int = REFINE_TOP_K):
+    """
+    Search a video for the frame with the largest couch box ratio within a budget.
+
+    Parameters:
+    - video_path (str): Path to the video file.
+    - engine (DetectionEngine): Engine used to score frames.
+    - max_inferences (int): Maximum number of frames passed to the model.
+    - max_seconds (float): Maximum wall time for the search, or None.
+    - target_box_ratio (float): Stop as soon as a frame reaches this box ratio, or None.
+    - coarse_step_seconds (float): Spacing between frames in the first pass.
+    - min_step_seconds (float): Smallest gap between frames that is still split in two.
+    - refine_top_k (int): Number of best frames to refine around in each round.
+
+    Returns:
+    - tuple: (best frame or None, largest box ratio, dict of search statistics including the best frame's time)
+    """
+    started = time.monotonic()
+    scores = {}
+    best_frame, largest_box_ratio = None, 0
+    stats = {"inferences": 0, "rounds": 0, "frames_decoded": 0, "stopped": "exhausted", "best_time": None}
+
+    with FrameReader(video_path) as reader:
+        min_step = max(int(min_step_seconds * reader.fps), 1)
+        # The coarse pass gets at most half the budget, the rest is left for refinement
+        coarse_samples = int(reader.duration / coarse_step_seconds) + 1
+        coarse_samples = max(min(coarse_samples, max_inferences // 2), 1)
+        step = reader.frame_total / coarse_samples
+        targets = [int(step * (i + 0.5)) for i in range(coarse_samples)]
+
+        def read_targets(targets):
+            for target in targets:
+                _, frame = reader.read(target)
+                if frame is None:
+                    # Past the real end of the video, count it as empty so it is not asked for again
+                    scores[target] = 0
+                    continue
+                yield target, frame
+
+        while targets and stats["stopped"] == "exhausted":
+            remaining = max_inferences - stats["inferences"]
+            targets = sorted(set(targets) - scores.keys())[:remaining]
+            if not targets:
+                stats["stopped"] = "budget" if remaining <= 0 else "exhausted"
+                break
+
+            stats["rounds"] += 1
+            detections = engine.detect(read_targets(targets))
+            try:
+                for target, frame, box_ratio in detections:
+                    stats["inferences"] += 1
+                    scores[target] = box_ratio or 0
+                    if box_ratio and box_ratio > largest_box_ratio:
+                        largest_box_ratio = box_ratio
+                        best_frame = frame
+                        stats["best_time"] = target / reader.fps
+
+                    if target_box_ratio is not None and largest_box_ratio >= target_box_ratio:
+                        stats["stopped"] = "target"
+                        break
+                    if max_seconds is not None and time.monotonic() - started > max_seconds:
+                        stats["stopped"] = "time"
+                        break
+                else:
+                    targets = _refine_targets(scores, reader.frame_total, min_step, refine_top_k)
+            finally:
+                # Stop the decoding thread before the reader it reads from is closed, rather than whenever
+                # the abandoned generator is collected
+                detections.close()
+
+        stats["frames_decoded"] = reader.frames_decoded
+
+    stats["seconds"] = time.monotonic() - started
+    return best_frame, largest_box_ratio, stats
@@ -0,0 +1,59 @@
+"""
+Inline image payloads for the colour classification in 04-get-couch-colour.py.
+
+Pointing the model at a GitHub raw URL means the couch images have to be pushed before they can be
+classified, and the provider then fetches and tokenizes a whole 1080p frame for a question about one
+couch. Instead the image is cropped to the couch (the bounding box of its stored mask, with a small
+margin), downscaled so its longer side is at most a few hundred pixels, and sent inline as a base64
+JPEG data URL.
+"""
+
+import base64
+import cv2
+from mask_codec import mask_bbox
+
+MAX_SIDE = 512  # Longest side of the image sent, in pixels
+JPEG_QUALITY = 85
+CROP_MARGIN = 0.05  # Margin kept around the couch, as a share of the box size
+
+
+def couch_crop(image, rle: dict = None, margin: float = CROP_MARGIN):
+    """Crop an image to the bounding box of a run-length encoded couch mask, or return it whole without one."""
+    box = mask_bbox(rle) if rle else None
+    if box is None:
+        return image
+    x_min, y_min, x_max, y_max = box
+    pad_x, pad_y = int((x_max - x_min) * margin), int((y_max - y_min) * margin)
+    height, width = image.shape[:2]
+    return image[max(y_min - pad_y, 0):min(y_max + pad_y, height), max(x_min - pad_x, 0):min(x_max + pad_x, width)]
+
+
+def downscale(image, max_side: int = MAX_SIDE):
+    """Shrink an image so its longer side is at most `max_side`, leaving smaller images alone."""
+    height, width = image.shape[:2]
+    scale = max_side / max(height, width)
+    if scale >= 1:
+        return image
+    return cv2.resize(image, (max(round(width * scale), 1), max(round(height * scale), 1)), interpolation=cv2.INTER_AREA)
+
+
+def image_data_url(image_path: str, rle: dict = None, max_side: int = MAX_SIDE, quality: int = JPEG_QUALITY) -> str:
+    """
+    Build an inline JPEG data URL of the couch in an image.
+
+    Parameters:
+    - image_path (str): Path to the full frame.
+    - rle (dict): Run-length encoded couch mask for the frame, if known. Without one the whole frame is sent.
+    - max_side (int): Longest side of the image sent.
+    - quality (int): JPEG quality of the image sent.
+    """
+    image = cv2.imread(image_path)
+    if image is None:
+        raise FileNotFoundError(f"Could not read image {image_path}")
+    if rle and tuple(rle["size"]) != image.shape[:2]:
+        rle = None  # The mask belongs to a frame of another size, so it cannot locate the couch here
+    image = downscale(couch_crop(image, rle), max_side)
+    ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError(f"Could not encode image {image_path}")
+    return "data:image/jpeg;base64," + base64.b64encode(encoded.tobytes()).decode("ascii")
@@ -0,0 +1,58 @@
+"""
+Compact run-length encoding for the couch masks stored in the detection records.
+
+A couch mask is a single blob, so a 1920x1080 mask comes down to a couple of runs per row. Masks are
+encoded row by row as {"size": [height, width], "counts": [...]}, where the counts alternate between
+runs of background and runs of couch, starting with background (so the first count may be 0).
+"""
+
+import hashlib
+import numpy as np
+
+
+def encode_mask(mask) -> dict:
+    """Run-length encode a 2D mask, treating every non-zero pixel as couch."""
+    flat = np.asarray(mask).ravel() > 0
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    counts = np.diff(np.concatenate(([0], changes, [flat.size])))
+    if flat.size and flat[0]:
+        counts = np.concatenate(([0], counts))
+    return {"size": [int(mask.shape[0]), int(mask.shape[1])], "counts": counts.tolist()}
+
+
+def decode_mask(rle: dict):
+    """Decode a run-length encoded mask back into a uint8 array of 0 and 255."""
+    height, width = rle["size"]
+    counts = np.asarray(rle["counts"], dtype=np.int64)
+    values = np.zeros(len(counts), dtype=np.uint8)
+    values[1::2] = 255
+    return np.repeat(values, counts).reshape(height, width)
+
+
+def mask_area(rle: dict) -> int:
+    """Number of couch pixels in a run-length encoded mask, without decoding it."""
+    return int(sum(rle["counts"][1::2]))
+
+
+def mask_indices(rle: dict):
+    """Flat, row-major indices of the couch pixels in a run-length encoded mask, without decoding it."""
+    counts = np.asarray(rle["counts"], dtype=np.int64)
+    ends = np.cumsum(counts)
+    starts, lengths = (ends - counts)[1::2], counts[1::2]
+    # Each run contributes start, start + 1, ...: shift a running arange by the gap before each run
+    offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    return np.arange(offsets.size, dtype=np.int64) + offsets
+
+
+def mask_digest(rle: dict) -> str:
+    """Short, stable hash of a run-length encoded mask, for use in cache keys."""
+    return hashlib.sha1(np.asarray([*rle["size"], *rle["counts"]], dtype=np.int64).tobytes()).hexdigest()
+
+
+def mask_bbox(rle: dict):
+    """Bounding box of the couch in a run-length encoded mask as (x_min, y_min, x_max, y_max), or None if empty."""
+    indices = mask_indices(rle)
+    if indices.size == 0:
+        return None
+    rows, cols = np.divmod(indices, rle["size"][1])
+    return int(cols.min()), int(rows[0]), int(cols.max()) + 1, int(rows[-1]) + 1
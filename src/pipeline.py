@@ -0,0 +1,271 @@
+"""
+Incremental runner for the numbered pipeline scripts.
+
+Each stage declares the script it runs, the stages it follows, the files it reads and writes, and the
+environment variables it depends on. A stage's fingerprint hashes the content of its inputs, its
+script and every local module the script imports, and those environment variables, so a stage is
+re-run only when one of them has changed since its last successful run (or its outputs are missing).
+Within a stage, items are already skipped by the stores and caches the scripts use, so a stale stage
+still only does the work for the videos that changed. A stage reading a remote source, such as the
+playlist fetched by 01, cannot see that source change, so it also re-runs once its last run is older
+than its max_age.
+
+Stages whose dependencies are done run in parallel, e.g. the colour strip and grid scripts 06 to 10.
+File hashes are memoised by size and modification time, so a run where nothing changed only stats
+files and finishes in well under a second. Run it from the repository root:
+
+    python src/pipeline.py              # run whatever is stale
+    python src/pipeline.py --dry-run    # list the stale stages and why
+    python src/pipeline.py 09 --force   # re-run 09 (and whatever then goes stale downstream)
+
+05-visualise-couch-colours.py only shows a plot, so it is not part of the pipeline.
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass
+from tracing import span
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+STATE_PATH = "data/pipeline_state.json"
+MAX_PARALLEL = 4  # Stages run at once
+PLAYLIST_MAX_AGE = 24 * 60 * 60  # New episodes are published weekly, a daily look is enough
+
+
+@dataclass
+class Stage:
+    name: str
+    script: str
+    deps: tuple = ()
+    inputs: tuple = ()  # Files or glob patterns read by the stage
+    outputs: tuple = ()  # Files or glob patterns the stage writes, checked for existence
+    env: tuple = ()  # Environment variables the stage reads
+    max_age: float = None  # Seconds after which a stage reading a remote source is stale regardless
+
+
+STAGES = [
+    Stage("01", "01-get-videos.py",
+          outputs=("data/never_too_small_official_playlist.json",), max_age=PLAYLIST_MAX_AGE),
+    Stage("02", "02-get-couch-image.py", deps=("01",),
+          inputs=("data/never_too_small_official_playlist.json", "data/thumbnails/*.png"),
+          outputs=("data/couch_info.jsonl",),
+          env=("VIDEO_URL_TEMPLATE", "VIDEO_FORMAT", "LOW_RES_VIDEO_FORMAT", "FULL_RES_VIDEO_FORMAT")),
+    Stage("03", "03-segment-couches.py", deps=("02",),
+          inputs=("data/couch_info.jsonl", "data/couch_images/*.jpg"),
+          outputs=("data/couch_images_segmented", "data/couch_hex_values")),
+    Stage("04", "04-get-couch-colour.py", deps=("03",),
+          inputs=("data/couch_info.jsonl", "data/couch_images/*.jpg", "data/couch_images_segmented/*.jpg",
+                  "data/couch_hex_values/*.json"),
+          outputs=("data/couch_colour_classifications_2",),
+          env=("OPENAI_BASE_URL",)),
+    Stage("06", "06-create-colour-strips.py", deps=("03",),
+          inputs=("data/couch_info.jsonl", "data/couch_images_segmented/*.jpg"),
+          outputs=("data/couch_images_segmented_colour_strips",)),
+    Stage("07", "07-aggregate-colour-strips.py", deps=("03",),
+          inputs=("data/couch_info.jsonl", "data/couch_images_segmented/*.jpg"),
+          outputs=("data/couch_images_segmented_aggregated/couch_color_composite_sorted.*",)),
+    Stage("08", "08-aggregate-colour-strips-test.py", deps=("03",),
+          inputs=("data/couch_info.jsonl", "data/couch_images_segmented/*.jpg"),
+          outputs=("data/couch_images_segmented_aggregated/couch_color_grid_sorted.*",)),
+    Stage("09", "09-aggregate-colour-grid-families.py", deps=("03",),
+          inputs=("data/couch_info.jsonl", "data/couch_images_segmented/*.jpg"),
+          outputs=("data/couch_images_segmented_aggregated/couch_color_composite_by_family.*",)),
+    Stage("10", "10-aggregate-colour-grid-families-test.py", deps=("03",),
+          inputs=("data/couch_info.jsonl", "data/couch_images_segmented/*.jpg"),
+          outputs=("data/couch_images_segmented_aggregated/couch_color_grid_sorted_by_family.*",)),
+    Stage("11", "11-join-classifcations.py", deps=("04",),
+          inputs=("data/couch_info.jsonl", "data/couch_colour_classifications_2/*.json", "data/couch_hex_values/*.json"),
+          outputs=("data/couch_results.parquet", "data/couch_info_with_colour_classifications.json")),
+    Stage("12", "12-make-gif.py", deps=("09",),
+          inputs=("data/couch_images_segmented_aggregated/couch_color_composite_by_family.*",),
+          outputs=("assets/scrolled_couch_colors.gif",)),
+]
+
+
+class FileHasher:
+    """SHA-1 of files, memoised by (size, mtime) so unchanged files are not read again."""
+
+    def __init__(self, memo: dict = None):
+        self.memo = memo or {}
+
+    def digest(self, path: str) -> str:
+        stat = os.stat(path)
+        known = self.memo.get(path)
+        if known and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+            return known[2]
+        with open(path, "rb") as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        self.memo[path] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+
+def local_imports(script_path: str, seen: set = None) -> set:
+    """Paths of the script and every module of this directory it imports, directly or indirectly."""
+    seen = set() if seen is None else seen
+    if script_path in seen:
+        return seen
+    seen.add(script_path)
+    with open(script_path, "r", encoding="utf-8") as f:
+        source = f.read()
+    for module in re.findall(r"^\s*(?:from|import)\s+(\w+)", source, flags=re.MULTILINE):
+        module_path = os.path.join(SRC_DIR, f"{module}.py")
+        if os.path.exists(module_path):
+            local_imports(module_path, seen)
+    return seen
+
+
+def expand(patterns) -> list:
+    """Files matched by paths or glob patterns, sorted. Directories count as no files of their own."""
+    return sorted({path for pattern in patterns for path in glob.glob(pattern) if os.path.isfile(path)})
+
+
+def fingerprint(stage: Stage, hasher: FileHasher) -> str:
+    digest = hashlib.sha1()
+    for path in sorted(local_imports(os.path.join(SRC_DIR, stage.script))):
+        digest.update(f"code {os.path.basename(path)} {hasher.digest(path)}\n".encode())
+    for path in expand(stage.inputs):
+        digest.update(f"input {path} {hasher.digest(path)}\n".encode())
+    for name in stage.env:
+        digest.update(f"env {name} {os.getenv(name)}\n".encode())
+    return digest.hexdigest()
+
+
+def stale_reason(stage: Stage, state: dict, hasher: FileHasher):
+    """Why a stage needs to run, or None if it is up to date."""
+    previous = state["stages"].get(stage.name)
+    if previous is None:
+        return "never run"
+    if any(not glob.glob(pattern) for pattern in stage.outputs):
+        return "outputs missing"
+    if stage.max_age is not None and time.time() - previous.get("finished", 0) > stage.max_age:
+        return f"remote source last read over {stage.max_age / 3600:g}h ago"
+    if previous["fingerprint"] != fingerprint(stage, hasher):
+        return "inputs, code or parameters changed"
+    return None
+
+
+def load_state(path: str = STATE_PATH) -> dict:
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"stages": {}, "files": {}}
+
+
+def save_state(state: dict, path: str = STATE_PATH):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def run_stage(stage: Stage) -> tuple:
+    """Run a stage's script from the repository root. Returns (return code, seconds)."""
+    started = time.monotonic()
+    with span(f"stage {stage.name}", script=stage.script):
+        result = subprocess.run([sys.executable, os.path.join(SRC_DIR, stage.script)])
+    return result.returncode, time.monotonic() - started
+
+
+def run_pipeline(selected=None, force=(), dry_run: bool = False, max_parallel: int = MAX_PARALLEL,
+                 stages=STAGES, state_path: str = STATE_PATH) -> dict:
+    """
+    Run the stale stages, in dependency order and in parallel where possible.
+
+    Parameters:
+    - selected: Names of the stages to consider, all of them if None. Their dependencies are not added.
+    - force: Names of stages to run even if they are up to date.
+    - dry_run (bool): Only print which stages are stale and why.
+
+    Returns:
+    - dict: Outcome of every considered stage: "up to date", "ran", "failed", "skipped" or "stale" on a dry run.
+    """
+    state = load_state(state_path)
+    hasher = FileHasher(state.get("files"))
+    pending = [stage for stage in stages if selected is None or stage.name in selected]
+    considered = {stage.name for stage in pending}
+    outcomes = {}
+
+    def ready(stage):
+        # Dependencies left out of the run count as done
+        return all(dep not in considered or outcomes.get(dep) in ("up to date", "ran", "stale")
+                   for dep in stage.deps)
+
+    def blocked(stage):
+        return any(outcomes.get(dep) in ("failed", "skipped") for dep in stage.deps)
+
+    with ThreadPoolExecutor(max_workers=max_parallel) as pool:
+        running = {}
+        while pending or running:
+            for stage in list(pending):
+                if blocked(stage):
+                    outcomes[stage.name] = "skipped"
+                    pending.remove(stage)
+                    print(f"[{stage.name}] skipped, a dependency failed")
+                elif ready(stage):
+                    pending.remove(stage)
+                    stale_deps = [dep for dep in stage.deps if outcomes.get(dep) == "stale"]
+                    if stage.name in force:
+                        reason = "forced"
+                    elif stale_deps:
+                        reason = f"may change once {', '.join(stale_deps)} has run"
+                    else:
+                        reason = stale_reason(stage, state, hasher)
+                    if reason is None:
+                        outcomes[stage.name] = "up to date"
+                    elif dry_run:
+                        outcomes[stage.name] = "stale"
+                        print(f"[{stage.name}] {stage.script}: {reason}")
+                    else:
+                        print(f"[{stage.name}] running {stage.script} ({reason})")
+                        running[pool.submit(run_stage, stage)] = stage
+
+            if not running:
+                if pending and not any(ready(stage) or blocked(stage) for stage in pending):
+                    raise RuntimeError(f"Stages {[stage.name for stage in pending]} wait on each other")
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                returncode, seconds = future.result()
+                if returncode != 0:
+                    outcomes[stage.name] = "failed"
+                    print(f"[{stage.name}] failed with exit code {returncode} after {seconds:.1f}s")
+                    continue
+                outcomes[stage.name] = "ran"
+                # Fingerprint after the run, so files the stage updates itself do not make it stale again
+                state["stages"][stage.name] = {"fingerprint": fingerprint(stage, hasher), "seconds": round(seconds, 1),
+                                               "finished": time.time()}
+                state["files"] = hasher.memo
+                save_state(state, state_path)
+                print(f"[{stage.name}] done in {seconds:.1f}s")
+
+    if not dry_run:
+        state["files"] = hasher.memo
+        save_state(state, state_path)
+    counts = {outcome: sum(1 for value in outcomes.values() if value == outcome) for outcome in set(outcomes.values())}
+    print("Pipeline: " + ", ".join(f"{count} {outcome}" for outcome, count in sorted(counts.items())))
+    return outcomes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the stale stages of the couch pipeline.")
+    parser.add_argument("stages", nargs="*", help="Stages to consider, e.g. 03 09 (default: all)")
+    parser.add_argument("--force", action="store_true", help="Run the given stages even if they are up to date")
+    parser.add_argument("--dry-run", action="store_true", help="Only list the stale stages")
+    parser.add_argument("--jobs", type=int, default=MAX_PARALLEL, help="Stages run at once")
+    args = parser.parse_args()
+
+    outcomes = run_pipeline(selected=set(args.stages) or None, force=set(args.stages) if args.force else (),
+                            dry_run=args.dry_run, max_parallel=args.jobs)
+    sys.exit(1 if "failed" in outcomes.values() else 0)
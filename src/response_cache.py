@@ -0,0 +1,172 @@
+"""
+Content-addressed cache of the model responses behind 04-get-couch-colour.py.
+
+Stage 04 used to decide what to classify by whether a result file existed, so a new prompt needed a
+new results directory and a re-run queried everything again. Here every response is stored under a
+key hashed from what actually determines it: the image sent, the prompt, the model and the response
+schema. Re-running with a changed prompt only pays for the requests whose key changed, and switching
+back to an earlier prompt is free.
+
+Entries are appended to data/classification_cache.jsonl, one JSON line each, together with the
+request latency and token usage, so the cost of an experiment can be read back from the cache.
+
+Running this file checks the keying, hits and misses, persistence and crash recovery against a stub
+model in a temporary directory:
+
+    python src/response_cache.py
+"""
+
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+CACHE_PATH = "data/classification_cache.jsonl"
+
+
+def text_digest(text: str) -> str:
+    """SHA-1 of a string."""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def file_digest(path: str) -> str:
+    """SHA-1 of a file's bytes."""
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+class ResponseCache:
+    """
+    Append-only cache of model responses keyed by (image, prompt, model, schema).
+
+    Parameters:
+    - path (str): Path to the JSONL file backing the cache. It is created on the first put().
+    """
+
+    def __init__(self, path: str = CACHE_PATH):
+        self.path = path
+        self.entries = self._read(path)
+        self.hits = 0
+        self.misses = 0
+        self.tokens_saved = 0
+        self.tokens_spent = 0
+
+    @staticmethod
+    def _read(path: str) -> dict:
+        entries = {}
+        if not os.path.exists(path):
+            return entries
+        good_until = 0
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                entries[entry["key"]] = entry
+                good_until += len(line)
+
+        # Drop a partial line left behind by a crash mid-append, so the next entry starts on a line of its own
+        if good_until < os.path.getsize(path):
+            with open(path, "r+b") as f:
+                f.truncate(good_until)
+        return entries
+
+    @staticmethod
+    def key(image_digest: str, prompt: str, model: str, schema: dict) -> str:
+        """Cache key of a request: a hash of the image digest, prompt, model and JSON schema of the response."""
+        schema_digest = text_digest(json.dumps(schema, sort_keys=True))
+        return text_digest(json.dumps([image_digest, text_digest(prompt), model, schema_digest]))
+
+    def get(self, key: str):
+        """Return the cached entry for a key, with the response under "content", or None."""
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.tokens_saved += (entry.get("usage") or {}).get("total_tokens", 0)
+        return entry
+
+    def put(self, key: str, content: str, latency: float, usage: dict = None, **fields) -> dict:
+        """Append a response with the seconds it took and its token usage. Extra fields are stored alongside."""
+        entry = {"key": key, "content": content, "latency": round(latency, 3), "usage": usage,
+                 "created": time.time(), **fields}
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "ab") as f:
+            f.write((json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+        self.entries[key] = entry
+        self.tokens_spent += (usage or {}).get("total_tokens", 0)
+        return entry
+
+    def summary(self) -> str:
+        return (f"Response cache: {self.hits} hits ({self.tokens_saved} tokens saved), "
+                f"{self.misses} misses ({self.tokens_spent} tokens spent), {len(self.entries)} entries in {self.path}")
+
+
+def _self_check(directory: str) -> list:
+    """Check the cache against a stub model in `directory`, as (check, passed, details)."""
+    checks = []
+    path = os.path.join(directory, "cache.jsonl")
+    schema = {"type": "object", "properties": {"couch_colour": {"type": "string"}}}
+    calls = []
+
+    def classify(cache, image, prompt, model="stub-model", schema=schema):
+        """Stage 04's pattern: answer from the cache, or call the stub model and store its answer."""
+        key = cache.key(text_digest(image), prompt, model, schema)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached["content"]
+        calls.append((image, prompt, model))
+        content = json.dumps({"couch_colour": f"colour {len(calls)}"})
+        cache.put(key, content, 0.01, {"total_tokens": 100})
+        return content
+
+    cache = ResponseCache(path)
+    first = classify(cache, "image-1", "What colour?")
+    again = classify(cache, "image-1", "What colour?")
+    checks.append(("hit skips the call", again == first and len(calls) == 1 and cache.tokens_saved == 100,
+                   {"calls": len(calls), "hits": cache.hits, "tokens_saved": cache.tokens_saved}))
+
+    changed = {"prompt": ("image-1", "Which colour?", "stub-model", schema),
+               "image": ("image-2", "What colour?", "stub-model", schema),
+               "model": ("image-1", "What colour?", "other-model", schema),
+               "schema": ("image-1", "What colour?", "stub-model", {**schema, "required": ["couch_colour"]})}
+    missed = {}
+    for name, request in changed.items():
+        before = len(calls)
+        classify(cache, *request)
+        missed[name] = len(calls) > before
+    checks.append(("changed request misses", all(missed.values()), missed))
+
+    # Key order within the schema does not change the key
+    reordered = dict(reversed(list(schema.items())))
+    checks.append(("schema key order ignored", ResponseCache.key("d", "p", "m", schema) ==
+                   ResponseCache.key("d", "p", "m", reordered), {}))
+
+    # Entries survive a restart, and a line half written by a crash is dropped rather than breaking the cache
+    with open(path, "ab") as f:
+        f.write(b'{"key": "half a li')
+    reopened = ResponseCache(path)
+    before = len(calls)
+    reopened_answer = classify(reopened, "image-1", "What colour?")
+    classify(reopened, "image-3", "What colour?")
+    recovered = ResponseCache(path)
+    checks.append(("persists and recovers from a partial line",
+                   reopened_answer == first and len(calls) == before + 1 and len(recovered.entries) == 6,
+                   {"entries": len(recovered.entries), "calls_after_restart": len(calls) - before}))
+    return checks
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directory:
+        checks = _self_check(directory)
+    for check, passed, details in checks:
+        print(f"{'ok' if passed else 'FAILED':<7}{check:<44}{details}")
+    sys.exit(0 if all(passed for _, passed, _ in checks) else 1)
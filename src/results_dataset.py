@@ -0,0 +1,141 @@
+"""
+One columnar dataset of everything known about each video, for 11-join-classifcations.py and the analysis.
+
+Detection records, stage 03 colours and stage 04 classifications are joined into a single Parquet file
+with a fixed schema, one row per video. Colour labels are normalised once at ingest ("Gray" becomes
+"grey") and stored as categorical codes, alongside a colour_family column that maps free-form labels
+such as "light gray" or "olive green" onto the fixed stage 04 vocabulary.
+
+Each row carries a digest of the inputs it was built from. Updating the dataset only rebuilds the
+rows of videos whose inputs changed and keeps every other row as it is.
+"""
+
+import hashlib
+import json
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from colour_names import NAMED_COLOURS
+from mask_codec import mask_area
+
+DATASET_PATH = "data/couch_results.parquet"
+CLASSIFICATIONS_DIR = "data/couch_colour_classifications_2"
+HEX_VALUES_DIR = "data/couch_hex_values"
+
+COLOUR_FAMILIES = list(NAMED_COLOURS) + ["other"]
+COLOUR_SYNONYMS = {"gray": "grey", "cream": "beige", "tan": "beige", "burgundy": "red", "teal": "blue",
+                   "navy": "blue", "charcoal": "grey"}
+
+SCHEMA = pa.schema([
+    ("video_id", pa.string()),
+    ("couch_detected", pa.bool_()),
+    ("image_path", pa.string()),
+    ("segmented_image_path", pa.string()),
+    ("couch_area", pa.int64()),
+    ("hex_values", pa.list_(pa.string())),
+    ("couch_colour", pa.dictionary(pa.int16(), pa.string())),
+    ("colour_family", pa.dictionary(pa.int8(), pa.string())),
+    ("classifier", pa.string()),
+    ("confidence", pa.float64()),
+    ("source_digest", pa.string()),
+])
+
+
+def normalise_colour(label):
+    """Lower-case a colour label, collapse whitespace and spell grey with an e."""
+    if not isinstance(label, str):
+        return None
+    return " ".join(label.lower().replace("gray", "grey").split()) or None
+
+
+def colour_family(label):
+    """The first word of a normalised label that is, or is a synonym of, a word of the vocabulary, else "other"."""
+    if label is None:
+        return None
+    for word in label.replace(",", " ").split():
+        word = COLOUR_SYNONYMS.get(word, word)
+        if word in NAMED_COLOURS:
+            return word
+    return "other"
+
+
+def _read_bytes(path: str) -> bytes:
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except (FileNotFoundError, TypeError):
+        return b""
+
+
+def _inputs(record: dict, classifications_dir: str, hex_values_dir: str):
+    """The raw inputs of a video's row and their digest."""
+    video_id = record["video_id"]
+    classification = _read_bytes(os.path.join(classifications_dir, f"{video_id}.json"))
+    hex_values = _read_bytes(record.get("hex_values_path") or os.path.join(hex_values_dir, f"{video_id}.json"))
+    digest = hashlib.sha1()
+    for part in (json.dumps(record, sort_keys=True).encode("utf-8"), classification, hex_values):
+        digest.update(hashlib.sha1(part).digest())
+    return classification, hex_values, digest.hexdigest()
+
+
+def build_row(record: dict, classification: bytes, hex_values: bytes, digest: str) -> dict:
+    """One dataset row from a detection record and the contents of its classification and hex value files."""
+    classification = json.loads(classification) if classification else {}
+    couch_colour = normalise_colour(classification.get("couch_colour"))
+    return {
+        "video_id": record["video_id"],
+        "couch_detected": bool(record.get("couch_detected")),
+        "image_path": record.get("image_path"),
+        "segmented_image_path": record.get("segmented_image_path"),
+        "couch_area": mask_area(record["couch_mask"]) if record.get("couch_mask") else None,
+        "hex_values": json.loads(hex_values) if hex_values else None,
+        "couch_colour": couch_colour,
+        "colour_family": colour_family(couch_colour),
+        "classifier": classification.get("classifier", "llm") if classification else None,
+        "confidence": classification.get("confidence"),
+        "source_digest": digest,
+    }
+
+
+def load_results(path: str = DATASET_PATH) -> pd.DataFrame:
+    """Load the dataset, with couch_colour and colour_family as pandas categoricals."""
+    return pd.read_parquet(path)
+
+
+def update_results(records, path: str = DATASET_PATH, classifications_dir: str = CLASSIFICATIONS_DIR,
+                   hex_values_dir: str = HEX_VALUES_DIR) -> pd.DataFrame:
+    """
+    Bring the dataset up to date with the detection records, rebuilding only the rows whose inputs changed.
+
+    Parameters:
+    - records: Detection records, e.g. DetectionStore().records(). Videos without a record are dropped.
+
+    Returns:
+    - pd.DataFrame: The updated dataset.
+    """
+    existing = {}
+    if os.path.exists(path):
+        previous = pd.read_parquet(path)
+        existing = {row["video_id"]: row for row in previous.to_dict("records")}
+
+    rows, rebuilt = [], 0
+    for record in records:
+        classification, hex_values, digest = _inputs(record, classifications_dir, hex_values_dir)
+        row = existing.get(record["video_id"])
+        if row is None or row["source_digest"] != digest:
+            row = build_row(record, classification, hex_values, digest)
+            rebuilt += 1
+        rows.append(row)
+
+    df = pd.DataFrame(rows, columns=SCHEMA.names)
+    df["hex_values"] = df["hex_values"].map(lambda values: None if values is None else list(values))
+    df["couch_colour"] = df["couch_colour"].astype("category")
+    df["colour_family"] = pd.Categorical(df["colour_family"], categories=COLOUR_FAMILIES)
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    pq.write_table(pa.Table.from_pandas(df, schema=SCHEMA, preserve_index=False), tmp_path)
+    os.replace(tmp_path, path)
+    print(f"Results dataset {path}: {rebuilt} rows rebuilt, {len(df) - rebuilt} unchanged")
+    return df
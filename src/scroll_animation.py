@@ -0,0 +1,104 @@
+"""
+Scrolling animations of a tall composite image for 12-make-gif.py.
+
+The animation is a window sliding down the composite. Rather than cropping a PIL image per frame and
+keeping every frame until the end, each frame is a NumPy view into the composite and is encoded as
+soon as it is produced, so memory stays at the size of the composite however many frames there are.
+
+GIFs are quantized to one shared palette up front, which is both faster than quantizing every frame
+and avoids colours flickering between frames, then written frame by frame. Animated WebP and MP4 are
+encoded incrementally with PyAV, when it is installed.
+"""
+
+import os
+import numpy as np
+from PIL import Image, GifImagePlugin
+
+try:
+    import av
+except ImportError:  # PyAV is optional, without it only GIFs can be written
+    av = None
+
+VIDEO_CODECS = {".mp4": ("libx264", "yuv420p"), ".webp": ("libwebp_anim", "yuv420p")}
+
+
+def scroll_windows(pixels, window_height: int, scroll_step: int):
+    """Yield successive windows of `window_height` rows, `scroll_step` rows apart, as views into `pixels`."""
+    for y_offset in range(0, pixels.shape[0] - window_height, scroll_step):
+        yield pixels[y_offset:y_offset + window_height]
+
+
+def write_gif(path: str, image, window_height: int, scroll_step: int, duration: int = 100, loop: int = 0) -> int:
+    """
+    Write a scrolling GIF, quantizing the whole composite to one palette and encoding frame by frame.
+
+    Returns:
+    - int: Number of frames written.
+    """
+    # A few k-means passes refine the median cut palette, as it has to serve every frame at once
+    quantized = image.convert("RGB").quantize(colors=256, kmeans=3)
+    palette = quantized.getpalette()
+    indices = np.asarray(quantized)
+
+    frames = 0
+    with open(path, "wb") as f:
+        for window in scroll_windows(indices, window_height, scroll_step):
+            frame = Image.fromarray(window, mode="P")
+            frame.putpalette(palette)
+            if frames == 0:
+                header, _ = GifImagePlugin.getheader(frame, info={"loop": loop, "duration": duration})
+                f.write(b"".join(header))
+            f.write(b"".join(GifImagePlugin.getdata(frame, duration=duration)))
+            frames += 1
+        f.write(b";")  # GIF trailer
+    return frames
+
+
+def write_video(path: str, image, window_height: int, scroll_step: int, duration: int = 100) -> int:
+    """
+    Write a scrolling MP4 or animated WebP with PyAV, encoding each frame as it is produced.
+
+    Returns:
+    - int: Number of frames written.
+    """
+    if av is None:
+        raise ImportError("Writing MP4 or WebP animations needs PyAV, install it with `pip install av`")
+    codec, pix_fmt = VIDEO_CODECS[os.path.splitext(path)[1].lower()]
+    pixels = np.asarray(image.convert("RGB"))
+    # Encoders working in yuv420p need even dimensions
+    width = pixels.shape[1] - pixels.shape[1] % 2
+    height = window_height - window_height % 2
+
+    frames = 0
+    with av.open(path, "w") as container:
+        stream = container.add_stream(codec, rate=max(round(1000 / duration), 1))
+        stream.width, stream.height, stream.pix_fmt = width, height, pix_fmt
+        for window in scroll_windows(pixels, window_height, scroll_step):
+            frame = av.VideoFrame.from_ndarray(np.ascontiguousarray(window[:height, :width]), format="rgb24")
+            container.mux(stream.encode(frame))
+            frames += 1
+        container.mux(stream.encode())  # Flush the encoder
+    return frames
+
+
+def save_scroll_animation(image_path: str, output_path: str, window_height: int = 150, scroll_step: int = 5,
+                          duration: int = 100, loop: int = 0) -> int:
+    """
+    Save an animation scrolling a window down an image, as a GIF, MP4 or animated WebP by file extension.
+
+    Parameters:
+    - window_height (int): Height of the visible window in pixels.
+    - scroll_step (int): Pixels the window moves down each frame.
+    - duration (int): Milliseconds per frame.
+    - loop (int): GIF loop count, 0 to loop forever.
+
+    Returns:
+    - int: Number of frames written.
+    """
+    image = Image.open(image_path)
+    extension = os.path.splitext(output_path)[1].lower()
+    if extension == ".gif":
+        return write_gif(output_path, image, window_height, scroll_step, duration, loop)
+    if extension in VIDEO_CODECS:
+        return write_video(output_path, image, window_height, scroll_step, duration)
+    raise ValueError(f"Unsupported animation format {extension!r}, expected .gif or one of {list(VIDEO_CODECS)}")
@@ -0,0 +1,133 @@
+"""
+Batched couch segmentation for 03-segment-couches.py.
+
+The segmentation model is loaded once and images are streamed through it in batches, with a background
+thread loading the next images from disk while the model runs on the current batch.
+
+save_segmentation_outputs() writes the segmented image and dominant colours for a couch. It is shared
+with 02-get-couch-image.py, which can segment the winning frame in memory instead of leaving it to stage 03.
+"""
+
+import json
+import os
+import time
+import cv2
+import numpy as np
+from PIL import Image
+from detection_engine import prefetched_batches
+from colour_extraction import pixel_histogram, cluster_colours
+from mask_codec import encode_mask
+from tracing import span, count
+
+SEGMENTED_DIR = "data/couch_images_segmented"
+HEX_VALUES_DIR = "data/couch_hex_values"
+BATCH_SIZE = 8  # Number of images passed to the model in a single call
+QUEUE_SIZE = 16  # Maximum number of loaded images waiting for the model
+
+
+def couch_mask_from_result(result, image_shape, couch_class: str = 'couch'):
+    """Return the first couch mask in a segmentation result as a uint8 array the size of the image, or None."""
+    if not hasattr(result, 'masks') or result.masks is None:
+        return None
+
+    for seg, cls in zip(result.masks.data, result.boxes.cls):
+        if result.names[int(cls)] == couch_class:
+            couch_mask = (seg.cpu().numpy() * 255).astype(np.uint8)
+            if couch_mask.shape != image_shape[:2]:  # Ensure mask has same dimensions as source image
+                couch_mask = cv2.resize(couch_mask, (image_shape[1], image_shape[0]))
+            return couch_mask
+    return None
+
+
+def save_segmentation_outputs(video_id: str, image_np, couch_mask, segmented_dir: str = SEGMENTED_DIR,
+                              hex_values_dir: str = HEX_VALUES_DIR) -> dict:
+    """
+    Save the segmented couch image and its dominant colours in hex format.
+
+    Parameters:
+    - video_id (str): Unique identifier for the video.
+    - image_np: RGB image array.
+    - couch_mask: uint8 mask the size of the image, non-zero on the couch.
+
+    Returns:
+    - dict: The segmented_image_path and hex_values_path that were written, and the run-length encoded
+      couch_mask for later stages to extract colours from.
+    """
+    # Define paths for the output segmented image and output hex values
+    segmented_image_path = f"{segmented_dir}/{video_id}.jpg"
+    hex_values_path = f"{hex_values_dir}/{video_id}.json"
+    os.makedirs(segmented_dir, exist_ok=True)
+    os.makedirs(hex_values_dir, exist_ok=True)
+
+    # Apply the mask to the original image
+    segmented_couch = cv2.bitwise_and(image_np, image_np, mask=couch_mask)
+
+    # Gather the couch pixels through the mask, so dark couch pixels are not mistaken for background
+    pixels = image_np[couch_mask > 0]
+
+    # Cluster a quantized histogram of the pixels to find the dominant colors
+    n_colors = 5
+    bin_colours, bin_counts = pixel_histogram(pixels)
+    colors, _ = cluster_colours(bin_colours, bin_counts, n_colors)
+
+    # Convert colors to hex format
+    hex_colors = ['#%02x%02x%02x' % tuple(map(int, color)) for color in colors]
+
+    # Save segmented couch image
+    Image.fromarray(segmented_couch).save(segmented_image_path)
+    print(f"Segmented image saved to {segmented_image_path}")
+
+    # Save hex colors to JSON
+    with open(hex_values_path, 'w') as f:
+        json.dump(hex_colors, f)
+    print(f"Hex values saved to {hex_values_path}")
+
+    return {"couch_mask": encode_mask(couch_mask), "segmented_image_path": segmented_image_path,
+            "hex_values_path": hex_values_path}
+
+
+class SegmentationEngine:
+    """
+    Run a YOLO segmentation model over (video_id, image) pairs in batches.
+
+    Parameters:
+    - model: An ultralytics YOLO segmentation model.
+    - couch_class (str): Class name of the mask to keep.
+    - batch_size (int): Number of images per model call.
+    - queue_size (int): Maximum number of loaded images held in memory.
+
+    After iterating, `images` and `seconds` hold the work done, and `images_per_second` summarises it.
+    """
+
+    def __init__(self, model, couch_class: str = 'couch', batch_size: int = BATCH_SIZE, queue_size: int = QUEUE_SIZE):
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        self.model = model
+        self.couch_class = couch_class
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.images = 0
+        self.seconds = 0.0
+
+    @property
+    def images_per_second(self) -> float:
+        return self.images / self.seconds if self.seconds else 0.0
+
+    def segment(self, items):
+        """
+        Yield (video_id, image, couch_mask) for every item, with couch_mask None if no couch was found.
+
+        Parameters:
+        - items: Iterable of (video_id, RGB image array) pairs. It is consumed on a background thread.
+        """
+        started = time.monotonic()
+        try:
+            for batch in prefetched_batches(items, self.batch_size, self.queue_size):
+                with span("segmentation", images=len(batch)):
+                    results = self.model([image for _, image in batch])
+                count("inferences", len(batch))
+                for (video_id, image), result in zip(batch, results):
+                    self.images += 1
+                    yield video_id, image, couch_mask_from_result(result, image.shape, self.couch_class)
+        finally:
+            self.seconds += time.monotonic() - started
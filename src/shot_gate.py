@@ -0,0 +1,88 @@
+"""
+Shot-change and near-duplicate gating for the frames sampled in 02-get-couch-image.py.
+
+Consecutive samples often come from the same static shot, and every one of them used to go through
+the detector. The gate computes a tiny colour histogram for each sampled frame and only lets through
+one or two representatives per shot:
+
+- the first sample after a shot boundary (a big jump in the histogram) always goes through
+- within a shot, a sample only goes through if it has drifted away from the last representative,
+  e.g. during a pan, and the shot has not used up its `max_per_shot` representatives yet
+
+The gate wraps any iterable of (frame_index, frame) pairs, so it sits between a FrameSampler and the
+DetectionEngine and runs on the decoder thread.
+"""
+
+import cv2
+
+SIGNATURE_SIZE = (64, 36)  # Frames are shrunk to this before taking the histogram
+HIST_BINS = [8, 4, 4]  # Hue, saturation and value bins
+SHOT_THRESHOLD = 0.35  # Histogram distance that counts as a new shot
+DUPLICATE_THRESHOLD = 0.15  # Histogram distance below which a frame is a near-duplicate
+MAX_PER_SHOT = 2  # Representatives passed on per shot
+
+
+def frame_signature(frame):
+    """Return a normalised HSV histogram of a downscaled copy of a BGR frame."""
+    small = cv2.resize(frame, SIGNATURE_SIZE, interpolation=cv2.INTER_AREA)
+    hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+    hist = cv2.calcHist([hsv], [0, 1, 2], None, HIST_BINS, [0, 180, 0, 256, 0, 256])
+    return cv2.normalize(hist, hist).flatten()
+
+
+def signature_distance(a, b) -> float:
+    """Bhattacharyya distance between two signatures, 0 for identical and 1 for nothing in common."""
+    return cv2.compareHist(a, b, cv2.HISTCMP_BHATTACHARYYA)
+
+
+class ShotGate:
+    """
+    Iterate over the (frame_index, frame) samples that are worth running the detector on.
+
+    Parameters:
+    - samples: Iterable of (frame_index, frame) pairs, e.g. a FrameSampler.
+    - max_per_shot (int): Maximum number of samples passed on for each shot.
+    - shot_threshold (float): Distance from the previous sample, or the last representative, that starts a new shot.
+    - duplicate_threshold (float): Distance from the last representative below which a sample is skipped.
+
+    After iterating, `passed`, `skipped` and `shots` count what the gate did.
+    """
+
+    def __init__(self, samples, max_per_shot: int = MAX_PER_SHOT, shot_threshold: float = SHOT_THRESHOLD,
+                 duplicate_threshold: float = DUPLICATE_THRESHOLD):
+        self.samples = samples
+        self.max_per_shot = max(max_per_shot, 1)
+        self.shot_threshold = shot_threshold
+        self.duplicate_threshold = duplicate_threshold
+        self.passed = 0
+        self.skipped = 0
+        self.shots = 0
+
+    def __iter__(self):
+        self.passed = self.skipped = self.shots = 0
+        previous = None
+        representative = None
+        in_shot = 0
+
+        for frame_index, frame in self.samples:
+            signature = frame_signature(frame)
+            if previous is None:
+                new_shot = True
+            else:
+                # A slow pan never jumps between samples, so drifting far from the representative also counts
+                new_shot = (signature_distance(previous, signature) > self.shot_threshold
+                            or signature_distance(representative, signature) > self.shot_threshold)
+            previous = signature
+
+            if new_shot:
+                self.shots += 1
+                in_shot = 0
+            elif in_shot >= self.max_per_shot or \
+                    signature_distance(representative, signature) < self.duplicate_threshold:
+                self.skipped += 1
+                continue
+
+            representative = signature
+            in_shot += 1
+            self.passed += 1
+            yield frame_index, frame
@@ -0,0 +1,232 @@
+"""
+Concurrent thumbnail downloads for 01-get-videos.py.
+
+Thumbnails are fetched by a small pool of worker threads sharing one pooled requests session. Every
+download is conditional: the ETag and Last-Modified headers of each thumbnail are remembered in a
+small JSON file, and for thumbnails downloaded before that (or by hand) the file's modification time
+stands in for Last-Modified, so an unchanged thumbnail costs a 304 response rather than a download.
+Files are written to a temporary path and renamed into place, so an interrupted run never leaves a
+truncated image behind.
+
+Running this file checks the conditional downloads against a stub server on localhost:
+
+    python src/thumbnail_fetcher.py
+"""
+
+import contextlib
+import glob
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+from requests.adapters import HTTPAdapter
+
+MAX_WORKERS = 8  # Thumbnails downloaded at once
+TIMEOUT = 30  # Seconds to wait for a server response
+CHUNK_SIZE = 1 << 16  # Bytes written at a time
+VALIDATORS_PATH = "data/thumbnail_validators.json"
+
+
+class ThumbnailFetcher:
+    """
+    Download (url, path) pairs concurrently, skipping thumbnails the server reports as unchanged.
+
+    Parameters:
+    - max_workers (int): Number of downloads in flight at once.
+    - validators_path (str): JSON file remembering the ETag and Last-Modified of each thumbnail.
+    - timeout (float): Seconds to wait for a server response.
+    - session: requests session to use, by default one pooled for `max_workers` connections.
+
+    After fetch_all(), `summary` counts the thumbnails "downloaded", "not_modified" and "failed", and
+    `failures` maps the path of each failed thumbnail to its error.
+    """
+
+    def __init__(self, max_workers: int = MAX_WORKERS, validators_path: str = VALIDATORS_PATH,
+                 timeout: float = TIMEOUT, session=None):
+        self.max_workers = max_workers
+        self.validators_path = validators_path
+        self.timeout = timeout
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        self.session = session
+        self.validators = self._load_validators()
+        self.summary = {"downloaded": 0, "not_modified": 0, "failed": 0}
+        self.failures = {}
+        self._lock = threading.Lock()
+
+    def _load_validators(self) -> dict:
+        try:
+            with open(self.validators_path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _save_validators(self):
+        os.makedirs(os.path.dirname(self.validators_path) or ".", exist_ok=True)
+        tmp_path = f"{self.validators_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.validators, f, indent=4)
+        os.replace(tmp_path, self.validators_path)
+
+    def _conditional_headers(self, url: str, path: str) -> dict:
+        if not os.path.exists(path):
+            return {}
+        with self._lock:
+            known = self.validators.get(path, {})
+        if known.get("url") != url:
+            # The validators belong to another URL, so only the file's own age is meaningful
+            known = {}
+        headers = {}
+        if known.get("etag"):
+            headers["If-None-Match"] = known["etag"]
+        headers["If-Modified-Since"] = known.get("last_modified") or formatdate(os.path.getmtime(path), usegmt=True)
+        return headers
+
+    def fetch(self, url: str, path: str) -> str:
+        """Download one thumbnail if it is missing or has changed. Returns "downloaded" or "not_modified"."""
+        headers = self._conditional_headers(url, path)
+        with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+            if response.status_code == 304:
+                return "not_modified"
+            response.raise_for_status()
+
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp_path, "wb") as f:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        f.write(chunk)
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+            with self._lock:
+                self.validators[path] = {
+                    "url": url,
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                }
+        return "downloaded"
+
+    def fetch_all(self, jobs) -> dict:
+        """
+        Download every (url, path) pair with the worker pool, printing progress as each one finishes.
+
+        Returns:
+        - dict: The summary counts.
+        """
+        jobs = list(jobs)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {pool.submit(self.fetch, url, path): path for url, path in jobs}
+            for done, future in enumerate(as_completed(futures), start=1):
+                path = futures[future]
+                try:
+                    outcome = future.result()
+                except Exception as e:
+                    outcome = "failed"
+                    self.failures[path] = str(e)
+                self.summary[outcome] += 1
+                print(f"[{done}/{len(jobs)}] {outcome}: {path}")
+
+        self._save_validators()
+        print(f"Thumbnails: {self.summary['downloaded']} downloaded, {self.summary['not_modified']} unchanged, "
+              f"{self.summary['failed']} failed")
+        for path, error in self.failures.items():
+            print(f"Failed to download thumbnail {path}: {error}")
+        return self.summary
+
+
+class _StubThumbnailServer(BaseHTTPRequestHandler):
+    """Serves `thumbnails` {path: (bytes, etag)}, answering 304 to matching conditional requests."""
+
+    thumbnails = {}
+    last_modified = 0.0  # Time the thumbnails were last changed
+    bodies_sent = 0
+
+    def do_GET(self):
+        if self.path not in self.thumbnails:
+            self.send_error(404)
+            return
+        body, etag = self.thumbnails[self.path]
+        since = self.headers.get("If-Modified-Since")
+        if self.headers.get("If-None-Match") == etag or (
+                "If-None-Match" not in self.headers and since
+                and parsedate_to_datetime(since).timestamp() >= int(self.last_modified)):
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", formatdate(self.last_modified, usegmt=True))
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        type(self).bodies_sent += 1
+
+    def log_message(self, *args):
+        pass
+
+
+def _self_check(directory: str) -> list:
+    """Check conditional downloads against a stub server, as (check, passed, details)."""
+    checks = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubThumbnailServer)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    stub = _StubThumbnailServer
+    stub.thumbnails = {f"/{name}.png": (f"thumbnail {name}".encode(), f'"{name}-1"') for name in ("a", "b", "c")}
+    stub.last_modified = 1_000_000_000.0
+    jobs = [(f"{base}/{name}.png", os.path.join(directory, f"{name}.png")) for name in ("a", "b", "c", "missing")]
+    validators_path = os.path.join(directory, "validators.json")
+
+    def run():
+        before = stub.bodies_sent
+        with contextlib.redirect_stdout(io.StringIO()):
+            summary = ThumbnailFetcher(max_workers=4, validators_path=validators_path).fetch_all(jobs)
+        return summary, stub.bodies_sent - before
+
+    try:
+        summary, bodies = run()
+        contents_match = all(open(path, "rb").read() == stub.thumbnails[f"/{os.path.basename(path)}"][0]
+                             for _, path in jobs[:3])
+        leftovers = glob.glob(os.path.join(directory, "*.tmp"))
+        checks.append(("first run downloads", summary == {"downloaded": 3, "not_modified": 0, "failed": 1}
+                       and contents_match and not leftovers, {**summary, "temporary_files": len(leftovers)}))
+
+        summary, bodies = run()
+        checks.append(("unchanged are not downloaded", summary["not_modified"] == 3 and bodies == 0,
+                       {**summary, "bodies_sent": bodies}))
+
+        stub.thumbnails["/b.png"] = (b"thumbnail b, new", '"b-2"')
+        summary, bodies = run()
+        changed = open(jobs[1][1], "rb").read() == b"thumbnail b, new"
+        checks.append(("changed is downloaded again", summary["downloaded"] == 1 and bodies == 1 and changed,
+                       {**summary, "bodies_sent": bodies}))
+
+        # Thumbnails without validators, e.g. downloaded by hand, are checked against the file's age
+        os.remove(validators_path)
+        summary, bodies = run()
+        checks.append(("file age stands in for validators", summary["not_modified"] == 3 and bodies == 0,
+                       {**summary, "bodies_sent": bodies}))
+    finally:
+        server.shutdown()
+        server.server_close()
+    return checks
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directory:
+        checks = _self_check(directory)
+    for check, passed, details in checks:
+        print(f"{'ok' if passed else 'FAILED':<7}{check:<40}{details}")
+    sys.exit(0 if all(passed for _, passed, _ in checks) else 1)
@@ -0,0 +1,169 @@
+"""
+Pre-screening of videos on their thumbnails for 02-get-couch-image.py.
+
+Stage 02 downloads every full resolution video before it knows whether a couch is ever visible. The
+thumbnails fetched by 01-get-videos.py (and any storyboard images saved alongside them) are a cheap
+first look: the couch detector runs on those images, each video is scored by its most confident couch,
+and videos scoring below a threshold are skipped without downloading, while the rest are processed
+most promising first.
+
+Every decision is recorded with its confidence in data/thumbnail_prescreen.jsonl. Skipped videos never
+reach stage 02, so those decisions alone cannot show what a threshold misses. A backtest screens the
+thumbnails of videos stage 02 has already processed, where it is known whether the full video had a
+couch, and records them in data/thumbnail_backtest.jsonl. Running this file compares the confidences
+with those outcomes, showing how many downloads each threshold would save and how many couches it
+would miss:
+
+    python src/thumbnail_screen.py             # report on the videos screened so far
+    python src/thumbnail_screen.py --backtest  # screen the processed videos first (needs ultralytics)
+"""
+
+import argparse
+import glob
+import cv2
+from detection_engine import prefetched_batches
+from detection_store import DetectionStore
+from tracing import span, count
+
+PRESCREEN_PATH = "data/thumbnail_prescreen.jsonl"
+BACKTEST_PATH = "data/thumbnail_backtest.jsonl"
+MODEL_NAME = "kadirnar/Yolov10/yolov10n.pt"  # Detector of 02-get-couch-image.py
+IMAGE_PATTERNS = ("data/thumbnails/{video_id}.png", "data/storyboards/{video_id}_*.jpg")
+PRESCREEN_THRESHOLD = 0.25  # Videos whose images show no couch at this confidence are skipped
+# Lowest box confidence the model reports, well below any threshold, so low confidences are recorded
+# rather than cut to 0 by the model's default of 0.25
+MODEL_CONFIDENCE = 0.01
+BATCH_SIZE = 8
+QUEUE_SIZE = 16
+
+
+def screen_images(video_id: str, patterns=IMAGE_PATTERNS):
+    """Paths of the thumbnail and storyboard images saved for a video."""
+    return sorted(path for pattern in patterns for path in glob.glob(pattern.format(video_id=video_id)))
+
+
+def couch_confidence(result, image_shape, couch_class: str = 'couch'):
+    """Return (highest couch confidence, area of that box as a share of the image), or (0.0, 0.0)."""
+    best = (0.0, 0.0)
+    for box in result.boxes:
+        confidence = float(box.conf[0])
+        if result.names[int(box.cls[0])] == couch_class and confidence > best[0]:
+            x_min, y_min, x_max, y_max = map(int, box.xyxy[0])
+            best = (confidence, (x_max - x_min) * (y_max - y_min) / (image_shape[0] * image_shape[1]))
+    return best
+
+
+def _load_images(jobs):
+    for video_id, path in jobs:
+        image = cv2.imread(path)
+        if image is not None:
+            yield video_id, image
+
+
+def score_videos(model, video_ids, couch_class: str = 'couch', patterns=IMAGE_PATTERNS,
+                 batch_size: int = BATCH_SIZE, queue_size: int = QUEUE_SIZE) -> dict:
+    """Return {video_id: (highest couch confidence, its box ratio)} over each video's images, for videos with any."""
+    jobs = [(video_id, path) for video_id in video_ids for path in screen_images(video_id, patterns)]
+    scores = {}
+    for batch in prefetched_batches(_load_images(jobs), batch_size, queue_size):
+        with span("prescreen_batch", images=len(batch)):
+            results = model([image for _, image in batch], conf=MODEL_CONFIDENCE)
+        count("inferences", len(batch))
+        for (video_id, image), result in zip(batch, results):
+            scores[video_id] = max(scores.get(video_id, (0.0, 0.0)), couch_confidence(result, image.shape, couch_class))
+    return scores
+
+
+def prescreen_videos(model, video_ids, threshold: float = PRESCREEN_THRESHOLD, couch_class: str = 'couch',
+                     store: DetectionStore = None, model_name: str = None, patterns=IMAGE_PATTERNS,
+                     batch_size: int = BATCH_SIZE, queue_size: int = QUEUE_SIZE):
+    """
+    Score videos on their thumbnails and decide which to download.
+
+    Parameters:
+    - model: An ultralytics YOLO detection model.
+    - video_ids: Videos to screen.
+    - threshold (float): Lowest couch confidence for a video to be kept.
+    - store (DetectionStore): Where to record each decision, by default data/thumbnail_prescreen.jsonl.
+    - model_name (str): Recorded with each decision, as confidences differ between models.
+
+    Returns:
+    - tuple: (video IDs to process, most confident first with unscreened videos last, skipped video IDs)
+    """
+    if store is None:
+        store = DetectionStore(PRESCREEN_PATH, legacy_path=None)
+
+    scores = score_videos(model, video_ids, couch_class, patterns, batch_size, queue_size)
+
+    keep, skip = [], []
+    for video_id, (confidence, box_ratio) in scores.items():
+        decision = "keep" if confidence >= threshold else "skip"
+        (keep if decision == "keep" else skip).append(video_id)
+        store.put({"video_id": video_id, "decision": decision, "confidence": confidence,
+                   "box_ratio": box_ratio, "threshold": threshold, "model": model_name})
+
+    keep.sort(key=lambda video_id: scores[video_id][0], reverse=True)
+    unscreened = [video_id for video_id in video_ids if video_id not in scores]
+    print(f"Thumbnail pre-screen: keeping {len(keep)} videos, skipping {len(skip)}, "
+          f"{len(unscreened)} without thumbnails")
+    return keep + unscreened, skip
+
+
+def backtest(model, detections_path: str = None, backtest_path: str = BACKTEST_PATH, model_name: str = None,
+             couch_class: str = 'couch', patterns=IMAGE_PATTERNS):
+    """
+    Screen the thumbnails of videos stage 02 has already processed, recording their confidences in `backtest_path`.
+
+    Videos already backtested with the same model are not screened again.
+
+    Returns:
+    - int: Number of videos screened.
+    """
+    detections = DetectionStore(detections_path) if detections_path else DetectionStore()
+    store = DetectionStore(backtest_path, legacy_path=None)
+    video_ids = [record["video_id"] for record in detections.records()
+                 if record["video_id"] not in store or store.get(record["video_id"]).get("model") != model_name]
+    scores = score_videos(model, video_ids, couch_class, patterns)
+    for video_id, (confidence, box_ratio) in scores.items():
+        store.put({"video_id": video_id, "confidence": confidence, "box_ratio": box_ratio, "model": model_name,
+                   "model_confidence": MODEL_CONFIDENCE})
+    print(f"Backtest screened {len(scores)} processed videos, {len(video_ids) - len(scores)} without thumbnails")
+    return len(scores)
+
+
+def threshold_report(prescreen_paths=(PRESCREEN_PATH, BACKTEST_PATH), detections_path: str = None, thresholds=None):
+    """
+    Print, for a range of thresholds, the downloads that would be skipped and the couches that would be missed.
+
+    Only videos that have been both screened, by the pre-screen or a backtest, and fully processed by
+    stage 02 are counted. Where a video is in both, the later file (the backtest) wins.
+    """
+    detections = DetectionStore(detections_path) if detections_path else DetectionStore()
+    confidences = {}
+    for path in prescreen_paths:
+        for record in DetectionStore(path, legacy_path=None).records():
+            confidences[record["video_id"]] = record["confidence"]
+    outcomes = [(confidence, detections.get(video_id)["couch_detected"])
+                for video_id, confidence in confidences.items() if video_id in detections]
+    if not outcomes:
+        print("No pre-screened videos have been processed by stage 02 yet")
+        return
+
+    couches = sum(detected for _, detected in outcomes)
+    print(f"{len(outcomes)} videos, {couches} with a couch found in the full video")
+    print("threshold  skipped  missed couches")
+    for threshold in thresholds or (0.05, 0.1, 0.15, 0.2, 0.25, 0.3, 0.4, 0.5):
+        skipped = [detected for confidence, detected in outcomes if confidence < threshold]
+        print(f"{threshold:>9.2f}  {len(skipped):>7}  {sum(skipped):>14}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare thumbnail couch confidences with stage 02's results.")
+    parser.add_argument("--backtest", action="store_true", help="Screen the thumbnails of processed videos first")
+    parser.add_argument("--model", default=MODEL_NAME, help="Detector used for the backtest")
+    args = parser.parse_args()
+
+    if args.backtest:
+        from ultralytics import YOLO
+        backtest(YOLO(args.model), model_name=args.model)
+    threshold_report()
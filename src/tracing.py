@@ -0,0 +1,186 @@
+"""
+Span timings, counters and peak memory for the pipeline stages, exported as a Chrome trace.
+
+Tracing is off unless the PIPELINE_TRACE environment variable is set, e.g.
+
+    PIPELINE_TRACE=1 python src/02-get-couch-image.py
+    PIPELINE_TRACE=1 python src/pipeline.py          # every stage the runner starts is traced too
+
+When it is off, span() hands back one shared do-nothing context manager, count() returns at once and
+traced() leaves the decorated function untouched, so the instrumentation costs nothing.
+
+When it is on, every span becomes a complete event and every counter update a counter event, and at
+exit the run is written to data/traces/<script>-<time>.trace.json (or under the directory PIPELINE_TRACE
+names), which chrome://tracing and https://ui.perfetto.dev open directly. A table of the time spent in
+each span, the counter totals and the peak resident memory is printed and saved next to it.
+"""
+
+import atexit
+import asyncio
+import contextlib
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+TRACE_DIR = "data/traces"
+_setting = os.getenv("PIPELINE_TRACE", "")
+ENABLED = _setting not in ("", "0", "false", "False")
+
+_NULL_SPAN = contextlib.nullcontext()
+_events = []
+_counters = {}
+_lock = threading.Lock()
+_started = time.perf_counter_ns()
+_peak_rss = 0
+
+
+def _now_us() -> float:
+    return (time.perf_counter_ns() - _started) / 1000
+
+
+def _track() -> int:
+    """Trace thread of the caller. Each asyncio task gets its own, so overlapping requests do not interleave."""
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    return id(task) if task is not None else threading.get_ident()
+
+
+def peak_rss_bytes() -> int:
+    """Peak resident set size of this process so far, or 0 where it cannot be read."""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # Bytes on macOS, kilobytes elsewhere
+
+
+def _record_rss():
+    global _peak_rss
+    peak = peak_rss_bytes()
+    if peak > _peak_rss:
+        _peak_rss = peak
+        _events.append({"name": "peak_rss_mb", "ph": "C", "ts": _now_us(), "pid": os.getpid(),
+                        "args": {"peak_rss_mb": round(peak / 1024 ** 2, 1)}})
+
+
+class _Span:
+    __slots__ = ("name", "args", "start")
+
+    def __init__(self, name: str, args: dict):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = _now_us()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = _now_us()
+        event = {"name": self.name, "ph": "X", "ts": self.start, "dur": end - self.start, "pid": os.getpid(),
+                 "tid": _track()}
+        if self.args:
+            event["args"] = self.args
+        _events.append(event)
+        _record_rss()
+        return False
+
+
+def span(name: str, **args):
+    """
+    Context manager timing a block as a span called `name`. Keyword arguments are shown with the span.
+
+    Returns a shared no-op context manager when tracing is off.
+    """
+    if not ENABLED:
+        return _NULL_SPAN
+    return _Span(name, args)
+
+
+def traced(name: str = None):
+    """Decorator timing every call of a function as a span, named after the function by default."""
+    def decorate(function):
+        if not ENABLED:
+            return function
+        span_name = name or function.__name__
+
+        if asyncio.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                with _Span(span_name, None):
+                    return await function(*args, **kwargs)
+        else:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with _Span(span_name, None):
+                    return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count(name: str, value=1):
+    """Add `value` to the counter `name`. Does nothing when tracing is off."""
+    if not ENABLED:
+        return
+    with _lock:
+        total = _counters[name] = _counters.get(name, 0) + value
+    _events.append({"name": name, "ph": "C", "ts": _now_us(), "pid": os.getpid(), "args": {name: total}})
+
+
+def summary() -> dict:
+    """Per span name: calls, total, mean and max milliseconds; plus counter totals and peak RSS in MB."""
+    spans = {}
+    for event in list(_events):
+        if event["ph"] != "X":
+            continue
+        stats = spans.setdefault(event["name"], {"calls": 0, "total_ms": 0.0, "max_ms": 0.0})
+        stats["calls"] += 1
+        stats["total_ms"] += event["dur"] / 1000
+        stats["max_ms"] = max(stats["max_ms"], event["dur"] / 1000)
+    for stats in spans.values():
+        stats["mean_ms"] = stats["total_ms"] / stats["calls"]
+    return {"spans": spans, "counters": dict(_counters), "peak_rss_mb": round(peak_rss_bytes() / 1024 ** 2, 1),
+            "wall_ms": _now_us() / 1000}
+
+
+def format_summary(stats: dict) -> str:
+    """The summary as a plain text table, spans ordered by total time."""
+    lines = [f"{'span':<28}{'calls':>8}{'total ms':>12}{'mean ms':>11}{'max ms':>11}"]
+    for name, span_stats in sorted(stats["spans"].items(), key=lambda item: -item[1]["total_ms"]):
+        lines.append(f"{name:<28}{span_stats['calls']:>8}{span_stats['total_ms']:>12.1f}"
+                     f"{span_stats['mean_ms']:>11.2f}{span_stats['max_ms']:>11.2f}")
+    for name, total in sorted(stats["counters"].items()):
+        lines.append(f"{name:<28}{total:>8}")
+    lines.append(f"wall time {stats['wall_ms'] / 1000:.1f}s, peak RSS {stats['peak_rss_mb']:.1f} MB")
+    return "\n".join(lines)
+
+
+def write_report(trace_dir: str = None) -> str:
+    """Write the Chrome trace and summary table of this run and print the table. Returns the trace path."""
+    if trace_dir is None:
+        trace_dir = TRACE_DIR if _setting in ("1", "true", "True") else _setting
+    script = os.path.splitext(os.path.basename(sys.argv[0] or "python"))[0] or "python"
+    base = os.path.join(trace_dir, f"{script}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+    stats = summary()
+    table = format_summary(stats)
+
+    os.makedirs(trace_dir, exist_ok=True)
+    metadata = [{"name": "process_name", "ph": "M", "pid": os.getpid(), "args": {"name": script}}]
+    with open(f"{base}.trace.json", "w") as f:
+        json.dump({"traceEvents": metadata + list(_events), "displayTimeUnit": "ms", "otherData": stats}, f)
+    with open(f"{base}.summary.txt", "w") as f:
+        f.write(table + "\n")
+    print(f"Trace written to {base}.trace.json\n{table}")
+    return f"{base}.trace.json"
+
+
+if ENABLED:
+    atexit.register(write_report)